@@ -1,7 +1,23 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, g, render_template, request, jsonify
+from oe10_calibration import DEFAULT_FILE, SpeedTable, unit_key
 from oe10_protocol import OE10Protocol
+import oe10_codec
+import oe10_metrics
+import oe10_motion
+from oe10_daemon import DeviceClient
+from oe10_joystick import JoystickController
+from oe10_journal import Journal
+from oe10_link import LINK_DOWN, SerialLink
+from oe10_poller import StatusPoller
+from oe10_scheduler import CommandScheduler, PRIORITY_STOP, PRIORITY_MOTION, PRIORITY_STATUS
+from oe10_trajectory import PositionUnknown, TrajectoryBusy, TrajectoryRunner, build_pattern
+import atexit
+import json
 import logging
+import os
 import sys
+import threading
+import time
 
 # Configure logging to show on console
 logging.basicConfig(
@@ -15,22 +31,258 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
-# Global controller variable
+# Serial device or pyserial URL (e.g. socket://localhost:7777 for oe10_simulator)
+SERIAL_PORT = os.environ.get('OE10_PORT', '/dev/ttyAMA0')
+# Finds the adapter when it comes back under another name after a replug:
+# USB id ("0403:6001"), serial number or description (see oe10_link)
+PORT_MATCH = os.environ.get('OE10_PORT_MATCH')
+# Longest wait for the link on the very first request after startup
+LINK_STARTUP_WAIT = 2.0
+
+# Status is sampled by one background poller and shared by all clients
+POLL_INTERVAL = float(os.environ.get('OE10_POLL_INTERVAL', '0.5'))  # seconds
+STATUS_MAX_AGE = float(os.environ.get('OE10_STATUS_MAX_AGE', '2.0'))  # seconds
+STREAM_MAX_RATE = float(os.environ.get('OE10_STREAM_MAX_RATE', '10'))  # updates/s per client
+COMMAND_TIMEOUT = float(os.environ.get('OE10_COMMAND_TIMEOUT', '5.0'))  # seconds
+# Joystick: PC commands per second at most, and seconds without a setpoint
+# before the head is stopped
+JOYSTICK_RATE = float(os.environ.get('OE10_JOYSTICK_RATE', '20'))
+JOYSTICK_DEADMAN = float(os.environ.get('OE10_JOYSTICK_DEADMAN', '0.5'))
+# "reliable" sends each command once, "compat" replays the vendor GUI sequence
+PROTOCOL_MODE = os.environ.get('OE10_PROTOCOL_MODE', 'reliable')
+# Record all serial traffic to binary journal files in this directory (see
+# oe10_journal.py)
+JOURNAL_DIR = os.environ.get('OE10_JOURNAL_DIR')
+# With a socket set, the device is owned by oe10_daemon.py and this process
+# (or each of several WSGI workers) is a client of it
+DAEMON_SOCKET = os.environ.get('OE10_DAEMON_SOCKET')
+# Per-command and per-route counters and histograms served on /metrics,
+# 0 turns recording off
+METRICS_ENABLED = os.environ.get('OE10_METRICS', '1') != '0'
+oe10_metrics.REGISTRY.enabled = METRICS_ENABLED
+# Calibrated axis rates per unit (python oe10_calibration.py calibrate),
+# nominal rates are used for units without a table
+SPEED_TABLE = os.environ.get('OE10_SPEED_TABLE', DEFAULT_FILE)
+
+# Global controller, the I/O thread that owns its port, and status poller,
+# or the daemon client that stands in for all three. The link thread opens
+# the controller and reconnects it (see oe10_link).
+link = None
 controller = None
+scheduler = None
+poller = None
+daemon = None
+joystick = None
+trajectory = None
+journal = None
+# Held while the globals above are created on first use, the threaded
+# server may run several first requests at once
+init_lock = threading.Lock()
+
+# Device identity (versions, supported axes), loaded once in the background
+identity = None
+
+# Speed table of the unit, for trajectory planning
+speed_table = None
 
 def init_controller():
-    """Initialize the OE10 controller with error handling"""
-    global controller
+    """Start the device connection, True while the device can be used
+
+    Does no I/O: the link thread opens and reopens the port, so requests
+    made while the device is away fail at once. Only the first call waits
+    up to LINK_STARTUP_WAIT for the initial connection.
+    """
+    global poller, daemon, journal, speed_table, link
     try:
-        if controller is None:
-            logger.info("Initializing OE10 controller...")
-            controller = OE10Protocol(port='/dev/ttyAMA0')  # Explicitly specify port
-            logger.info("OE10 controller initialized successfully")
-        return True
+        with init_lock:
+            if speed_table is None:
+                unit = unit_key(SERIAL_PORT, oe10_codec.PERIPHERAL_ID)
+                speed_table = SpeedTable.load(SPEED_TABLE, unit) or SpeedTable.nominal()
+            if DAEMON_SOCKET:
+                if daemon is None:
+                    daemon = DeviceClient(DAEMON_SOCKET, timeout=COMMAND_TIMEOUT)
+                    poller = daemon.poller()
+                    logger.info(f"Using OE10 device daemon at {DAEMON_SOCKET}")
+                    load_identity_async()
+                return True
+            started = link is None
+            if started:
+                logger.info(f"Connecting to OE10 on {SERIAL_PORT}...")
+                if JOURNAL_DIR and journal is None:
+                    journal = Journal(JOURNAL_DIR).start()
+                link = SerialLink(SERIAL_PORT, open_controller, match=PORT_MATCH,
+                                  on_up=link_up, on_down=link_down).start()
+        # Outside the lock, later requests answer at once with the link state
+        return link.wait_up(LINK_STARTUP_WAIT) if started else link.is_up
     except Exception as e:
         logger.error(f"Failed to initialize OE10 controller: {str(e)}")
         return False
 
+def open_controller(port):
+    """First connection of the link thread"""
+    opened = OE10Protocol(port=port, mode=PROTOCOL_MODE, journal=journal)
+    opened.set_speed_table(speed_table)
+    return opened
+
+def link_up(opened, reconnect):
+    """Called by the link thread after the handshake, before requests see the link up"""
+    global controller, scheduler, poller, identity
+    controller = opened
+    if scheduler is None:
+        scheduler = CommandScheduler()
+        scheduler.start()
+        poller = StatusPoller(device(PRIORITY_STATUS), interval=POLL_INTERVAL,
+                              max_age=STATUS_MAX_AGE)
+        poller.start()
+        logger.info("OE10 controller initialized successfully")
+    else:
+        poller.invalidate()
+    # The unit may have been swapped or updated while it was away
+    identity = None
+    load_identity_async()
+
+def link_down(opened, reason):
+    """Called by the link thread after the port was closed"""
+    if trajectory:
+        # Its commands would fail one by one, a stop cannot be sent either
+        trajectory.abort(stop=False)
+    if poller:
+        poller.invalidate()
+
+def raw_unavailable():
+    """Reply to the raw frame debug routes, the daemon only serves the public API"""
+    return jsonify({"success": False,
+                    "error": "Raw commands are not available through the device daemon"})
+
+def not_ready():
+    """Reply to device requests while the link is not up"""
+    status = link.status() if link else {"state": LINK_DOWN}
+    return jsonify({"success": False, "error": f"Serial link is {status['state']}",
+                    "link": status})
+
+def device(priority=PRIORITY_MOTION):
+    """Controller proxy whose calls run on the scheduler's I/O thread
+
+    Request threads never touch the port directly. Calls wait in their
+    priority lane (stop, motion, status) and give up after COMMAND_TIMEOUT.
+    """
+    if daemon is not None:
+        return daemon.proxy(priority, timeout=COMMAND_TIMEOUT)
+    return scheduler.proxy(controller, priority, timeout=COMMAND_TIMEOUT)
+
+def get_joystick():
+    """Joystick controller, created on first use
+
+    With the daemon it is the daemon's joystick, shared by all workers.
+    """
+    global joystick
+    with init_lock:
+        if joystick is None and daemon is not None:
+            joystick = daemon.joystick()
+        elif joystick is None:
+            joystick = JoystickController(device(), device(PRIORITY_STOP), rate=JOYSTICK_RATE,
+                                          deadman=JOYSTICK_DEADMAN, on_command=poller.invalidate)
+        return joystick
+
+def get_trajectory():
+    """Trajectory runner, created on first use
+
+    With the daemon it is the daemon's runner, shared by all workers.
+    """
+    global trajectory
+    with init_lock:
+        if trajectory is None and daemon is not None:
+            trajectory = daemon.trajectory()
+        elif trajectory is None:
+            trajectory = TrajectoryRunner(device(), device(PRIORITY_STOP),
+                                          read_position=device(PRIORITY_STATUS).get_pan_tilt_status,
+                                          on_command=poller.invalidate, table=speed_table)
+        return trajectory
+
+def device_identity():
+    """Device identity, read from the device on first use only
+
+    The controller caches it for the session, so only the first call (or
+    the first one after a reconnect) costs serial transactions.
+    """
+    global identity
+    if identity is None:
+        identity = device(PRIORITY_STATUS).get_identity()
+    return identity
+
+def load_identity_async():
+    """Warm the identity cache without holding up the caller"""
+    def load():
+        try:
+            device_identity()
+        except Exception as e:
+            logger.warning(f"Could not read device identity: {e}")
+    threading.Thread(target=load, name="oe10-identity", daemon=True).start()
+
+def estimate_position(at=None):
+    """Interpolated position without serial traffic
+
+    Args:
+        at (float): Unix time to estimate for, defaults to now
+    """
+    monotonic = None if at is None else time.monotonic() - (time.time() - at)
+    return (daemon or controller).estimate_position(monotonic)
+
+def polled_position():
+    """Latest position from the status poller, for arrival detection"""
+    snapshot = poller.wait(timeout=2 * POLL_INTERVAL)
+    return snapshot.data if snapshot else None
+
+def shutdown_controller():
+    """Stop the poller and I/O thread and close the serial port"""
+    global link, controller, scheduler, poller, daemon, identity, joystick, trajectory, journal
+    identity = None
+    if link:
+        link.stop(timeout=2)
+        link = None
+    if trajectory:
+        if daemon is None:
+            # A run in the daemon belongs to all workers and outlives this one
+            trajectory.abort()
+            trajectory.wait(timeout=2)
+        trajectory = None
+    if joystick:
+        if daemon is None:
+            joystick.stop(timeout=2)
+        joystick = None
+    if daemon:
+        daemon.close()
+        daemon = None
+        poller = None
+    if poller:
+        poller.stop(timeout=2)
+        poller = None
+    if scheduler:
+        scheduler.stop(timeout=COMMAND_TIMEOUT)
+        scheduler = None
+    if controller:
+        controller.close()
+        controller = None
+    if journal:
+        journal.close()
+        journal = None
+
+atexit.register(shutdown_controller)
+
+@app.before_request
+def start_timer():
+    g.started = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    """Request duration per route template, so ids in URLs add no series"""
+    started = g.pop('started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        oe10_metrics.HTTP_DURATION.observe(time.perf_counter() - started, route,
+                                           request.method, str(response.status_code))
+    return response
+
 @app.route('/')
 def index():
     """Render the main control interface"""
@@ -39,14 +291,16 @@ def index():
                              error="Failed to initialize device connection. Check serial port and device.")
     
     try:
-        status = controller.get_status()
-        protocol_version = controller.get_protocol_version()
-        software_version = controller.get_software_version()
+        # Render from cached state only, the page hydrates live values from
+        # /api/versions and the status stream once it is loaded
+        snapshot = poller.snapshot()
+        status = snapshot.as_dict() if snapshot else None
+        cached = identity or {}
         
         return render_template('index.html', 
                              status=status,
-                             protocol_version=protocol_version,
-                             software_version=software_version)
+                             protocol_version=cached.get('protocol_version'),
+                             software_version=cached.get('software_version'))
     except Exception as e:
         logger.error(f"Error in index route: {e}")
         return render_template('index.html', error=str(e))
@@ -55,36 +309,101 @@ def index():
 def get_status():
     """Get current device status"""
     if not init_controller():
-        return jsonify({"success": False, "error": "Device not initialized"})
+        return not_ready()
     
     try:
-        status = controller.get_status()
-        if status is None:
-            logger.warning("Failed to get status from device")
+        # Only waits if the snapshot was just invalidated by a motion command
+        snapshot = poller.wait(timeout=2 * POLL_INTERVAL)
+        if snapshot is None:
+            logger.warning("No recent status from device")
             return jsonify({"success": False, "error": "No status available"})
-        return jsonify({"success": True, "status": status})
+        return jsonify({"success": True, "status": snapshot.as_dict()})
     except Exception as e:
         logger.error(f"Error getting status: {e}")
         return jsonify({"success": False, "error": str(e)})
 
+@app.route('/api/position')
+def get_position():
+    """Estimated position, interpolated between status replies
+
+    Costs no serial traffic, so it can be read at any rate. ?at=<unix time>
+    estimates for another moment, e.g. the capture time of a camera frame.
+    """
+    if not init_controller():
+        return not_ready()
+    
+    try:
+        estimate = estimate_position(request.args.get('at', type=float))
+        return jsonify({"success": True, "position": estimate})
+    except Exception as e:
+        logger.error(f"Error estimating position: {e}")
+        return jsonify({"success": False, "error": str(e)})
+
+@app.route('/api/stream')
+def status_stream():
+    """Push status changes to the browser as Server-Sent Events
+
+    Every subscriber reads from the shared poller, so connected clients
+    add no serial traffic. ?max_rate=N limits a client to N updates per
+    second (capped at OE10_STREAM_MAX_RATE).
+    """
+    if not init_controller():
+        return not_ready()
+    
+    max_rate = request.args.get('max_rate', STREAM_MAX_RATE, type=float)
+    max_rate = min(max(max_rate, 0.1), STREAM_MAX_RATE)
+    source = poller
+    
+    def generate():
+        for delta in source.updates(min_interval=1.0 / max_rate):
+            if delta is None:
+                yield ": keepalive\n\n"
+            else:
+                yield f"id: {delta['sequence']}\ndata: {json.dumps(delta)}\n\n"
+    
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/move', methods=['POST'])
 def move():
-    """Handle absolute position movement"""
+    """Handle absolute position movement
+
+    Sends one GL (pan and tilt) or PP/TP command. With "deadline" (seconds)
+    DS/TA are first set to the lowest speeds that arrive in time according
+    to the speed table. The reply includes the predicted duration. With
+    "wait": true the request blocks until the polled position is within
+    "tolerance" degrees of the target or "timeout" seconds pass. The
+    timeout defaults to the prediction plus a margin.
+    """
     if not init_controller():
-        return jsonify({"success": False, "error": "Device not initialized"})
+        return not_ready()
     
     try:
         data = request.get_json()
         pan = float(data.get('pan')) if data.get('pan') is not None else None
         tilt = float(data.get('tilt')) if data.get('tilt') is not None else None
         
-        success = True
-        if pan is not None:
-            success &= controller.move_pan_to(pan)
-        if tilt is not None:
-            success &= controller.move_tilt_to(tilt)
-            
-        return jsonify({"success": success})
+        if data.get('deadline') is not None:
+            predicted = device().move_within(pan, tilt, float(data['deadline']))
+            success = predicted is not None
+        else:
+            predicted = (daemon or controller).predict_move(pan, tilt)
+            success = oe10_motion.start_move(device(), pan, tilt)
+        poller.invalidate()
+        if not success or not data.get('wait'):
+            return jsonify({"success": success, "predicted": predicted})
+        
+        timeout = data.get('timeout')
+        if timeout is None:
+            timeout = 30.0 if predicted is None else 1.5 * predicted + 2.0
+        result = oe10_motion.wait_for_position(
+            polled_position, pan, tilt,
+            tolerance=float(data.get('tolerance', 1.0)),
+            timeout=float(timeout),
+            poll_interval=POLL_INTERVAL / 2
+        )
+        return jsonify({"success": result.arrived, "predicted": predicted,
+                        "result": result._asdict()})
     except Exception as e:
         logger.error(f"Error in move: {e}")
         return jsonify({"success": False, "error": str(e)})
@@ -93,30 +412,114 @@ def move():
 def proportional_control():
     """Handle proportional control movement"""
     if not init_controller():
-        return jsonify({"success": False, "error": "Device not initialized"})
+        return not_ready()
     
     try:
         data = request.get_json()
-        success = controller.proportional_control(
+        success = device().proportional_control(
             pan_direction=int(data.get('pan_direction', 0)),
             tilt_direction=int(data.get('tilt_direction', 0)),
             pan_speed=int(data.get('pan_speed', 50)),
             tilt_speed=int(data.get('tilt_speed', 50))
         )
+        poller.invalidate()
         return jsonify({"success": success})
     except Exception as e:
         logger.error(f"Error in proportional control: {e}")
         return jsonify({"success": False, "error": str(e)})
 
+@app.route('/api/joystick', methods=['GET', 'POST'])
+def joystick_control():
+    """Continuous jogging with velocity setpoints
+
+    POST {"pan": -50, "tilt": 0} (-100..100, + = right/up) as often as the
+    input changes, or stream setpoints as chunked application/x-ndjson, one
+    per line (the head stops when the stream ends). Setpoints return
+    immediately; the joystick thread sends a PC command only when the
+    velocity changes and stops the head when setpoints stop arriving for
+    OE10_JOYSTICK_DEADMAN seconds. GET returns the joystick counters.
+    """
+    if not init_controller():
+        return not_ready()
+    
+    try:
+        stick = get_joystick()
+        if request.method == 'GET':
+            return jsonify({"success": True, "joystick": stick.stats()})
+        
+        if request.mimetype == 'application/x-ndjson':
+            count = 0
+            try:
+                for line in request.stream:
+                    if line.strip():
+                        setpoint = json.loads(line)
+                        stick.update(float(setpoint.get('pan', 0)), float(setpoint.get('tilt', 0)))
+                        count += 1
+            finally:
+                stick.release()
+            return jsonify({"success": True, "setpoints": count})
+        
+        data = request.get_json()
+        stick.update(float(data.get('pan', 0)), float(data.get('tilt', 0)))
+        return jsonify({"success": True})
+    except Exception as e:
+        logger.error(f"Error in joystick control: {e}")
+        return jsonify({"success": False, "error": str(e)})
+
+@app.route('/api/trajectory', methods=['GET', 'POST', 'DELETE'])
+def trajectory_control():
+    """Planned scan patterns
+
+    POST a pattern to start a run from the current position, e.g.
+    {"pattern": "raster", "pan": [60, 120], "tilt": [10, 40], "rows": 4,
+    "speed": 80}, {"pattern": "spiral", "pan": 90, "tilt": 30, "radius": 15}
+    or {"pattern": "waypoints", "points": [{"pan": 10, "tilt": 20, "dwell": 2}]}
+    (see oe10_trajectory.build_pattern). GET returns the progress of the
+    current or last run and DELETE aborts it and stops the head.
+    """
+    if not init_controller():
+        return not_ready()
+    
+    try:
+        runner = get_trajectory()
+        if request.method == 'GET':
+            return jsonify({"success": True, "trajectory": runner.progress()})
+        if request.method == 'DELETE':
+            return jsonify({"success": runner.abort()})
+        
+        data = request.get_json()
+        planned = runner.start(build_pattern(data), speed=int(data.get('speed', 100)))
+        return jsonify({"success": True, "steps": len(planned.steps),
+                        "planned_duration": round(planned.duration, 3)})
+    except TrajectoryBusy as e:
+        return jsonify({"success": False, "error": str(e)}), 409
+    except PositionUnknown as e:
+        logger.warning(f"Trajectory not started: {e}")
+        return jsonify({"success": False, "error": str(e)}), 503
+    except Exception as e:
+        logger.error(f"Error in trajectory: {e}")
+        return jsonify({"success": False, "error": str(e)})
+
 @app.route('/api/stop', methods=['POST'])
 def stop():
     """Stop all movement"""
     if not init_controller():
-        return jsonify({"success": False, "error": "Device not initialized"})
+        return not_ready()
     
     try:
-        pan_stop = controller.pan_stop()
-        tilt_stop = controller.tilt_stop()
+        # With the daemon another worker may have started them, so they
+        # are always released there
+        stick = get_joystick() if daemon is not None else joystick
+        runner = get_trajectory() if daemon is not None else trajectory
+        if stick:
+            # Otherwise a held direction would be resent after the stop
+            stick.release()
+        if runner:
+            # The stop below covers the head
+            runner.abort(stop=False)
+        pan_stop = device(PRIORITY_STOP).pan_stop()
+        tilt_stop = device(PRIORITY_STOP).tilt_stop()
+        poller.invalidate()
         return jsonify({"success": pan_stop and tilt_stop})
     except Exception as e:
         logger.error(f"Error stopping movement: {e}")
@@ -126,26 +529,63 @@ def stop():
 def get_versions():
     """Get protocol and software versions"""
     if not init_controller():
-        return jsonify({"success": False, "error": "Device not initialized"})
+        return not_ready()
     
     try:
-        return jsonify({
-            "success": True,
-            "protocol_version": controller.get_protocol_version(),
-            "software_version": controller.get_software_version()
-        })
+        info = device_identity()
+        if info is None:
+            return jsonify({"success": False, "error": "Device did not report its versions"})
+        return jsonify(dict(info, success=True))
     except Exception as e:
         logger.error(f"Error getting versions: {e}")
         return jsonify({"success": False, "error": str(e)})
 
+@app.route('/api/scheduler')
+def scheduler_metrics():
+    """Queue depth and wait times of the serial I/O thread per priority lane"""
+    if not init_controller():
+        return not_ready()
+    
+    try:
+        return jsonify({"success": True, "lanes": (daemon or scheduler).metrics()})
+    except Exception as e:
+        logger.error(f"Error getting scheduler metrics: {e}")
+        return jsonify({"success": False, "error": str(e)})
+
+@app.route('/api/link')
+def get_link():
+    """State of the serial link, answered whether or not it is up"""
+    if DAEMON_SOCKET:
+        try:
+            init_controller()
+            return jsonify({"success": True, "link": daemon.link_status()})
+        except Exception as e:
+            return jsonify({"success": False, "error": str(e)})
+    init_controller()
+    return jsonify({"success": True, "link": link.status() if link else {"state": LINK_DOWN}})
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics: serial commands, scheduler lanes and HTTP routes"""
+    if not METRICS_ENABLED:
+        return Response("Metrics are disabled\n", status=404, mimetype='text/plain')
+    if daemon is not None:
+        # The serial side lives in the daemon process
+        try:
+            text = daemon.metrics_text()
+        except Exception as e:
+            logger.error(f"Error getting daemon metrics: {e}")
+            text = ""
+        text += oe10_metrics.REGISTRY.render([oe10_metrics.HTTP_DURATION])
+    else:
+        text = oe10_metrics.REGISTRY.render()
+    return Response(text, content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/api/shutdown', methods=['POST'])
 def shutdown():
     """Shutdown the application and cleanup resources"""
-    global controller
     try:
-        if controller:
-            controller.close()
-            controller = None
+        shutdown_controller()
         func = request.environ.get('werkzeug.server.shutdown')
         if func is None:
             raise RuntimeError('Not running with the Werkzeug Server')
@@ -155,31 +595,26 @@ def shutdown():
         logger.error(f"Error during shutdown: {e}")
         return jsonify({"success": False, "error": str(e)})
 
-@app.teardown_appcontext
-def cleanup(error):
-    """Ensure proper cleanup on shutdown"""
-    global controller
-    if controller:
-        controller.close()
-        controller = None
-
 @app.route('/api/debug_command', methods=['POST'])
 def debug_command():
     """Send a raw command for debugging"""
     if not init_controller():
-        return jsonify({"success": False, "error": "Device not initialized"})
+        return not_ready()
+    if daemon:
+        return raw_unavailable()
     
     try:
         data = request.get_json()
         command = data.get('command')
         params = data.get('params', '')
         
-        response = controller._send_command(command, params)
+        response = device()._send_command(command, params)
+        poller.invalidate()
         return jsonify({
             "success": True,
             "sent_command": command,
             "sent_params": params,
-            "response": response
+            "response": response.raw.hex(' ') if response else None
         })
     except Exception as e:
         logger.error(f"Error in debug command: {e}")
@@ -189,7 +624,9 @@ def debug_command():
 def test_capture():
     """Test exact captured commands"""
     if not init_controller():
-        return jsonify({"success": False, "error": "Device not initialized"})
+        return not_ready()
+    if daemon:
+        return raw_unavailable()
     
     try:
         data = request.get_json()
@@ -199,20 +636,21 @@ def test_capture():
         if direction == 'up':
             cmd_data = "08001E00"
         elif direction == 'down':
-            cmd_data = "0400280"
+            cmd_data = "04002800"
         elif direction == 'left':
-            cmd_data = "023200000"
+            cmd_data = "02320000"
         elif direction == 'right':
-            cmd_data = "013200000"
+            cmd_data = "01320000"
         else:  # stop
             cmd_data = "00000000"
             
-        response = controller._send_command("PC", cmd_data)
+        response = device()._send_command("PC", cmd_data)
+        poller.invalidate()
         return jsonify({
             "success": True,
             "direction": direction,
             "data_sent": cmd_data,
-            "response": response
+            "response": response.raw.hex(' ') if response else None
         })
     except Exception as e:
         logger.error(f"Error in test capture: {e}")
@@ -230,6 +668,5 @@ if __name__ == '__main__':
         app.run(host='0.0.0.0', port=5000, debug=True)
     except Exception as e:
         logger.error(f"Failed to start server: {str(e)}")
-        if controller:
-            controller.close()
+        shutdown_controller()
         sys.exit(1) 
\ No newline at end of file
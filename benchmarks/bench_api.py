@@ -0,0 +1,64 @@
+"""Flask endpoints under concurrent clients, backed by the simulator"""
+import json
+import logging
+import os
+import threading
+import time
+import urllib.request
+
+from werkzeug.serving import make_server
+
+from oe10_simulator import PtySimulator
+
+from benchmarks.common import summarize
+
+
+def _client(url, requests, samples, errors):
+    for _ in range(requests):
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(url, timeout=10) as response:
+                if not json.load(response).get("success"):
+                    errors.append(1)
+        except Exception:
+            errors.append(1)
+        samples.append(time.perf_counter() - started)
+
+
+def run(quick=False, concurrency=(1, 4, 16), routes=("/api/status", "/api/versions")):
+    requests = 10 if quick else 100
+    sim = PtySimulator().start()
+    os.environ["OE10_PORT"] = sim.port
+    import app as webapp
+    logging.getLogger().setLevel(logging.WARNING)
+    # werkzeug sets its own level and would log every request
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    server = make_server("127.0.0.1", 0, webapp.app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base = f"http://127.0.0.1:{server.server_port}"
+
+    results = []
+    try:
+        webapp.init_controller()
+        webapp.poller.wait(timeout=5)
+        for route in routes:
+            for clients in concurrency:
+                samples, errors = [], []
+                workers = [threading.Thread(target=_client,
+                                            args=(base + route, requests, samples, errors))
+                           for _ in range(clients)]
+                started = time.perf_counter()
+                for worker in workers:
+                    worker.start()
+                for worker in workers:
+                    worker.join()
+                results.append(summarize(f"GET {route} x{clients} clients", samples,
+                                         elapsed=time.perf_counter() - started,
+                                         clients=clients, errors=len(errors)))
+    finally:
+        server.shutdown()
+        webapp.shutdown_controller()
+        sim.stop()
+    return results
@@ -0,0 +1,27 @@
+"""Encode cost of frames and checksums"""
+import oe10_codec
+from oe10_codec import PAN_LEFT, TILT_DOWN
+from oe10_protocol import OE10Protocol
+
+from benchmarks.common import summarize, time_batches
+
+
+def run(quick=False):
+    batches = 10 if quick else 50
+    # _build_packet is called on an instance without opening a port
+    protocol = OE10Protocol.__new__(OE10Protocol)
+    protocol.CONTROLLER_ID = oe10_codec.CONTROLLER_ID
+    protocol.PERIPHERAL_ID = oe10_codec.PERIPHERAL_ID
+    pc_data = oe10_codec.encode_data("PC", PAN_LEFT, 0x32, 0)
+    body = oe10_codec.fixed_frame("ST")[1:-5]
+
+    cases = [
+        ("codec.encode ST (cached)", lambda: oe10_codec.encode("ST")),
+        ("codec.encode PC", lambda: oe10_codec.encode("PC", TILT_DOWN, 0, 0x1E)),
+        ("codec.encode PP", lambda: oe10_codec.encode("PP", 270)),
+        ("codec.encode GL", lambda: oe10_codec.encode("GL", 20, 65)),
+        ("codec.checksum ST body", lambda: oe10_codec.checksum(body)),
+        ("OE10Protocol._build_packet ST", lambda: protocol._build_packet("ST")),
+        ("OE10Protocol._build_packet PC", lambda: protocol._build_packet("PC", pc_data)),
+    ]
+    return [summarize(name, time_batches(func, batches)) for name, func in cases]
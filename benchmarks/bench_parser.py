@@ -0,0 +1,73 @@
+"""Response parsing, including replay of the vendor capture in hexdump.txt"""
+import time
+
+from oe10_hexdump import capture_stats, iter_chunks, iter_frames
+from oe10_parser import FrameParser, decode_status, decode_pan_tilt_status
+
+from benchmarks.common import HEXDUMP, load_hexdump, summarize
+
+
+def _replay(chunks, rounds):
+    """Feed capture chunks through one parser, returns (samples, frames, seconds)"""
+    samples = []
+    frames = 0
+    perf = time.perf_counter
+    started = perf()
+    for _ in range(rounds):
+        parser = FrameParser()
+        round_started = perf()
+        count = 0
+        for chunk in chunks:
+            count += len(parser.feed(chunk))
+        elapsed = perf() - round_started
+        samples.append(elapsed / count)
+        frames += count
+    return samples, frames, perf() - started
+
+
+def run(quick=False):
+    rounds = 50 if quick else 500
+    capture = load_hexdump()
+    rx_chunks = [data for direction, data in capture if direction == "rx"]
+    all_chunks = [data for _, data in capture]
+    stream = b"".join(all_chunks)
+    single_bytes = [stream[i:i + 1] for i in range(len(stream))]
+
+    results = []
+    for name, chunks, count in (
+        ("parser hexdump replay (captured reads)", rx_chunks, rounds),
+        ("parser hexdump replay (whole capture)", [stream], rounds),
+        ("parser hexdump replay (byte at a time)", single_bytes, max(1, rounds // 10)),
+    ):
+        samples, frames, elapsed = _replay(chunks, count)
+        results.append(summarize(name, samples, operations=frames, elapsed=elapsed, unit="frame"))
+
+    with open(HEXDUMP) as capture:
+        lines = capture.readlines()
+    samples = []
+    frames = 0
+    perf = time.perf_counter
+    started = perf()
+    for _ in range(max(1, rounds // 10)):
+        round_started = perf()
+        stats = capture_stats(iter_frames(iter_chunks(lines)))
+        count = sum(stats.commands.values())
+        samples.append((perf() - round_started) / count)
+        frames += count
+    results.append(summarize("hexdump import with stats (text lines)", samples,
+                             operations=frames, elapsed=perf() - started, unit="frame"))
+
+    frames = FrameParser().feed(stream)
+    st = next(f for f in frames if f.command == "ST" and f.is_ack)
+    as_ = next(f for f in frames if f.command == "AS" and f.is_ack)
+    for name, func, payload in (("decode_status ST", decode_status, st.payload),
+                                ("decode_pan_tilt_status AS", decode_pan_tilt_status, as_.payload)):
+        perf = time.perf_counter
+        samples = []
+        for _ in range(rounds):
+            started = perf()
+            for _ in range(100):
+                func(payload)
+            samples.append((perf() - started) / 100)
+        results.append(summarize(name, samples))
+    return results
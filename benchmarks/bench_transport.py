@@ -0,0 +1,50 @@
+"""Full transactions against the simulated device"""
+import time
+
+import oe10_codec
+from oe10_protocol import MODE_COMPAT, MODE_RELIABLE, OE10Protocol
+from oe10_simulator import PtySimulator
+
+from benchmarks.common import summarize
+
+
+def _measure(name, func, count, **extra):
+    samples = []
+    failures = 0
+    started = time.perf_counter()
+    for _ in range(count):
+        call_started = time.perf_counter()
+        if func() is None:
+            failures += 1
+        samples.append(time.perf_counter() - call_started)
+    return summarize(name, samples, elapsed=time.perf_counter() - started,
+                     failures=failures, **extra)
+
+
+def run(quick=False, baudrates=(9600, 115200), modes=(MODE_RELIABLE, MODE_COMPAT)):
+    count = 10 if quick else 100
+    results = []
+    for baudrate in baudrates:
+        sim = PtySimulator(baudrate=baudrate).start()
+        protocol = OE10Protocol(port=sim.port, baudrate=baudrate)
+        try:
+            st = oe10_codec.fixed_frame("ST")
+            results.append(_measure(f"transport.transact ST @{baudrate}",
+                                    lambda: protocol.transport.transact(st), count,
+                                    baudrate=baudrate))
+            calls = [("get_status", protocol.get_status),
+                     ("get_pan_tilt_status", protocol.get_pan_tilt_status),
+                     ("stop", lambda: protocol.stop() or None)]
+            for mode in modes:
+                protocol.mode = mode
+                for name, func in calls:
+                    requests = sim.stats["requests"]
+                    result = _measure(f"OE10Protocol.{name} {mode} @{baudrate}", func, count,
+                                      baudrate=baudrate)
+                    # Request frames put on the wire per call
+                    result["frames_per_call"] = (sim.stats["requests"] - requests) / count
+                    results.append(result)
+        finally:
+            protocol.close()
+            sim.stop()
+    return results
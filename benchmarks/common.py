@@ -0,0 +1,74 @@
+"""Shared helpers for the benchmark suite"""
+import os
+import time
+
+from oe10_hexdump import iter_chunks
+from oe10_journal import DIRECTION_NAMES
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEXDUMP = os.path.join(REPO_ROOT, "hexdump.txt")
+
+
+def percentile(sorted_samples, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_samples:
+        return None
+    index = min(len(sorted_samples) - 1, max(0, int(round(fraction * len(sorted_samples))) - 1))
+    return sorted_samples[index]
+
+
+def summarize(name, samples, operations=None, elapsed=None, **extra):
+    """Build a result record from per-operation latencies in seconds
+
+    Args:
+        name (str): Workload name
+        samples (list): Latency of each operation (or batch average)
+        operations (int): Operations performed, defaults to len(samples)
+        elapsed (float): Wall time of the whole run, for throughput
+
+    Returns:
+        dict: Record with latency percentiles in microseconds
+    """
+    samples = sorted(samples)
+    operations = operations if operations is not None else len(samples)
+    record = {
+        "name": name,
+        "operations": operations,
+        "latency_us": {
+            "mean": round(sum(samples) / len(samples) * 1e6, 3) if samples else None,
+            "min": round(samples[0] * 1e6, 3) if samples else None,
+            "p50": round(percentile(samples, 0.50) * 1e6, 3) if samples else None,
+            "p95": round(percentile(samples, 0.95) * 1e6, 3) if samples else None,
+            "p99": round(percentile(samples, 0.99) * 1e6, 3) if samples else None,
+            "max": round(samples[-1] * 1e6, 3) if samples else None,
+        },
+    }
+    if elapsed:
+        record["throughput_per_s"] = round(operations / elapsed, 3)
+    record.update(extra)
+    return record
+
+
+def time_batches(func, batches=50, batch_size=1000):
+    """Time func in batches, returning the average per call of each batch
+
+    Batching keeps timer overhead out of sub-microsecond measurements.
+    """
+    samples = []
+    perf = time.perf_counter
+    for _ in range(batches):
+        started = perf()
+        for _ in range(batch_size):
+            func()
+        samples.append((perf() - started) / batch_size)
+    return samples
+
+
+def load_hexdump(path=HEXDUMP):
+    """Read a vendor serial monitor capture into (direction, bytes) chunks
+
+    Returns:
+        list: ("tx" or "rx", bytes) per captured write or read, in order
+    """
+    with open(path) as capture:
+        return [(DIRECTION_NAMES[chunk.direction], chunk.data) for chunk in iter_chunks(capture)]
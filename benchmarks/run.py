@@ -0,0 +1,60 @@
+"""Run the benchmark suite and print the results as JSON
+
+    python -m benchmarks.run                      # all workloads
+    python -m benchmarks.run codec parser --quick
+    python -m benchmarks.run --output results.json
+"""
+import argparse
+import contextlib
+import json
+import platform
+import sys
+import time
+
+from benchmarks import bench_api, bench_codec, bench_parser, bench_transport
+
+WORKLOADS = {
+    "codec": bench_codec.run,
+    "parser": bench_parser.run,
+    "transport": bench_transport.run,
+    "api": bench_api.run,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OE10 protocol stack benchmarks")
+    parser.add_argument("workloads", nargs="*", metavar="WORKLOAD",
+                        help=f"one of {', '.join(WORKLOADS)} (default: all)")
+    parser.add_argument("--quick", action="store_true", help="fewer iterations")
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = parser.parse_args()
+    unknown = set(args.workloads) - set(WORKLOADS)
+    if unknown:
+        parser.error(f"unknown workload: {', '.join(sorted(unknown))}")
+
+    report = {
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": [],
+    }
+    # Port status messages and the app's console log go to stderr, so
+    # stdout only carries the report
+    for name in args.workloads or WORKLOADS:
+        print(f"Running {name}...", file=sys.stderr)
+        with contextlib.redirect_stdout(sys.stderr):
+            results = WORKLOADS[name](quick=args.quick)
+        for record in results:
+            record["workload"] = name
+        report["results"].extend(results)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,41 @@
-import serial
+import os
+import selectors
+import threading
 import time
+from collections import deque
+
+import serial
+
+from oe10_parser import FrameParser
+
 
 class MAX3232:
-    def __init__(self, port='/dev/ttyAMA0', baudrate=9600, timeout=1):
+    """OE10 frames over the MAX3232 adapter without polling the port
+
+    The port's file descriptor is watched with a selector (epoll on Linux),
+    so nothing runs while the line is quiet. Whatever has arrived is read
+    in one call and fed to a FrameParser, and complete frames are delivered
+    by read_frame()/frames() or to a callback from a reader thread (start()).
+    Writes return as soon as the driver has sent the bytes, there are no
+    fixed delays.
+    """
+
+    def __init__(self, port='/dev/ttyAMA0', baudrate=9600, timeout=1, trace=False):
+        self.timeout = timeout
+        self.trace = trace
+        self.parser = FrameParser()
+        self._frames = deque()
+        self._selector = None
+        self._thread = None
+        self._running = False
+        # Written to wake the reader thread when it is stopped
+        self._wakeup_read, self._wakeup_write = os.pipe()
         try:
             print(f"Attempting to open serial port {port}")
-            self.ser = serial.Serial(
-                port=port,
+            # serial_for_url also accepts pyserial URLs, e.g. a simulator
+            # on socket://localhost:7777
+            self.ser = serial.serial_for_url(
+                port,
                 baudrate=baudrate,
                 parity=serial.PARITY_NONE,
                 stopbits=serial.STOPBITS_ONE,
@@ -17,89 +46,164 @@ class MAX3232:
         except serial.SerialException as e:
             print(f"Error initializing serial connection: {e}")
             self.ser = None
+            return
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self.ser.fileno(), selectors.EVENT_READ, "serial")
+        self._selector.register(self._wakeup_read, selectors.EVENT_READ, "wakeup")
 
-    def send_hex(self, command_string):
-        """Send raw hex data. command_string should be a formatted protocol string."""
+    def fileno(self):
+        """File descriptor of the port, for callers with their own event loop"""
+        return self.ser.fileno()
+
+    @staticmethod
+    def encode_hex(command_string):
+        """Bytes of a protocol string such as "<03:01:03:ST::06:G>"
+
+        Two digit hex fields become one byte, anything else is sent as ASCII.
+        """
+        command_bytes = bytearray(b"<")
+        for i, part in enumerate(command_string.strip('<>').split(':')):
+            if i > 0:  # Add separator except for first part
+                command_bytes.append(0x3A)  # ':'
+            if len(part) == 2 and all(c in '0123456789ABCDEF' for c in part.upper()):
+                command_bytes.append(int(part, 16))
+            else:
+                command_bytes.extend(part.encode())
+        command_bytes.append(0x3E)  # '>'
+        return bytes(command_bytes)
+
+    def write(self, data):
+        """Send raw bytes, returns once the driver has transmitted them"""
         if self.ser:
             try:
-                # Convert protocol string to actual bytes
-                # Example input: "<FF:01:03:ST::7E:G>"
-                # Remove < > brackets and convert to bytes
-                command_bytes = bytearray()
-                
-                # Add start bracket
-                command_bytes.append(0x3C)  # '<'
-                
-                # Process the middle part
-                parts = command_string.strip('<>').split(':')
-                for i, part in enumerate(parts):
-                    if i > 0:  # Add separator except for first part
-                        command_bytes.append(0x3A)  # ':'
-                    
-                    # Convert hex values
-                    if len(part) == 2 and all(c in '0123456789ABCDEF' for c in part.upper()):
-                        command_bytes.append(int(part, 16))
-                    else:
-                        # Add ASCII characters
-                        command_bytes.extend(part.encode())
-                
-                # Add end bracket
-                command_bytes.append(0x3E)  # '>'
-                
-                print(f"Sending bytes: {' '.join(f'{b:02X}' for b in command_bytes)}")
-                self.ser.write(command_bytes)
-                print(f"Sent {len(command_bytes)} bytes")
-                
-                # Small delay to ensure transmission
-                time.sleep(0.1)
+                self.ser.write(data)
+                # Blocks in the kernel (tcdrain) instead of a fixed sleep
+                self.ser.flush()
+                return True
             except Exception as e:
                 print(f"Error sending data: {e}")
+        return False
+
+    def send_hex(self, command_string):
+        """Send raw hex data. command_string should be a formatted protocol string."""
+        command_bytes = self.encode_hex(command_string)
+        if self.trace:
+            print(f"Sending bytes: {' '.join(f'{b:02X}' for b in command_bytes)}")
+        return self.write(command_bytes)
 
     def send(self, data):
         """Send raw string data with CR/LF"""
-        if self.ser:
-            try:
-                message = data + "\r\n"
-                self.ser.write(message.encode())
-                print(f"Sent: {message.strip()}")
-                time.sleep(0.1)
-            except Exception as e:
-                print(f"Error sending data: {e}")
+        message = data + "\r\n"
+        sent = self.write(message.encode())
+        if sent and self.trace:
+            print(f"Sent: {message.strip()}")
+        return sent
 
-    def read(self):
-        """Read response"""
-        if self.ser:
+    def _receive(self, timeout):
+        """Wait up to `timeout` seconds for data and parse it
+
+        Returns:
+            bool: False if woken up by stop() or the port failed
+        """
+        for key, _ in self._selector.select(timeout):
+            if key.data == "wakeup":
+                os.read(self._wakeup_read, 512)
+                return False
             try:
-                if self.ser.in_waiting:
-                    # Read until '>' is found or timeout
-                    response = bytearray()
-                    start_time = time.time()
-                    
-                    while (time.time() - start_time) < self.ser.timeout:
-                        if self.ser.in_waiting:
-                            byte = self.ser.read()
-                            response.extend(byte)
-                            if byte == b'>':  # End of message
-                                break
-                    
-                    if response:
-                        try:
-                            # Try to decode as ASCII first
-                            decoded = response.decode(errors='ignore')
-                            print(f"Received: {decoded}")
-                            return decoded
-                        except UnicodeDecodeError:
-                            # If ASCII decode fails, return hex representation
-                            hex_str = ' '.join(f'{b:02X}' for b in response)
-                            print(f"Received hex: {hex_str}")
-                            return hex_str
-                return ""
-            except Exception as e:
+                chunk = self.ser.read(max(1, self.ser.in_waiting))
+            except serial.SerialException as e:
                 print(f"Error reading data: {e}")
-        return ""
+                return False
+            self._frames.extend(self.parser.feed(chunk))
+        return True
+
+    def read_frame(self, timeout=None):
+        """Next complete frame
+
+        Args:
+            timeout (float): Seconds to wait, defaults to the port timeout
+
+        Returns:
+            Frame: See oe10_parser, None on timeout
+        """
+        if not self.ser:
+            return None
+        if timeout is None:
+            timeout = self.timeout
+        deadline = time.monotonic() + timeout
+        while not self._frames:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self._receive(remaining):
+                break
+        return self._frames.popleft() if self._frames else None
+
+    def frames(self, timeout=None):
+        """Iterate over frames as they arrive
+
+        Args:
+            timeout (float): End after this many seconds without a frame,
+                None waits forever
+        """
+        last = time.monotonic()
+        while self.ser:
+            if self._frames:
+                last = time.monotonic()
+                yield self._frames.popleft()
+                continue
+            wait = None if timeout is None else last + timeout - time.monotonic()
+            if (wait is not None and wait <= 0) or not self._receive(wait):
+                return
+
+    def read(self, timeout=None):
+        """Read response, the next frame as text ("" on timeout)"""
+        frame = self.read_frame(timeout)
+        if frame is None:
+            return ""
+        decoded = bytes(frame.raw).decode(errors='ignore')
+        if self.trace:
+            print(f"Received: {decoded}")
+        return decoded
+
+    def start(self, on_frame):
+        """Deliver every frame to on_frame(frame) from a reader thread"""
+        if not self.ser or self._running:
+            return
+        self._running = True
+
+        def run():
+            # Ends when stop() wakes the selector or the port fails
+            for frame in self.frames():
+                try:
+                    on_frame(frame)
+                except Exception as e:
+                    print(f"Error in frame callback: {e}")
+                if not self._running:
+                    break
+            self._running = False
+
+        self._thread = threading.Thread(target=run, name="max3232-reader", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the reader thread"""
+        if self._thread:
+            self._running = False
+            if self._thread.is_alive():
+                os.write(self._wakeup_write, b"\0")
+            self._thread.join()
+            self._thread = None
 
     def close(self):
         """Close the serial port"""
+        self.stop()
+        if self._selector:
+            self._selector.close()
+            self._selector = None
+        for fd in (self._wakeup_read, self._wakeup_write):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
         if self.ser:
             try:
                 self.ser.close()
@@ -109,24 +213,23 @@ class MAX3232:
 
 if __name__ == '__main__':
     import serial.tools.list_ports
-    
+
     # List all available serial ports
     print("Available serial ports:")
     ports = list(serial.tools.list_ports.comports())
     for port in ports:
         print(f"- {port.device}: {port.description}")
-    
+
     # Test connection
     port = input("Enter port to test (e.g., /dev/ttyAMA0): ")
-    max_device = MAX3232(port=port)
-    
+    max_device = MAX3232(port=port, trace=True)
+
     if max_device.ser:
         try:
             while True:
                 # Test with status command
                 print("\nSending status command...")
-                status_command = "3C FF 3A 01 3A 03 3A 53 54 3A 3A 7E 3A 47 3E"
-                max_device.send_hex(status_command)
+                max_device.send_hex("<03:01:03:ST::06:G>")
                 response = max_device.read()
                 if response:
                     print(f"Response: {response}")
@@ -134,4 +237,4 @@ if __name__ == '__main__':
         except KeyboardInterrupt:
             print("\nTest terminated by user")
         finally:
-            max_device.close() 
\ No newline at end of file
+            max_device.close()
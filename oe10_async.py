@@ -0,0 +1,331 @@
+import asyncio
+import logging
+
+import serial
+
+import oe10_codec
+import oe10_metrics
+import oe10_parser
+from oe10_journal import RX, TX
+from oe10_motion import ArrivalCheck, MoveResult
+from oe10_parser import FrameParser
+from oe10_protocol import PAN_ACTIONS, TILT_ACTIONS
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncOE10Protocol:
+    """asyncio client for one OE10 unit
+
+    The port is opened non-blocking and watched with loop.add_reader(), so
+    waiting for a reply costs no thread. Requests on one client are sent one
+    at a time, each awaiting its own reply (matched on command and unit
+    address) before the next goes out. Every call takes a timeout that
+    covers both waiting for the port and waiting for the reply; on expiry
+    the call returns None (or False), like OE10Protocol. Cancelling a call
+    frees the port for the next one. When the port fails or is closed, the
+    client stops watching it and every call returns None.
+
+    Usage:
+        async with AsyncOE10Protocol("/dev/ttyAMA0") as oe10:
+            status = await oe10.get_status()
+    """
+
+    def __init__(self, port='/dev/ttyAMA0', baudrate=9600, timeout=1.0,
+                 address=oe10_codec.PERIPHERAL_ID, journal=None):
+        """Open the port, call connect() (or use async with) before any command
+
+        Args:
+            port (str): Serial port or pyserial URL (see oe10_simulator)
+            baudrate (int): Line speed
+            timeout (float): Default seconds per call
+            address (int): Address of the unit on the bus
+            journal (Journal): Record all traffic (see oe10_journal)
+        """
+        self.serial = serial.serial_for_url(
+            port,
+            baudrate=baudrate,
+            bytesize=serial.EIGHTBITS,
+            parity=serial.PARITY_NONE,
+            stopbits=serial.STOPBITS_ONE,
+            timeout=0
+        )
+        self.timeout = timeout
+        self.address = address
+        self.journal = journal
+        self.parser = FrameParser()
+        self.unsolicited = 0  # Frames received while no request was waiting
+        self.closed = False
+
+        self._fd = None
+        self._loop = None
+        self._lock = None
+        self._waiter = None  # (command, Future) of the request on the wire
+
+    async def connect(self):
+        """Start watching the port on the running event loop"""
+        if self._loop is not None or self.closed:
+            return self
+        self._loop = asyncio.get_running_loop()
+        self._lock = asyncio.Lock()
+        self._fd = self.serial.fileno()
+        self._loop.add_reader(self._fd, self._on_readable)
+        return self
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def _on_readable(self):
+        try:
+            chunk = self.serial.read(max(1, self.serial.in_waiting))
+        except (serial.SerialException, OSError) as e:
+            logger.error(f"Serial read failed, closing the port: {e}")
+            self._detach()
+            return
+        if not chunk:
+            # Readable without data: the other end hung up
+            logger.error("Serial port hung up, closing it")
+            self._detach()
+            return
+        if self.journal is not None:
+            self.journal.record(RX, chunk)
+        for frame in self.parser.feed(chunk):
+            self._dispatch(frame)
+
+    def _dispatch(self, frame):
+        if not frame.checksum_ok:
+            oe10_metrics.CHECKSUM_ERRORS.inc(oe10_metrics.address_label(frame.from_addr))
+        waiter = self._waiter
+        if (waiter is None or waiter[1].done() or frame.command != waiter[0]
+                or (self.address != oe10_codec.BROADCAST_ID and frame.from_addr != self.address)):
+            self.unsolicited += 1
+            return
+        waiter[1].set_result(frame)
+
+    def _detach(self):
+        """Stop watching the port, the request on the wire gets None"""
+        if self._loop is not None and self._fd is not None:
+            self._loop.remove_reader(self._fd)
+        self._fd = None
+        self.closed = True
+        if self._waiter is not None and not self._waiter[1].done():
+            self._waiter[1].set_result(None)
+
+    async def transact(self, command, data=b"", timeout=None):
+        """Send one request and await its reply
+
+        Args:
+            command (str): Two letter command
+            data (bytes): Encoded data section (see oe10_codec.encode_data)
+            timeout (float): Seconds for the whole call, defaults to self.timeout
+
+        Returns:
+            Frame: Reply frame (see oe10_parser), None on timeout or when
+            the port is closed
+        """
+        if self._loop is None:
+            await self.connect()
+        if self.closed:
+            return None
+        if timeout is None:
+            timeout = self.timeout
+        deadline = self._loop.time() + timeout
+
+        if data or command not in oe10_codec.COMMANDS:
+            packet = oe10_codec.encode_raw(command, data, self.address, oe10_codec.CONTROLLER_ID)
+        else:
+            packet = oe10_codec.fixed_frame(command, self.address, oe10_codec.CONTROLLER_ID)
+
+        if self._lock.locked():
+            try:
+                await asyncio.wait_for(self._lock.acquire(), deadline - self._loop.time())
+            except asyncio.TimeoutError:
+                return None
+        else:
+            # Uncontended, acquire() returns without yielding. wait_for()
+            # would swallow a cancel that arrives while it completes.
+            await self._lock.acquire()
+        if self.closed or self._loop.time() >= deadline:
+            # Sending now would move the unit and still report a failure
+            self._lock.release()
+            return None
+
+        future = self._loop.create_future()
+        expiry = self._loop.call_at(deadline, self._expire, future)
+        try:
+            # Drop stale bytes so a late reply cannot pair with this request
+            self.parser.reset()
+            self.serial.reset_input_buffer()
+            self._waiter = (command, future)
+            started = self._loop.time()
+            self.serial.write(packet)
+            if self.journal is not None:
+                self.journal.record(TX, packet)
+            reply = await future
+            oe10_metrics.observe_command(command, self.address,
+                                         reply if reply is not None and reply.checksum_ok else None,
+                                         self._loop.time() - started)
+            return reply
+        finally:
+            expiry.cancel()
+            self._waiter = None
+            self._lock.release()
+
+    @staticmethod
+    def _expire(future):
+        if not future.done():
+            future.set_result(None)
+
+    async def _query(self, command, data=b"", timeout=None):
+        """Like transact(), but only return replies the device ACKed"""
+        response = await self.transact(command, data, timeout)
+        if response is None:
+            return None
+        if not response.checksum_ok:
+            logger.warning(f"Checksum error in {response.command} reply")
+            return None
+        if not response.is_ack:
+            logger.warning(f"{command} rejected: "
+                           f"{', '.join(oe10_metrics.nak_reasons(response.error_code))}")
+            return None
+        return response
+
+    async def get_status(self, timeout=None):
+        """Status (ST)
+
+        Returns:
+            dict: Decoded ST reply (see oe10_parser.decode_status) or None
+        """
+        response = await self._query("ST", timeout=timeout)
+        if response is None:
+            return None
+        status = oe10_parser.decode_status(response.payload)
+        if status and status["error"]:
+            status["diagnosis"] = await self.get_error_diagnosis(timeout)
+        return status
+
+    async def get_error_diagnosis(self, timeout=None):
+        """Error diagnosis (ED), read by get_status() when the error flag is set
+
+        Returns:
+            dict: See oe10_parser.decode_error_diagnosis, or None
+        """
+        response = await self._query("ED", timeout=timeout)
+        if response is None:
+            return None
+        return oe10_parser.decode_error_diagnosis(response.payload)
+
+    async def get_pan_tilt_status(self, timeout=None):
+        """Pan and tilt status (AS): speeds, positions and endstops
+
+        Returns:
+            dict: Decoded AS reply (see oe10_parser.decode_pan_tilt_status) or None
+        """
+        response = await self._query("AS", timeout=timeout)
+        if response is None:
+            return None
+        return oe10_parser.decode_pan_tilt_status(response.payload)
+
+    async def get_protocol_version(self, timeout=None):
+        """Protocol version (PV) as a string, or None"""
+        response = await self._query("PV", timeout=timeout)
+        if response is None:
+            return None
+        return bytes(response.payload).decode('ascii', 'replace').strip()
+
+    async def get_software_version(self, timeout=None):
+        """Software version (CV) as "01.04.28", or None"""
+        response = await self._query("CV", timeout=timeout)
+        if response is None or len(response.payload) < 6:
+            return None
+        version = bytes(response.payload[:6]).decode('ascii', 'replace')
+        return f"{version[0:2]}.{version[2:4]}.{version[4:6]}"
+
+    async def go_to_pan(self, degrees, timeout=None):
+        """Go to pan position (PP), True if the device accepted the move"""
+        data = oe10_codec.encode_data("PP", degrees)
+        return await self._query("PP", data, timeout) is not None
+
+    async def go_to_tilt(self, degrees, timeout=None):
+        """Go to tilt position (TP), True if the device accepted the move"""
+        data = oe10_codec.encode_data("TP", degrees)
+        return await self._query("TP", data, timeout) is not None
+
+    async def go_to_location(self, pan, tilt, timeout=None):
+        """Go to pan and tilt position (GL), True if the device accepted the move"""
+        data = oe10_codec.encode_data("GL", pan, tilt)
+        return await self._query("GL", data, timeout) is not None
+
+    async def pan_stop(self, timeout=None):
+        """Pan stop (PS), True if acknowledged"""
+        return await self._query("PS", timeout=timeout) is not None
+
+    async def tilt_stop(self, timeout=None):
+        """Tilt stop (TS), True if acknowledged"""
+        return await self._query("TS", timeout=timeout) is not None
+
+    async def stop(self, timeout=None):
+        """Stop both axes with a zero PC command"""
+        return await self.proportional_control(timeout=timeout)
+
+    async def proportional_control(self, pan_direction=0, tilt_direction=0,
+                                   pan_speed=0, tilt_speed=0, timeout=None):
+        """Proportional control (PC) movement
+
+        Args:
+            pan_direction (int): 0 = stop, 1 = left, 2 = right
+            tilt_direction (int): 0 = stop, 1 = up, 2 = down
+            pan_speed (int): 0 - 100 (0x64)
+            tilt_speed (int): 0 - 100 (0x64)
+
+        Returns:
+            bool: True if acknowledged
+        """
+        actions = PAN_ACTIONS.get(pan_direction, 0) | TILT_ACTIONS.get(tilt_direction, 0)
+        data = oe10_codec.encode_data("PC", actions, pan_speed, tilt_speed)
+        return await self._query("PC", data, timeout) is not None
+
+    async def move_to(self, pan=None, tilt=None, tolerance=1.0, timeout=30.0,
+                      poll_interval=0.1, stall_time=3.0):
+        """Move to an absolute position and wait until it is reached
+
+        Same semantics as oe10_motion.move_to(). Cancelling the task stops
+        the wait, not the device.
+
+        Returns:
+            MoveResult: See oe10_motion.wait_for_position()
+        """
+        if pan is not None and tilt is not None:
+            accepted = await self.go_to_location(pan, tilt)
+        elif pan is not None:
+            accepted = await self.go_to_pan(pan)
+        elif tilt is not None:
+            accepted = await self.go_to_tilt(tilt)
+        else:
+            raise ValueError("No target position given")
+        if not accepted:
+            return MoveResult(False, None, None, 0.0, "rejected")
+
+        check = ArrivalCheck(pan, tilt, tolerance, timeout, stall_time, self._loop.time())
+        while True:
+            position = await self.get_pan_tilt_status()
+            now = self._loop.time()
+            reason = check.update(position, now)
+            if reason is not None:
+                return check.result(reason, now)
+            await asyncio.sleep(poll_interval)
+
+    def close(self):
+        """Stop watching the port and close it"""
+        if self._loop is not None:
+            self._detach()
+            self._loop = None
+        self.closed = True
+        try:
+            if self.serial.is_open:
+                self.serial.close()
+        except Exception as e:
+            logger.error(f"Error closing serial connection: {e}")
@@ -0,0 +1,285 @@
+import logging
+import threading
+import time
+from types import MappingProxyType
+
+import serial
+
+import oe10_codec
+from oe10_poller import StatusSnapshot
+from oe10_protocol import OE10Protocol
+from oe10_transport import FrameTransport
+
+logger = logging.getLogger(__name__)
+
+# Unit addresses, 0x00/0x01 belong to controllers and 0xFF is broadcast
+FIRST_ADDRESS = 0x02
+LAST_ADDRESS = 0xFE
+
+# After SI a unit reverts to its old id unless it is addressed on the new
+# id within this many seconds
+SI_REVERT_TIME = 1.0
+
+
+class OE10Bus:
+    """Several OE10 units sharing one serial line
+
+    The bus owns the port and one FrameTransport. Every unit is an
+    OE10Protocol bound to that transport, so all units share its lock and
+    replies are routed by the "from" field of the frame. A background
+    thread can poll all units back to back in a weighted round-robin order.
+    """
+
+    def __init__(self, port='/dev/ttyAMA0', baudrate=9600, timeout=1.0, scan_timeout=0.1,
+                 journal=None):
+        """Open the port shared by all units
+
+        Args:
+            port (str): Serial port or pyserial URL (see oe10_simulator)
+            baudrate (int): Line speed
+            timeout (float): Seconds to wait for a reply frame
+            scan_timeout (float): Seconds to wait per address in scan()
+            journal (Journal): Record all traffic (see oe10_journal)
+        """
+        self.serial = serial.serial_for_url(
+            port,
+            baudrate=baudrate,
+            bytesize=serial.EIGHTBITS,
+            parity=serial.PARITY_NONE,
+            stopbits=serial.STOPBITS_ONE,
+            timeout=timeout
+        )
+        self.transport = FrameTransport(self.serial, timeout=timeout, journal=journal)
+        self.scan_timeout = scan_timeout
+
+        self.units = {}    # address -> OE10Protocol
+        self.weights = {}  # address -> polls per round
+        self.errors = {}   # address -> failed polls
+
+        self._snapshots = {}
+        self._sequence = 0
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_unit(self, address, weight=1):
+        """Register a unit and return its OE10Protocol
+
+        Args:
+            address (int): Unit address on the bus
+            weight (int): Number of polls per round, e.g. 4 for a unit that
+                is being moved and 1 for idle ones
+        """
+        if not FIRST_ADDRESS <= address <= LAST_ADDRESS:
+            raise ValueError(f"Invalid unit address {address:#04x}")
+        unit = self.units.get(address)
+        if unit is None:
+            unit = self.units[address] = OE10Protocol(address=address, transport=self.transport)
+            self.errors[address] = 0
+        self.weights[address] = max(0, int(weight))
+        return unit
+
+    def remove_unit(self, address):
+        """Stop polling a unit and forget it"""
+        self.units.pop(address, None)
+        self.weights.pop(address, None)
+        self.errors.pop(address, None)
+        with self._cond:
+            self._snapshots.pop(address, None)
+
+    def unit(self, address):
+        """OE10Protocol for a registered unit"""
+        return self.units[address]
+
+    def set_weight(self, address, weight):
+        """Change how often a unit is polled per round, 0 pauses it"""
+        if address not in self.units:
+            raise KeyError(address)
+        self.weights[address] = max(0, int(weight))
+
+    def scan(self, addresses=None, timeout=None):
+        """Find units by sending ST to every address
+
+        A full scan of 0x02-0xFE takes about 253 * timeout seconds, pass a
+        smaller range when the addresses in use are known.
+
+        Args:
+            addresses (iterable): Addresses to probe, defaults to all
+            timeout (float): Seconds to wait per address
+
+        Returns:
+            list: Addresses that replied, each registered with add_unit()
+        """
+        if addresses is None:
+            addresses = range(FIRST_ADDRESS, LAST_ADDRESS + 1)
+        if timeout is None:
+            timeout = self.scan_timeout
+
+        found = []
+        for address in addresses:
+            frame = oe10_codec.fixed_frame("ST", address, oe10_codec.CONTROLLER_ID)
+            reply = self.transport.transact(frame, timeout=timeout, source=address)
+            if reply is not None and reply.checksum_ok and reply.command == "ST":
+                found.append(address)
+                if address not in self.units:
+                    self.add_unit(address)
+        logger.info(f"Bus scan found {len(found)} unit(s): "
+                    f"{', '.join(f'{a:#04x}' for a in found)}")
+        return found
+
+    def change_id(self, old, new):
+        """Move a unit to a new address with the SI handshake
+
+        The unit accepts SI, switches to the new id and reverts to the old
+        one unless it receives a status command on the new id within
+        SI_REVERT_TIME. ST is sent to the new id inside that window while
+        the bus lock is held, so no other traffic can delay it.
+
+        Args:
+            old (int): Current address of the unit
+            new (int): Address to move it to
+
+        Returns:
+            bool: True if the unit confirmed the new id
+        """
+        if not FIRST_ADDRESS <= new <= LAST_ADDRESS:
+            raise ValueError(f"Invalid unit address {new:#04x}")
+        if new in self.units and new != old:
+            raise ValueError(f"Address {new:#04x} is already in use")
+
+        with self.transport.lock:
+            sent = time.monotonic()
+            reply = self.transport.transact(oe10_codec.encode("SI", new, to_addr=old))
+            if (reply is None or not reply.checksum_ok or not reply.is_ack
+                    or reply.command != "SI" or reply.from_addr not in (old, new)):
+                logger.warning(f"Unit {old:#04x} rejected SI to {new:#04x}")
+                return False
+
+            remaining = SI_REVERT_TIME - (time.monotonic() - sent)
+            confirm = None
+            if remaining > 0:
+                frame = oe10_codec.fixed_frame("ST", new, oe10_codec.CONTROLLER_ID)
+                confirm = self.transport.transact(
+                    frame, timeout=min(self.transport.timeout, remaining), source=new)
+            if confirm is None or not confirm.checksum_ok:
+                # The unit falls back to the old id on its own
+                logger.warning(f"No reply on {new:#04x} within {SI_REVERT_TIME}s, "
+                               f"unit stays at {old:#04x}")
+                return False
+
+        weight = self.weights.get(old, 1)
+        if old in self.units:
+            self.remove_unit(old)
+        self.add_unit(new, weight)
+        logger.info(f"Unit {old:#04x} moved to {new:#04x}")
+        return True
+
+    def broadcast(self, command, *args):
+        """Send a command to all units at once
+
+        Units on a shared line would answer at the same time, so no reply
+        is awaited and any garbled replies are discarded by the next
+        transaction.
+        """
+        frame = oe10_codec.encode(command, *args, to_addr=oe10_codec.BROADCAST_ID)
+        with self.transport.lock:
+            self.transport.write_frame(frame)
+
+    def poll_order(self):
+        """One polling round in smooth weighted round-robin order
+
+        Each unit appears `weight` times, spread over the round instead of
+        in bursts (weights 3 and 1 give A A B A, not A A A B).
+        """
+        weights = {address: weight for address, weight in sorted(self.weights.items())
+                   if weight > 0}
+        total = sum(weights.values())
+        current = dict.fromkeys(weights, 0)
+        order = []
+        for _ in range(total):
+            for address, weight in weights.items():
+                current[address] += weight
+            chosen = max(current, key=current.get)
+            current[chosen] -= total
+            order.append(chosen)
+        return order
+
+    def poll(self, address):
+        """Sample AS on one unit and publish it
+
+        Returns:
+            StatusSnapshot: The new snapshot, or None if the unit did not answer
+        """
+        unit = self.units.get(address)
+        if unit is None:
+            return None
+        status = unit.get_pan_tilt_status()
+        if status is None:
+            self.errors[address] = self.errors.get(address, 0) + 1
+            return None
+
+        with self._cond:
+            self._sequence += 1
+            snap = StatusSnapshot(MappingProxyType(status), time.time(),
+                                  time.monotonic(), self._sequence)
+            self._snapshots[address] = snap
+            self._cond.notify_all()
+        return snap
+
+    def snapshot(self, address, max_age=None):
+        """Latest polled status of a unit, None if missing or older than max_age"""
+        snap = self._snapshots.get(address)
+        if snap is None or (max_age is not None and snap.age > max_age):
+            return None
+        return snap
+
+    def snapshots(self):
+        """Latest polled status of every unit"""
+        with self._cond:
+            return dict(self._snapshots)
+
+    def start_polling(self, interval=0.0):
+        """Poll all units in a background thread
+
+        Args:
+            interval (float): Minimum seconds per round, 0 keeps the line
+                busy with back to back polls
+        """
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(interval,),
+                                        name="oe10-bus-poller", daemon=True)
+        self._thread.start()
+
+    def stop_polling(self, timeout=None):
+        """Stop the polling thread and wait for it to finish"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self, interval):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            order = self.poll_order()
+            for address in order:
+                if self._stop.is_set():
+                    return
+                try:
+                    self.poll(address)
+                except Exception as e:
+                    self.errors[address] = self.errors.get(address, 0) + 1
+                    logger.error(f"Poll of unit {address:#04x} failed: {e}")
+            # Nothing to poll yet, do not spin
+            wait = interval if order else max(interval, self.transport.timeout)
+            self._stop.wait(max(0.0, wait - (time.monotonic() - started)))
+
+    def close(self):
+        """Stop polling and close the shared port"""
+        self.stop_polling()
+        try:
+            if self.serial and self.serial.is_open:
+                self.serial.close()
+        except Exception as e:
+            logger.error(f"Error closing serial connection: {e}")
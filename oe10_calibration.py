@@ -0,0 +1,356 @@
+"""Measured axis rates per speed setting and move-time prediction
+
+The DS (pan) and TA (tilt) speed bytes run from 1 to 0x64, but how many
+degrees per second a setting produces depends on the head and its load.
+calibrate() sweeps each axis back and forth at a range of settings,
+samples AS while it moves and fits a line through the samples taken in
+motion: the slope is the rate, the intercept gives the start latency
+(command to first movement).
+
+A SpeedTable interpolates the measured rates over all settings and
+predicts move durations. It also picks speeds for a deadline. Tables are
+stored per unit (port and address) in one JSON file:
+
+    python oe10_calibration.py calibrate --port /dev/ttyAMA0 --file oe10_speeds.json
+    python oe10_calibration.py show --file oe10_speeds.json
+
+Without a table the nominal rates of oe10_estimator are used, linear in
+the speed setting.
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from datetime import datetime
+
+from oe10_estimator import DEFAULT_PAN_RATE, DEFAULT_TILT_RATE
+
+logger = logging.getLogger(__name__)
+
+MAX_SPEED = 0x64
+AXES = ("pan", "tilt")
+SPEED_COMMANDS = {"pan": "DS", "tilt": "TA"}
+MOVE_COMMANDS = {"pan": "PP", "tilt": "TP"}
+
+DEFAULT_SPEEDS = (10, 20, 35, 50, 75, 100)
+DEFAULT_FILE = "oe10_speeds.json"
+
+# Samples within this many degrees of either end of a sweep are left out of
+# the fit, the head accelerates and brakes there
+EDGE = 1.0
+
+
+def unit_key(port, address):
+    """Key of a unit in a table file, e.g. /dev/ttyAMA0@0x03"""
+    return f"{port}@{address:#04x}"
+
+
+class SpeedTable:
+    """Degrees per second for every speed setting, per axis
+
+    Rates between calibrated settings are interpolated linearly, below the
+    lowest one they fall linearly to 0 and above the highest one they grow
+    in proportion to the setting. Rates never decrease with the setting, so
+    speed_for() can bisect.
+    """
+
+    def __init__(self, pan=None, tilt=None, pan_latency=0.0, tilt_latency=0.0,
+                 calibrated=None):
+        """Create a table
+
+        Args:
+            pan (dict): Measured pan rates, speed setting -> deg/s; defaults
+                to DEFAULT_PAN_RATE at 0x64
+            tilt (dict): Measured tilt rates, defaults to DEFAULT_TILT_RATE
+                at 0x64
+            pan_latency (float): Seconds from a pan command to movement
+            tilt_latency (float): Seconds from a tilt command to movement
+            calibrated (str): ISO time of the calibration, None for nominal
+        """
+        self.points = {
+            "pan": dict(pan or {MAX_SPEED: DEFAULT_PAN_RATE}),
+            "tilt": dict(tilt or {MAX_SPEED: DEFAULT_TILT_RATE}),
+        }
+        self.latency = {"pan": pan_latency, "tilt": tilt_latency}
+        self.calibrated = calibrated
+        self._rates = {axis: _interpolate(points) for axis, points in self.points.items()}
+
+    @classmethod
+    def nominal(cls, pan_rate=DEFAULT_PAN_RATE, tilt_rate=DEFAULT_TILT_RATE):
+        """Uncalibrated table, rates linear in the speed setting"""
+        return cls({MAX_SPEED: pan_rate}, {MAX_SPEED: tilt_rate})
+
+    def rate(self, axis, speed):
+        """Degrees per second at a speed setting"""
+        return self._rates[axis][max(0, min(MAX_SPEED, int(round(speed))))]
+
+    def move_time(self, axis, distance, speed):
+        """Seconds to travel `distance` degrees at a speed setting, start latency included"""
+        distance = abs(distance)
+        if not distance:
+            return 0.0
+        rate = self.rate(axis, speed)
+        if rate <= 0:
+            return float("inf")
+        return self.latency[axis] + distance / rate
+
+    def predict(self, pan_distance=0.0, tilt_distance=0.0, pan_speed=MAX_SPEED,
+                tilt_speed=MAX_SPEED):
+        """Seconds until both axes have arrived"""
+        return max(self.move_time("pan", pan_distance, pan_speed),
+                   self.move_time("tilt", tilt_distance, tilt_speed))
+
+    def speed_for(self, axis, distance, deadline, limit=MAX_SPEED):
+        """Lowest speed setting that covers `distance` within `deadline` seconds
+
+        The lowest such setting is the gentlest on the mechanics and lets
+        the other axis of a GL move arrive at the same time.
+
+        Returns:
+            int: Speed setting, None if even `limit` is too slow
+        """
+        limit = max(1, min(MAX_SPEED, int(limit)))
+        if self.move_time(axis, distance, limit) > deadline:
+            return None
+        low, high = 1, limit
+        while low < high:
+            middle = (low + high) // 2
+            if self.move_time(axis, distance, middle) <= deadline:
+                high = middle
+            else:
+                low = middle + 1
+        return low
+
+    def to_dict(self):
+        return {
+            "calibrated": self.calibrated,
+            **{axis: {"latency": round(self.latency[axis], 4),
+                      "rates": {str(speed): round(rate, 4)
+                                for speed, rate in sorted(self.points[axis].items())}}
+               for axis in AXES},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        rates = {axis: {int(speed): float(rate)
+                        for speed, rate in data.get(axis, {}).get("rates", {}).items()}
+                 for axis in AXES}
+        return cls(rates["pan"], rates["tilt"],
+                   float(data.get("pan", {}).get("latency", 0.0)),
+                   float(data.get("tilt", {}).get("latency", 0.0)),
+                   data.get("calibrated"))
+
+    @classmethod
+    def load(cls, path, unit):
+        """Table of a unit from a table file
+
+        Returns:
+            SpeedTable: The stored table, None if the file or unit is missing
+        """
+        try:
+            with open(path) as stored:
+                units = json.load(stored).get("units", {})
+        except FileNotFoundError:
+            return None
+        data = units.get(unit)
+        return cls.from_dict(data) if data is not None else None
+
+    def save(self, path, unit):
+        """Store the table of a unit, other units in the file are kept"""
+        try:
+            with open(path) as stored:
+                contents = json.load(stored)
+        except FileNotFoundError:
+            contents = {}
+        contents.setdefault("units", {})[unit] = self.to_dict()
+        temporary = f"{path}.tmp"
+        with open(temporary, "w") as output:
+            json.dump(contents, output, indent=2, sort_keys=True)
+        os.replace(temporary, path)
+
+
+def _interpolate(points):
+    """Rate per speed setting 0-0x64 from measured (speed, rate) points"""
+    known = sorted((speed, rate) for speed, rate in points.items() if speed > 0 and rate > 0)
+    if not known:
+        raise ValueError("A speed table needs at least one positive rate")
+    rates = [0.0] * (MAX_SPEED + 1)
+    below_speed, below_rate = 0, 0.0
+    index = 0
+    for speed in range(1, MAX_SPEED + 1):
+        while index < len(known) and known[index][0] < speed:
+            below_speed, below_rate = known[index]
+            index += 1
+        if index < len(known):
+            above_speed, above_rate = known[index]
+            share = (speed - below_speed) / (above_speed - below_speed)
+            rate = below_rate + (above_rate - below_rate) * share
+        else:
+            rate = below_rate * speed / below_speed
+        rates[speed] = max(rate, rates[speed - 1])
+    return rates
+
+
+def fit_sweep(samples, start, end):
+    """Rate and start latency from the samples of one sweep
+
+    Args:
+        samples (list): (seconds since the move command, position) pairs
+        start (float): Position the sweep started from
+        end (float): Target of the sweep
+
+    Returns:
+        tuple: (deg/s, latency in seconds), None with fewer than two
+        samples taken in motion
+    """
+    low, high = min(start, end) + EDGE, max(start, end) - EDGE
+    moving = [(t, p) for t, p in samples if low <= p <= high]
+    if len(moving) < 2 or moving[0][0] == moving[-1][0]:
+        return None
+    count = len(moving)
+    mean_t = sum(t for t, _ in moving) / count
+    mean_p = sum(p for _, p in moving) / count
+    spread = sum((t - mean_t) ** 2 for t, _ in moving)
+    slope = sum((t - mean_t) * (p - mean_p) for t, p in moving) / spread
+    if slope == 0 or (slope > 0) != (end > start):
+        return None
+    # Where the fitted line leaves the start position
+    latency = mean_t - (mean_p - start) / slope
+    return abs(slope), max(0.0, latency)
+
+
+def _sweep(device, read_position, axis, target, timeout):
+    """Move one axis to `target` and sample AS until it arrives
+
+    Returns:
+        list: (seconds since the move command, position) pairs
+    """
+    before = time.monotonic()
+    if device.send_batch([[MOVE_COMMANDS[axis], [target]]]) != 1:
+        raise RuntimeError(f"{MOVE_COMMANDS[axis]} {target} was rejected")
+    # The unit starts on receiving the command, about halfway through the
+    # transaction
+    commanded = (before + time.monotonic()) / 2
+    samples = []
+    while time.monotonic() - commanded < timeout:
+        sent = time.monotonic()
+        status = read_position()
+        position = status.get(f"{axis}_position") if status else None
+        if position is None:
+            # Reply lost or incomplete, the next sample covers it
+            continue
+        samples.append(((sent + time.monotonic()) / 2 - commanded, position))
+        if abs(position - target) <= 0.5:
+            return samples
+    raise RuntimeError(f"{axis} did not reach {target} within {timeout:.0f}s")
+
+
+def calibrate(device, read_position=None, axes=AXES, speeds=DEFAULT_SPEEDS,
+              pan_range=(90, 150), tilt_range=(10, 40), timeout=120.0):
+    """Measure the rate of each axis at a range of speed settings
+
+    The head sweeps between the ends of each range, one sweep per speed
+    setting, alternating direction. The speed settings in use before are
+    restored afterwards.
+
+    Args:
+        device: OE10Protocol (or a proxy with the same methods) of the unit
+        read_position (callable): Returns an AS status dict, defaults to
+            device.get_pan_tilt_status
+        axes (tuple): Axes to calibrate
+        speeds (tuple): Speed settings to measure, 1-100
+        pan_range (tuple): Pan sweep between these positions
+        tilt_range (tuple): Tilt sweep between these positions
+        timeout (float): Seconds one sweep may take
+
+    Returns:
+        SpeedTable: Measured rates, uncalibrated axes keep nominal rates
+    """
+    read_position = read_position or device.get_pan_tilt_status
+    status = read_position()
+    if status is None:
+        raise RuntimeError("Could not read the current position")
+    original = {"pan": status.get("pan_speed"), "tilt": status.get("tilt_speed")}
+    ranges = {"pan": pan_range, "tilt": tilt_range}
+    rates = {}
+    latencies = {}
+    try:
+        for axis in axes:
+            start, end = ranges[axis]
+            # Reach the start of the range at full speed
+            device.send_batch([[SPEED_COMMANDS[axis], [MAX_SPEED]]])
+            _sweep(device, read_position, axis, start, timeout)
+            rates[axis], measured = {}, []
+            for speed in speeds:
+                device.send_batch([[SPEED_COMMANDS[axis], [speed]]])
+                samples = _sweep(device, read_position, axis, end, timeout)
+                fitted = fit_sweep(samples, start, end)
+                if fitted is None:
+                    logger.warning(f"Too few samples for {axis} at speed {speed}, "
+                                   f"widen the range")
+                else:
+                    rates[axis][speed], latency = fitted
+                    measured.append(latency)
+                    logger.info(f"{axis} speed {speed}: {fitted[0]:.2f} deg/s, "
+                                f"{latency * 1000:.0f} ms to start")
+                start, end = end, start
+            if measured:
+                latencies[axis] = sorted(measured)[len(measured) // 2]
+    finally:
+        restore = [[SPEED_COMMANDS[axis], [speed]] for axis, speed in original.items()
+                   if axis in axes and speed]
+        if restore:
+            device.send_batch(restore)
+
+    return SpeedTable(rates.get("pan") or None, rates.get("tilt") or None,
+                      latencies.get("pan", 0.0), latencies.get("tilt", 0.0),
+                      datetime.now().isoformat(timespec="seconds"))
+
+
+def _speeds(text):
+    return tuple(int(speed, 0) for speed in text.split(","))
+
+
+def _range(text):
+    start, end = (float(value) for value in text.split(":"))
+    return start, end
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate OE10 axis speeds")
+    parser.add_argument("command", choices=["calibrate", "show"])
+    parser.add_argument("--port", default=os.environ.get('OE10_PORT', '/dev/ttyAMA0'))
+    parser.add_argument("--address", type=lambda text: int(text, 0), default=0x03)
+    parser.add_argument("--file", default=os.environ.get('OE10_SPEED_TABLE', DEFAULT_FILE))
+    parser.add_argument("--axes", default="pan,tilt")
+    parser.add_argument("--speeds", type=_speeds, default=DEFAULT_SPEEDS)
+    parser.add_argument("--pan-range", type=_range, default=(90, 150), help="start:end")
+    parser.add_argument("--tilt-range", type=_range, default=(10, 40), help="start:end")
+    args = parser.parse_args()
+    unit = unit_key(args.port, args.address)
+
+    if args.command == "show":
+        table = SpeedTable.load(args.file, unit)
+        if table is None:
+            print(f"No table for {unit} in {args.file}")
+            return
+        print(json.dumps(table.to_dict(), indent=2))
+        return
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    from oe10_protocol import OE10Protocol
+    controller = OE10Protocol(port=args.port, address=args.address, trace=False)
+    try:
+        table = calibrate(controller, axes=tuple(args.axes.split(",")), speeds=args.speeds,
+                          pan_range=args.pan_range, tilt_range=args.tilt_range)
+    finally:
+        controller.close()
+    table.save(args.file, unit)
+    print(json.dumps(table.to_dict(), indent=2))
+    print(f"Saved as {unit} in {args.file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""Packet encoder for the OE10-104 protocol
+
+Implements the packet structure from oe10_com_protocol.md:
+
+    <to:from:length:command:data:checksum:checksum ind>
+
+Lengths and checksums are always computed, never copied from captures.
+Frames for commands without data are encoded once and kept in a cache of
+ready-to-write bytes, so the status polling path does no formatting.
+"""
+from collections import namedtuple
+
+CONTROLLER_ID = 0x01
+PERIPHERAL_ID = 0x03
+BROADCAST_ID = 0xFF
+
+FRAME_START = 0x3C  # '<'
+FRAME_END = 0x3E    # '>'
+SEPARATOR = 0x3A    # ':'
+ACK = 0x06
+NAK = 0x15
+
+# NAK error byte bits
+NAK_OTHER_CONTROLLER = 0x01  # Device under control of another controller
+NAK_NOT_AVAILABLE = 0x08     # Command not available for device
+NAK_NOT_RECOGNISED = 0x10    # Command not recognized
+NAK_TIMED_OUT = 0x20         # Device timed out
+
+# Lengths above this are sent as 99 (see "Length" in the spec)
+MAX_LENGTH = 99
+
+# Proportional control action bits (Byte1 of PC/PF), as the vendor GUI
+# sends them in the captures (signal_reverse-engineering.md); the spec
+# table has left/right and up/down the other way round
+PAN_LEFT = 0x02
+PAN_RIGHT = 0x01
+TILT_UP = 0x08
+TILT_DOWN = 0x04
+
+CommandSpec = namedtuple('CommandSpec', ['command', 'data_size', 'encoder', 'description'])
+
+
+def _no_data():
+    return b""
+
+
+def _degrees(value):
+    """Three ASCII digits, e.g. 270 -> b'270'"""
+    value = int(round(value))
+    if not 0 <= value <= 999:
+        raise ValueError(f"Position out of range: {value}")
+    return b"%03d" % value
+
+
+def _location(pan, tilt):
+    """Pan followed by tilt as six ASCII digits"""
+    return _degrees(pan) + _degrees(tilt)
+
+
+def _speed(value):
+    """Single speed byte in the range 0x00 - 0x64"""
+    return bytes([max(0, min(0x64, int(value)))])
+
+
+def _proportional(actions, pan_speed=0, tilt_speed=0):
+    """Action byte, pan speed, tilt speed and the unused Byte4"""
+    return bytes([actions & 0xFF]) + _speed(pan_speed) + _speed(tilt_speed) + b"\x00"
+
+
+def _endstops(enabled):
+    return b"1" if enabled else b"0"
+
+
+def _termination(state):
+    """0 = off, 1 = on, 2 = enquiry"""
+    state = int(state)
+    if state not in (0, 1, 2):
+        raise ValueError(f"Invalid termination state: {state}")
+    return b"%d" % state
+
+
+def _address(new_id):
+    if not 0x02 <= new_id <= 0xFE:
+        raise ValueError(f"Peripheral id must be in 0x02-0xFE: {new_id:#04x}")
+    return bytes([new_id])
+
+
+COMMANDS = {spec.command: spec for spec in (
+    CommandSpec("ST", 0, _no_data, "Check status"),
+    CommandSpec("SI", 1, _address, "Change ID"),
+    CommandSpec("PV", 0, _no_data, "Request protocol version"),
+    CommandSpec("CV", 0, _no_data, "Request software version"),
+    CommandSpec("PL", 0, _no_data, "Pan left"),
+    CommandSpec("PR", 0, _no_data, "Pan right"),
+    CommandSpec("PS", 0, _no_data, "Pan stop"),
+    CommandSpec("PP", 3, _degrees, "Go to pan position"),
+    CommandSpec("TU", 0, _no_data, "Tilt up"),
+    CommandSpec("TD", 0, _no_data, "Tilt down"),
+    CommandSpec("TS", 0, _no_data, "Tilt stop"),
+    CommandSpec("TP", 3, _degrees, "Go to tilt position"),
+    CommandSpec("PC", 4, _proportional, "Proportional control"),
+    CommandSpec("PF", 4, _proportional, "Proportional control with feedback"),
+    CommandSpec("AW", 0, _no_data, "Set pan anti-clockwise soft end stop"),
+    CommandSpec("CW", 0, _no_data, "Set pan clockwise soft end stop"),
+    CommandSpec("UT", 0, _no_data, "Set tilt up soft end stop"),
+    CommandSpec("DT", 0, _no_data, "Set tilt down soft end stop"),
+    CommandSpec("DS", 1, _speed, "Set pan speed"),
+    CommandSpec("TA", 1, _speed, "Set tilt speed"),
+    CommandSpec("ES", 1, _endstops, "Use endstops"),
+    CommandSpec("AS", 0, _no_data, "Pan and tilt status"),
+    CommandSpec("GL", 6, _location, "Go to location"),
+    CommandSpec("TR", 1, _termination, "Set/clear/enquire termination"),
+    CommandSpec("ED", 0, _no_data, "Error diagnosis"),
+)}
+
+# Pre-encoded frames for commands without data, keyed by (command, to, from)
+_FRAME_CACHE = {}
+
+
+def checksum(data):
+    """XOR of all bytes between '<' and the checksum section"""
+    value = 0
+    for byte in data:
+        value ^= byte
+    return value
+
+
+def encode_checksum(value):
+    """Escape a checksum so it never looks like a frame delimiter
+
+    Returns:
+        bytes: Checksum byte followed by the checksum indicator
+    """
+    if value == FRAME_START:
+        return b"\xff0"
+    if value == FRAME_END:
+        return b"\xff1"
+    return bytes([value]) + b"G"
+
+
+def _frame(body, to_addr, from_addr):
+    """Wrap a body (the section counted by the length byte) into a frame"""
+    length = min(len(body), MAX_LENGTH)
+    header = bytes([to_addr, SEPARATOR, from_addr, SEPARATOR, length, SEPARATOR])
+    ind = encode_checksum(checksum(header + body))
+    return b"<" + header + body + b":" + ind[:1] + b":" + ind[1:] + b">"
+
+
+def encode_raw(command, data=b"", to_addr=PERIPHERAL_ID, from_addr=CONTROLLER_ID):
+    """Encode a frame from an already encoded data section
+
+    Args:
+        command (str or bytes): Two letter command
+        data (bytes): Data section
+        to_addr (int): Destination id
+        from_addr (int): Source id
+
+    Returns:
+        bytes: Complete frame
+    """
+    if isinstance(command, str):
+        command = command.encode('ascii')
+    return _frame(command + b":" + bytes(data), to_addr, from_addr)
+
+
+def encode_reply(command, data=b"", status=ACK, to_addr=CONTROLLER_ID, from_addr=PERIPHERAL_ID):
+    """Encode a peripheral reply: <to:from:length:ACK:commanddata:...>
+
+    Used by the simulator and by tests that need device traffic.
+    """
+    if isinstance(command, str):
+        command = command.encode('ascii')
+    return _frame(bytes([status]) + b":" + command + bytes(data), to_addr, from_addr)
+
+
+def fixed_frame(command, to_addr=PERIPHERAL_ID, from_addr=CONTROLLER_ID):
+    """Return the cached frame for a command without data"""
+    key = (command, to_addr, from_addr)
+    frame = _FRAME_CACHE.get(key)
+    if frame is None:
+        if COMMANDS[command].data_size:
+            raise ValueError(f"{command} requires data")
+        frame = _FRAME_CACHE[key] = encode_raw(command, b"", to_addr, from_addr)
+    return frame
+
+
+def encode_data(command, *args):
+    """Encode only the data section of a command from its spec table entry"""
+    spec = COMMANDS[command]
+    data = spec.encoder(*args)
+    if len(data) != spec.data_size:
+        raise ValueError(f"{command} data must be {spec.data_size} bytes, got {len(data)}")
+    return data
+
+
+def encode(command, *args, to_addr=PERIPHERAL_ID, from_addr=CONTROLLER_ID):
+    """Encode a command from its spec table entry
+
+    Examples:
+        encode("ST")                        -> status request
+        encode("PP", 270)                   -> go to pan 270
+        encode("PC", TILT_UP, 0, 30)        -> tilt at speed 0x1E
+        encode("GL", 20, 65, to_addr=0xFF)  -> broadcast go to location
+
+    Returns:
+        bytes: Complete frame
+    """
+    spec = COMMANDS[command]
+    if not spec.data_size:
+        if args:
+            raise ValueError(f"{command} takes no data")
+        return fixed_frame(command, to_addr, from_addr)
+    return encode_raw(command, encode_data(command, *args), to_addr, from_addr)
+
+
+# Warm the cache for the default addressing used by OE10Protocol
+for _command, _spec in COMMANDS.items():
+    if not _spec.data_size:
+        fixed_frame(_command)
+del _command, _spec
+
+
+if __name__ == "__main__":
+    import timeit
+
+    print("Frames for the default peripheral:")
+    for name in COMMANDS:
+        spec = COMMANDS[name]
+        if spec.data_size:
+            continue
+        print(f"  {name}  {fixed_frame(name).hex(' ')}")
+
+    runs = 200000
+    cases = [
+        ("ST (cached)", lambda: encode("ST")),
+        ("PC", lambda: encode("PC", TILT_DOWN, 0, 0x1E)),
+        ("PP", lambda: encode("PP", 270)),
+        ("GL", lambda: encode("GL", 20, 65)),
+    ]
+    print(f"\nEncode cost per frame ({runs} runs):")
+    for label, func in cases:
+        seconds = min(timeit.repeat(func, number=runs, repeat=3))
+        print(f"  {label:12s} {seconds / runs * 1e9:8.0f} ns")
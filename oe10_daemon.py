@@ -0,0 +1,582 @@
+"""Device daemon: one process owns the serial port, web workers connect to it
+
+The daemon runs the controller, its CommandScheduler and StatusPoller for
+the lifetime of the device session. Clients (e.g. several gunicorn workers
+running app.py with OE10_DAEMON_SOCKET set) talk to it over a Unix socket
+with one JSON object per line in each direction:
+
+    {"op": "call", "method": "go_to_pan", "args": [90], "priority": 1}
+    {"result": true}
+
+    {"op": "wait", "timeout": 1.0}
+    {"result": {"data": {...}, "timestamp": ..., "monotonic": ..., "sequence": 42}}
+
+Errors come back as {"error": "message", "type": "TimeoutError"}.
+
+The joystick and the trajectory runner also live in the daemon, so a
+setpoint, stop or abort sent through any worker acts on the same state:
+
+    {"op": "joystick", "pan": -50, "tilt": 0}
+    {"op": "trajectory_start", "waypoints": [[10, 20, 2.0]], "speed": 80}
+
+The port is opened and reconnected by an oe10_link.SerialLink. The socket
+is served while the link is down, and device requests then fail at once
+with type "LinkDown", which DeviceClient raises as
+oe10_transport.LinkDown.
+"""
+import argparse
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+from types import MappingProxyType
+
+import oe10_codec
+import oe10_metrics
+from oe10_calibration import DEFAULT_FILE, SpeedTable, unit_key
+from oe10_joystick import JoystickController
+from oe10_journal import Journal
+from oe10_link import SerialLink
+from oe10_parser import FrameParser
+from oe10_poller import StatusPoller, StatusSnapshot, iter_updates
+from oe10_protocol import MODE_RELIABLE, OE10Protocol
+from oe10_scheduler import CommandScheduler, PRIORITY_MOTION, PRIORITY_STATUS, PRIORITY_STOP
+from oe10_trajectory import (Plan, PositionUnknown, Step, TrajectoryBusy, TrajectoryRunner,
+                             waypoint_list)
+from oe10_transport import LinkDown
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET = "/tmp/oe10.sock"
+
+# Controller methods clients may call, everything else is refused
+DEVICE_METHODS = frozenset([
+    "get_status", "get_pan_tilt_status", "get_protocol_version", "get_software_version",
+    "get_identity", "get_error_diagnosis",
+    "go_to_pan", "go_to_tilt", "go_to_location", "move_pan_to", "move_tilt_to",
+    "pan_stop", "tilt_stop", "stop", "proportional_control", "send_batch", "move_within",
+])
+
+# Commands a client may put in send_batch: speed settings and absolute
+# moves, as trajectory steps and calibration sweeps use them. Anything
+# else (SI, ES, AW...) is not reachable over the socket.
+BATCH_COMMANDS = frozenset(["DS", "TA", "PP", "TP", "GL"])
+
+
+def _encode_result(value):
+    """JSON form of a controller result, reply frames travel as raw bytes"""
+    raw = getattr(value, "raw", None)
+    if raw is not None:
+        return {"frame": bytes(raw).hex()}
+    return value
+
+
+def _decode_result(value):
+    if isinstance(value, dict) and set(value) == {"frame"}:
+        frames = FrameParser().feed(bytes.fromhex(value["frame"]))
+        return frames[0] if frames else None
+    return value
+
+
+def _encode_snapshot(snap):
+    if snap is None:
+        return None
+    return {"data": dict(snap.data), "timestamp": snap.timestamp,
+            "monotonic": snap.monotonic, "sequence": snap.sequence}
+
+
+def _decode_snapshot(value):
+    if value is None:
+        return None
+    # time.monotonic() is system wide on Linux, so ages stay valid
+    return StatusSnapshot(MappingProxyType(value["data"]), value["timestamp"],
+                          value["monotonic"], value["sequence"])
+
+
+def _encode_plan(plan):
+    return {"steps": plan.steps, "duration": plan.duration, "restore": plan.restore}
+
+
+def _decode_plan(value):
+    return Plan(tuple(Step(*step) for step in value["steps"]), value["duration"],
+                tuple(value["restore"]))
+
+
+def _check_batch(args, kwargs):
+    """Refuse a send_batch request with a command outside BATCH_COMMANDS"""
+    commands = kwargs.get("commands", args[0] if args else [])
+    for command, _ in commands:
+        if command not in BATCH_COMMANDS:
+            raise ValueError(f"Command {command!r} is not available in a batch")
+
+
+class DeviceDaemon:
+    """Owns the controller and serves it on a Unix socket"""
+
+    def __init__(self, port='/dev/ttyAMA0', socket_path=DEFAULT_SOCKET, mode=MODE_RELIABLE,
+                 poll_interval=0.5, max_age=2.0, command_timeout=5.0, journal_dir=None,
+                 speed_table=DEFAULT_FILE, match=None, joystick_rate=20.0,
+                 joystick_deadman=0.5):
+        """Create a daemon, start() opens the port and the socket
+
+        Args:
+            port (str): Serial port or pyserial URL
+            socket_path (str): Unix socket to listen on
+            mode (str): Protocol mode, see oe10_protocol
+            poll_interval (float): Seconds between status samples
+            max_age (float): Default staleness limit for status reads
+            command_timeout (float): Seconds a device call may wait in total
+            journal_dir (str): Record all serial traffic here (see oe10_journal)
+            speed_table (str): Calibration file to load the unit's speed
+                table from (see oe10_calibration)
+            match (str): Find the adapter under another name after a
+                replug, see oe10_link.discover_port()
+            joystick_rate (float): Maximum PC commands per second
+            joystick_deadman (float): Seconds without a setpoint before
+                the joystick stops the head
+        """
+        self.port = port
+        self.socket_path = socket_path
+        self.mode = mode
+        self.poll_interval = poll_interval
+        self.max_age = max_age
+        self.command_timeout = command_timeout
+        self.journal_dir = journal_dir
+        self.speed_table = speed_table
+        self.match = match
+        self.joystick_rate = joystick_rate
+        self.joystick_deadman = joystick_deadman
+
+        self.journal = None
+        self.table = None
+        self.link = None
+        self.controller = None
+        self.scheduler = None
+        self.poller = None
+        self.joystick = None
+        self.trajectory = None
+        self.server = None
+        self._thread = None
+
+    def start(self):
+        """Start connecting to the device and serving in background threads"""
+        if self.journal_dir:
+            self.journal = Journal(self.journal_dir).start()
+        self.table = SpeedTable.load(self.speed_table,
+                                     unit_key(self.port, oe10_codec.PERIPHERAL_ID))
+        if self.table is not None:
+            logger.info(f"Loaded speed table from {self.speed_table}")
+        self.scheduler = CommandScheduler()
+        self.scheduler.start()
+        self.link = SerialLink(self.port, self._open, match=self.match,
+                               on_up=self._link_up, on_down=self._link_down).start()
+
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)  # Left over from a previous run
+        self.server = _Server(self.socket_path, _Handler)
+        self.server.device_daemon = self
+        os.chmod(self.socket_path, 0o660)
+        self._thread = threading.Thread(target=self.server.serve_forever,
+                                        name="oe10-daemon", daemon=True)
+        self._thread.start()
+        logger.info(f"Serving {self.port} on {self.socket_path}")
+        return self
+
+    def _open(self, port):
+        """First connection of the link thread"""
+        controller = OE10Protocol(port=port, mode=self.mode, journal=self.journal)
+        if self.table is not None:
+            controller.set_speed_table(self.table)
+        return controller
+
+    def _link_up(self, controller, reconnect):
+        """Called by the link thread after the handshake, before the link is up"""
+        self.controller = controller
+        if self.poller is None:
+            self.poller = StatusPoller(self.scheduler.proxy(controller, PRIORITY_STATUS,
+                                                            self.command_timeout),
+                                       interval=self.poll_interval, max_age=self.max_age)
+            self.poller.start()
+            self.joystick = JoystickController(self._device(), self._device(PRIORITY_STOP),
+                                               rate=self.joystick_rate,
+                                               deadman=self.joystick_deadman,
+                                               on_command=self.poller.invalidate)
+            self.trajectory = TrajectoryRunner(
+                self._device(), self._device(PRIORITY_STOP),
+                read_position=self._device(PRIORITY_STATUS).get_pan_tilt_status,
+                on_command=self.poller.invalidate, table=self.table)
+        else:
+            self.poller.invalidate()
+
+    def _link_down(self, controller, reason):
+        """Called by the link thread after the port was closed"""
+        if self.trajectory:
+            # Its commands would fail one by one, a stop cannot be sent either
+            self.trajectory.abort(stop=False)
+        if self.poller:
+            self.poller.invalidate()
+
+    def _device(self, priority=PRIORITY_MOTION):
+        return self.scheduler.proxy(self.controller, priority, self.command_timeout)
+
+    def _require_link(self):
+        if self.link is None or not self.link.is_up:
+            raise LinkDown(f"Serial link is {self.link.state if self.link else 'down'}")
+
+    def stop(self):
+        """Stop serving, then stop polling and close the port"""
+        if self.link:
+            self.link.stop(timeout=2)
+        if self.trajectory:
+            self.trajectory.abort()
+            self.trajectory.wait(timeout=2)
+        if self.joystick:
+            self.joystick.stop(timeout=2)
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+        if self.poller:
+            self.poller.stop(timeout=2)
+        if self.scheduler:
+            self.scheduler.stop(timeout=self.command_timeout)
+        if self.controller:
+            self.controller.close()
+        if self.journal:
+            self.journal.close()
+
+    def handle(self, request):
+        """Execute one decoded request and return the JSON result"""
+        op = request.get("op")
+        if op == "call":
+            method = request.get("method")
+            if method not in DEVICE_METHODS:
+                raise ValueError(f"Method {method!r} is not available")
+            if method == "send_batch":
+                _check_batch(request.get("args", []), request.get("kwargs", {}))
+            self._require_link()
+            result = self.scheduler.call(getattr(self.controller, method),
+                                         *request.get("args", []),
+                                         priority=int(request.get("priority", PRIORITY_MOTION)),
+                                         timeout=self.command_timeout,
+                                         **request.get("kwargs", {}))
+            return _encode_result(result)
+        if op == "link":
+            return self.link.status()
+        if op in ("joystick", "trajectory_start"):
+            self._require_link()
+        if op in ("snapshot", "wait", "wait_newer", "invalidate", "estimate", "predict",
+                  "joystick_release", "joystick_stats", "trajectory_progress",
+                  "trajectory_abort"):
+            # Served from the last session while the link is down, until
+            # the first connection there is nothing to serve
+            if self.poller is None:
+                self._require_link()
+        if op == "snapshot":
+            return _encode_snapshot(self.poller.snapshot(request.get("max_age")))
+        if op == "wait":
+            return _encode_snapshot(self.poller.wait(float(request["timeout"]),
+                                                     request.get("max_age")))
+        if op == "wait_newer":
+            return _encode_snapshot(self.poller.wait_newer(int(request["sequence"]),
+                                                           float(request["timeout"])))
+        if op == "invalidate":
+            self.poller.invalidate()
+            return True
+        if op == "joystick":
+            self.joystick.update(float(request.get("pan", 0.0)), float(request.get("tilt", 0.0)))
+            return True
+        if op == "joystick_release":
+            # A joystick nobody has used yet has nothing to release
+            if self.joystick.active:
+                self.joystick.release()
+            return True
+        if op == "joystick_stats":
+            return self.joystick.stats()
+        if op == "trajectory_start":
+            return _encode_plan(self.trajectory.start(waypoint_list(request["waypoints"]),
+                                                      int(request.get("speed", 100))))
+        if op == "trajectory_progress":
+            return self.trajectory.progress()
+        if op == "trajectory_abort":
+            return self.trajectory.abort(bool(request.get("stop", True)))
+        if op == "metrics":
+            return self.scheduler.metrics()
+        if op == "metrics_text":
+            return oe10_metrics.REGISTRY.render(oe10_metrics.SERIAL_METRICS)
+        if op == "estimate":
+            # No I/O, so it does not queue behind serial transactions
+            return self.controller.estimate_position(request.get("at"))
+        if op == "predict":
+            return self.controller.predict_move(request.get("pan"), request.get("tilt"),
+                                                request.get("pan_speed"), request.get("tilt_speed"))
+        raise ValueError(f"Unknown op {op!r}")
+
+
+class _Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """One client connection, requests are answered in order"""
+
+    def handle(self):
+        daemon = self.server.device_daemon
+        for line in self.rfile:
+            try:
+                reply = {"result": daemon.handle(json.loads(line))}
+            except Exception as e:
+                reply = {"error": str(e), "type": type(e).__name__}
+            self.wfile.write(json.dumps(reply, separators=(",", ":")).encode() + b"\n")
+            self.wfile.flush()
+
+
+class DaemonError(Exception):
+    """A request failed inside the daemon"""
+
+
+class DeviceClient:
+    """Client for DeviceDaemon, safe to share between threads
+
+    Each thread keeps its own connection, so a long status wait in one
+    request never holds up a command from another.
+    """
+
+    def __init__(self, socket_path=DEFAULT_SOCKET, timeout=5.0):
+        """Create a client, connections are opened on first use
+
+        Args:
+            socket_path (str): Unix socket of the daemon
+            timeout (float): Extra seconds to wait for any reply
+        """
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.socket_path)
+            conn = self._local.conn = (sock, sock.makefile("rb"))
+        return conn
+
+    def _drop_connection(self):
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn:
+            conn[1].close()
+            conn[0].close()
+
+    def request(self, op, wait=0.0, **fields):
+        """Send one request and return its result
+
+        Args:
+            op (str): Operation, see DeviceDaemon.handle()
+            wait (float): Seconds the daemon may block on this request,
+                added to the client timeout
+
+        Raises:
+            TimeoutError: The daemon timed out the call or did not answer
+            LinkDown: The daemon's serial link is down
+            TrajectoryBusy, PositionUnknown: A trajectory could not start
+            DaemonError: The call failed in the daemon
+        """
+        fields["op"] = op
+        sock, reader = self._connection()
+        try:
+            sock.settimeout(self.timeout + wait)
+            sock.sendall(json.dumps(fields, separators=(",", ":")).encode() + b"\n")
+            line = reader.readline()
+        except (OSError, ValueError) as e:
+            # Timed out or broken, the reply can no longer be paired
+            self._drop_connection()
+            if isinstance(e, socket.timeout):
+                raise TimeoutError(f"No reply from daemon to {op}")
+            raise
+        if not line:
+            self._drop_connection()
+            raise ConnectionError("Daemon closed the connection")
+
+        reply = json.loads(line)
+        if "error" in reply:
+            if reply.get("type") == "TimeoutError":
+                raise TimeoutError(reply["error"])
+            if reply.get("type") == "LinkDown":
+                raise LinkDown(reply["error"])
+            if reply.get("type") == "TrajectoryBusy":
+                raise TrajectoryBusy(reply["error"])
+            if reply.get("type") == "PositionUnknown":
+                raise PositionUnknown(reply["error"])
+            raise DaemonError(reply["error"])
+        return reply["result"]
+
+    def proxy(self, priority=PRIORITY_MOTION, timeout=None):
+        """Object whose controller method calls run in the daemon
+
+        Args:
+            priority (int): Scheduler lane in the daemon
+            timeout (float): Seconds the daemon may take for the call
+        """
+        return RemoteDevice(self, priority, timeout or 0.0)
+
+    def poller(self):
+        """StatusPoller look-alike reading the daemon's snapshots"""
+        return RemotePoller(self)
+
+    def joystick(self):
+        """JoystickController look-alike driving the daemon's joystick"""
+        return RemoteJoystick(self)
+
+    def trajectory(self):
+        """TrajectoryRunner look-alike driving the daemon's runner"""
+        return RemoteTrajectory(self)
+
+    def link_status(self):
+        """State of the daemon's serial link, see oe10_link.SerialLink.status()"""
+        return self.request("link")
+
+    def metrics(self):
+        """Scheduler lane metrics of the daemon"""
+        return self.request("metrics")
+
+    def metrics_text(self):
+        """Serial and scheduler metrics of the daemon in the Prometheus format"""
+        return self.request("metrics_text")
+
+    def estimate_position(self, at=None):
+        """Position estimate of the daemon's controller, at is time.monotonic()"""
+        return self.request("estimate", at=at)
+
+    def predict_move(self, pan=None, tilt=None, pan_speed=None, tilt_speed=None):
+        """Predicted move duration from the daemon's controller, see OE10Protocol.predict_move()"""
+        return self.request("predict", pan=pan, tilt=tilt, pan_speed=pan_speed,
+                            tilt_speed=tilt_speed)
+
+    def close(self):
+        """Close this thread's connection"""
+        self._drop_connection()
+
+
+class RemoteDevice:
+    """Forwards controller method calls to the daemon"""
+
+    def __init__(self, client, priority, timeout):
+        self._client = client
+        self._priority = priority
+        self._timeout = timeout
+
+    def __getattr__(self, name):
+        if name not in DEVICE_METHODS:
+            raise AttributeError(name)
+
+        def call(*args, **kwargs):
+            result = self._client.request("call", wait=self._timeout, method=name,
+                                          args=list(args), kwargs=kwargs,
+                                          priority=self._priority)
+            return _decode_result(result)
+        call.__name__ = name
+        return call
+
+
+class RemotePoller:
+    """Read side of StatusPoller backed by the daemon"""
+
+    def __init__(self, client):
+        self._client = client
+
+    def snapshot(self, max_age=None):
+        return _decode_snapshot(self._client.request("snapshot", max_age=max_age))
+
+    def wait(self, timeout, max_age=None):
+        return _decode_snapshot(self._client.request("wait", wait=timeout, timeout=timeout,
+                                                     max_age=max_age))
+
+    def wait_newer(self, sequence, timeout):
+        return _decode_snapshot(self._client.request("wait_newer", wait=timeout,
+                                                     sequence=sequence, timeout=timeout))
+
+    def updates(self, min_interval=0.0, keepalive=15.0):
+        return iter_updates(self.wait_newer, min_interval, keepalive)
+
+    def invalidate(self):
+        self._client.request("invalidate")
+
+
+class RemoteJoystick:
+    """Setpoint side of JoystickController backed by the daemon"""
+
+    def __init__(self, client):
+        self._client = client
+
+    def update(self, pan=0.0, tilt=0.0):
+        self._client.request("joystick", pan=float(pan), tilt=float(tilt))
+
+    def release(self):
+        self._client.request("joystick_release")
+
+    def stats(self):
+        return self._client.request("joystick_stats")
+
+
+class RemoteTrajectory:
+    """Control side of TrajectoryRunner backed by the daemon"""
+
+    def __init__(self, client):
+        self._client = client
+
+    def start(self, waypoints, speed=100):
+        # Waypoints travel as [pan, tilt, dwell] lists, see waypoint_list()
+        return _decode_plan(self._client.request("trajectory_start",
+                                                 waypoints=[list(w) for w in waypoints],
+                                                 speed=speed))
+
+    def progress(self):
+        return self._client.request("trajectory_progress")
+
+    def abort(self, stop=True):
+        return self._client.request("trajectory_abort", stop=stop)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve one OE10 to local clients")
+    parser.add_argument("--port", default=os.environ.get('OE10_PORT', '/dev/ttyAMA0'))
+    parser.add_argument("--socket", default=os.environ.get('OE10_DAEMON_SOCKET', DEFAULT_SOCKET))
+    parser.add_argument("--mode", default=os.environ.get('OE10_PROTOCOL_MODE', MODE_RELIABLE))
+    parser.add_argument("--poll-interval", type=float,
+                        default=float(os.environ.get('OE10_POLL_INTERVAL', '0.5')))
+    parser.add_argument("--max-age", type=float,
+                        default=float(os.environ.get('OE10_STATUS_MAX_AGE', '2.0')))
+    parser.add_argument("--command-timeout", type=float,
+                        default=float(os.environ.get('OE10_COMMAND_TIMEOUT', '5.0')))
+    parser.add_argument("--journal-dir", default=os.environ.get('OE10_JOURNAL_DIR'))
+    parser.add_argument("--speed-table", default=os.environ.get('OE10_SPEED_TABLE', DEFAULT_FILE))
+    parser.add_argument("--port-match", default=os.environ.get('OE10_PORT_MATCH'),
+                        help="USB id, serial number or description of the adapter")
+    parser.add_argument("--joystick-rate", type=float,
+                        default=float(os.environ.get('OE10_JOYSTICK_RATE', '20')))
+    parser.add_argument("--joystick-deadman", type=float,
+                        default=float(os.environ.get('OE10_JOYSTICK_DEADMAN', '0.5')))
+    args = parser.parse_args()
+    oe10_metrics.REGISTRY.enabled = os.environ.get('OE10_METRICS', '1') != '0'
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    daemon = DeviceDaemon(args.port, args.socket, args.mode, args.poll_interval,
+                          args.max_age, args.command_timeout, args.journal_dir,
+                          args.speed_table, args.port_match, args.joystick_rate,
+                          args.joystick_deadman).start()
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.stop()
+
+
+if __name__ == "__main__":
+    main()
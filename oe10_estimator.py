@@ -0,0 +1,220 @@
+"""Position estimator for the OE10 between serial samples
+
+Every axis runs an alpha-beta filter over the positions reported in
+replies (ST, AS and the echoes of PL/PR/PS/TU/TD/TS). Between replies the
+position is extrapolated with the filtered velocity, which commands reset
+right away: PC and jogs set a velocity, stops set zero, and PP/TP/GL set a
+target the estimate never overshoots. Lookups cost no serial traffic.
+"""
+import math
+import threading
+import time
+
+# Degrees per second at speed 0x64. The real unit's rates depend on the
+# head and load; these are starting values that the filter corrects.
+DEFAULT_PAN_RATE = 20.0
+DEFAULT_TILT_RATE = 10.0
+DEFAULT_SPEED = 0x32  # Speed assumed for jogs and moves until AS reports one
+
+RESOLUTION = 1.0  # Positions are reported in whole degrees
+COMMAND_RATE_ERROR = 0.2  # Relative error assumed for commanded velocities
+
+
+class _AxisFilter:
+    """Alpha-beta filter for one axis"""
+
+    def __init__(self, name, max_rate, wraps, alpha, beta):
+        self.name = name
+        self.max_rate = max_rate
+        self.wraps = wraps
+        self.alpha = alpha
+        self.beta = beta
+
+        self.position = None
+        self.velocity = 0.0
+        self.time = None           # monotonic time of position/velocity
+        self.observed = None       # monotonic time of the last observation
+        self.velocity_error = 0.0  # deg/s, grows the uncertainty with age
+        self.target = None
+        self.speed = DEFAULT_SPEED
+        self.table = None          # oe10_calibration.SpeedTable, None for max_rate
+
+    def _difference(self, a, b):
+        diff = a - b
+        if self.wraps:
+            diff = (diff + 180.0) % 360.0 - 180.0
+        return diff
+
+    def _normalise(self, position):
+        return position % 360.0 if self.wraps else position
+
+    def predict(self, at):
+        """Position at monotonic time `at`, None before the first observation"""
+        if self.position is None:
+            return None
+        step = self.velocity * (at - self.time)
+        if self.target is not None:
+            remaining = self._difference(self.target, self.position)
+            if step * remaining >= 0 and abs(step) >= abs(remaining):
+                return self.target
+        return self._normalise(self.position + step)
+
+    def velocity_at(self, at):
+        if self.target is not None and self.predict(at) == self.target:
+            return 0.0
+        return self.velocity
+
+    def uncertainty(self, at):
+        """Expected error in degrees at monotonic time `at`"""
+        if self.observed is None:
+            return None
+        age = max(0.0, at - self.observed)
+        return RESOLUTION / 2 + self.velocity_error * age
+
+    def observe(self, at, position):
+        if self.position is None:
+            self.position = float(position)
+            self.time = self.observed = at
+            return
+
+        predicted = self.predict(at)
+        residual = self._difference(position, predicted)
+        dt = at - self.time
+        self.position = self._normalise(predicted + self.alpha * residual)
+        if dt > 0:
+            self.velocity += self.beta * residual / dt
+            self.velocity_error = 0.7 * self.velocity_error + 0.3 * abs(residual) / dt
+        if self.target is not None and abs(self._difference(position, self.target)) <= RESOLUTION / 2:
+            # Arrived, hold still at the reported position
+            self.target = None
+            self.velocity = 0.0
+        self.time = self.observed = at
+
+    def command(self, at, velocity=None, target=None):
+        """Re-anchor at the current estimate with a new velocity or target"""
+        if self.position is not None:
+            self.position = self.predict(at)
+            self.time = at
+        self.target = target
+        if target is not None and self.position is not None:
+            direction = 1.0 if self._difference(target, self.position) > 0 else -1.0
+            velocity = direction * self.rate(self.speed)
+        self.velocity = velocity or 0.0
+        # Commanded rates are nominal until observations confirm them
+        self.velocity_error = max(self.velocity_error, COMMAND_RATE_ERROR * abs(self.velocity))
+
+    def rate(self, speed):
+        if self.table is not None:
+            return math.copysign(self.table.rate(self.name, abs(speed)), speed)
+        return self.max_rate * speed / 0x64
+
+
+class PositionEstimator:
+    """Timestamped pan/tilt estimates between serial samples, thread safe"""
+
+    def __init__(self, pan_rate=DEFAULT_PAN_RATE, tilt_rate=DEFAULT_TILT_RATE,
+                 alpha=0.5, beta=0.2):
+        """Create an estimator
+
+        Args:
+            pan_rate (float): Pan degrees per second at speed 0x64
+            tilt_rate (float): Tilt degrees per second at speed 0x64
+            alpha (float): Position gain of the filter, 0-1
+            beta (float): Velocity gain of the filter, 0-1
+        """
+        self.axes = {
+            "pan": _AxisFilter("pan", pan_rate, True, alpha, beta),
+            "tilt": _AxisFilter("tilt", tilt_rate, False, alpha, beta),
+        }
+        self._lock = threading.Lock()
+
+    def observe(self, at=None, pan=None, tilt=None):
+        """Feed reported positions
+
+        Args:
+            at (float): time.monotonic() the positions were sampled at
+            pan (float): Reported pan position, None if not in the reply
+            tilt (float): Reported tilt position, None if not in the reply
+        """
+        at = time.monotonic() if at is None else at
+        with self._lock:
+            for axis, value in (("pan", pan), ("tilt", tilt)):
+                if value is not None:
+                    self.axes[axis].observe(at, value)
+
+    def set_speeds(self, pan=None, tilt=None):
+        """Configured speeds (DS/TA, reported by AS) used for jogs and moves"""
+        with self._lock:
+            for axis, value in (("pan", pan), ("tilt", tilt)):
+                if value:
+                    self.axes[axis].speed = value
+
+    def set_speed_table(self, table):
+        """Use calibrated rates (oe10_calibration.SpeedTable) instead of the linear model"""
+        with self._lock:
+            for filt in self.axes.values():
+                filt.table = table
+
+    def speeds(self):
+        """Configured speed settings per axis, as last set or reported"""
+        return {axis: filt.speed for axis, filt in self.axes.items()}
+
+    def command_velocity(self, at=None, pan=None, tilt=None):
+        """A command changed the velocity (PC, jogs, stops)
+
+        Args:
+            pan (float): Signed speed 0-100 (+ = right), None leaves the axis
+            tilt (float): Signed speed 0-100 (+ = up), None leaves the axis
+        """
+        at = time.monotonic() if at is None else at
+        with self._lock:
+            for axis, speed in (("pan", pan), ("tilt", tilt)):
+                if speed is not None:
+                    filt = self.axes[axis]
+                    filt.command(at, velocity=filt.rate(speed))
+
+    def command_jog(self, at=None, pan=None, tilt=None):
+        """A jog at the configured speed started (PL/PR/TU/TD), direction +1/-1"""
+        at = time.monotonic() if at is None else at
+        with self._lock:
+            for axis, direction in (("pan", pan), ("tilt", tilt)):
+                if direction is not None:
+                    filt = self.axes[axis]
+                    filt.command(at, velocity=direction * filt.rate(filt.speed))
+
+    def command_target(self, at=None, pan=None, tilt=None):
+        """An absolute move started (PP/TP/GL)"""
+        at = time.monotonic() if at is None else at
+        with self._lock:
+            for axis, target in (("pan", pan), ("tilt", tilt)):
+                if target is not None:
+                    self.axes[axis].command(at, target=float(target))
+
+    def estimate(self, at=None):
+        """Position estimate at any time, no serial traffic
+
+        Args:
+            at (float): time.monotonic() to estimate for, defaults to now
+
+        Returns:
+            dict: pan/tilt position, velocity (deg/s) and uncertainty
+            (degrees) per axis, the wall clock timestamp of `at` and the
+            age of the newest observation; positions are None until the
+            first reply was seen
+        """
+        now = time.monotonic()
+        at = now if at is None else at
+        result = {"timestamp": time.time() - (now - at)}
+        with self._lock:
+            observed = []
+            for axis, filt in self.axes.items():
+                position = filt.predict(at)
+                result[axis] = round(position, 2) if position is not None else None
+                result[f"{axis}_velocity"] = round(filt.velocity_at(at), 2)
+                uncertainty = filt.uncertainty(at)
+                result[f"{axis}_uncertainty"] = (round(uncertainty, 2)
+                                                if uncertainty is not None else None)
+                if filt.observed is not None:
+                    observed.append(filt.observed)
+        result["age"] = round(max(0.0, at - max(observed)), 3) if observed else None
+        return result
@@ -0,0 +1,340 @@
+"""Importer for vendor serial monitor captures (hexdump.txt)
+
+The MultiproductGui serial monitor logs every write and read as a block:
+
+    [20/01/2025 14:26:27] Written data (COM2)
+        3c 03 3a 01 3a 03 3a 53 54 3a 3a 06 3a 47 3e 3c   <.:.:.:ST::.:G><
+        03 3a 01 3a 03 3a 53 54 3a 3a 06 3a 47 3e         .:.:.:ST::.:G>
+
+A block can hold several frames and a frame can continue in a later block
+of the same direction, so the bytes of each direction go through their own
+FrameParser. The capture is read line by line and nothing is kept per
+frame, so captures of any size are imported in constant memory.
+
+The monitor stamps whole seconds, so gaps and turnaround times from a
+capture are quantised to 1 s. CaptureStats accepts frames from the traffic
+journal too (see journal_frames()), which have microsecond timestamps.
+
+    python oe10_hexdump.py summary hexdump.txt
+    python oe10_hexdump.py frames hexdump.txt
+    python oe10_hexdump.py check hexdump.txt     # codec regression, exit 1 on mismatch
+    python oe10_hexdump.py replay hexdump.txt    # requests into the simulator
+"""
+import argparse
+import json
+import sys
+from collections import Counter, deque, namedtuple
+from datetime import datetime
+
+import oe10_codec
+from oe10_journal import DIRECTION_NAMES, RX, TX, JournalRecord
+from oe10_parser import FrameParser
+
+# One write or read block of the capture
+CaptureChunk = namedtuple('CaptureChunk', ['timestamp', 'direction', 'sequence', 'data'])
+
+# One frame, stamped with the block that completed it
+CaptureFrame = namedtuple('CaptureFrame', ['timestamp', 'direction', 'sequence', 'frame'])
+
+_DIRECTIONS = {"Written": TX, "Read": RX}
+_TIME_FORMAT = "%d/%m/%Y %H:%M:%S"
+_HEX_START = 4   # Hex column after four spaces of indent
+_HEX_END = 52    # 16 bytes of "xx " per line, the ASCII column follows
+
+_STATUS_NAMES = {oe10_codec.ACK: " ACK", oe10_codec.NAK: " NAK"}
+
+# Requests awaiting a reply for turnaround matching; older ones are given up
+MAX_PENDING = 64
+
+
+# Capture stamps already parsed, each distinct second is parsed once
+_TIMES = {}
+
+
+def _parse_time(stamp):
+    """Unix time of a capture stamp"""
+    value = _TIMES.get(stamp)
+    if value is None:
+        if len(_TIMES) > 1024:
+            _TIMES.clear()
+        value = _TIMES[stamp] = datetime.strptime(stamp, _TIME_FORMAT).timestamp()
+    return value
+
+
+def _hex_bytes(line):
+    """Bytes of one indented dump line, None if it holds no hex"""
+    try:
+        return bytes.fromhex(line[_HEX_START:_HEX_END])
+    except ValueError:
+        # Not the usual layout, take the leading hex pairs only
+        pairs = []
+        for token in line.split():
+            if len(token) != 2:
+                break
+            pairs.append(token)
+        try:
+            return bytes.fromhex("".join(pairs)) if pairs else None
+        except ValueError:
+            return None
+
+
+def iter_chunks(lines):
+    """Write and read blocks of a capture
+
+    Args:
+        lines (iterable): Lines of the capture, e.g. an open file
+
+    Yields:
+        CaptureChunk: timestamp (unix), direction (TX/RX), block number
+        and the bytes written or read
+    """
+    timestamp = direction = None
+    data = bytearray()
+    sequence = 0
+    for line in lines:
+        if direction is not None and line.startswith("    "):
+            chunk = _hex_bytes(line)
+            if chunk is not None:
+                data += chunk
+                continue
+        if line.startswith("["):
+            if data:
+                yield CaptureChunk(timestamp, direction, sequence, bytes(data))
+                sequence += 1
+                data = bytearray()
+            stamp, _, event = line[1:].partition("] ")
+            kind = event.split(" ", 1)[0]
+            direction = _DIRECTIONS.get(kind) if event.startswith(kind + " data") else None
+            if direction is not None:
+                timestamp = _parse_time(stamp)
+            continue
+        if direction is not None and line.strip():
+            # Any other text ends the block
+            if data:
+                yield CaptureChunk(timestamp, direction, sequence, bytes(data))
+                sequence += 1
+                data = bytearray()
+            direction = None
+    if data:
+        yield CaptureChunk(timestamp, direction, sequence, bytes(data))
+
+
+def iter_frames(chunks):
+    """Frames reassembled per direction from capture blocks
+
+    Args:
+        chunks (iterable): CaptureChunks from iter_chunks()
+
+    Yields:
+        CaptureFrame: with the timestamp of the block completing the frame
+    """
+    parsers = {TX: FrameParser(), RX: FrameParser()}
+    for chunk in chunks:
+        for frame in parsers[chunk.direction].feed(chunk.data):
+            yield CaptureFrame(chunk.timestamp, chunk.direction, chunk.sequence, frame)
+
+
+def read_capture(path):
+    """Frames of a capture file, streamed"""
+    with open(path, errors="replace") as capture:
+        yield from iter_frames(iter_chunks(capture))
+
+
+def journal_records(path):
+    """Capture blocks as JournalRecords, for oe10_journal.replay() and friends"""
+    with open(path, errors="replace") as capture:
+        for chunk in iter_chunks(capture):
+            yield JournalRecord(chunk.timestamp, chunk.timestamp, chunk.direction, chunk.data)
+
+
+def journal_frames(records):
+    """CaptureFrames from JournalRecords, so CaptureStats works on journals"""
+    parsers = {TX: FrameParser(), RX: FrameParser()}
+    for sequence, record in enumerate(records):
+        if record.direction not in parsers:
+            continue  # Raw bytes of a shared line, their frames follow as TX/RX
+        for frame in parsers[record.direction].feed(record.data):
+            yield CaptureFrame(record.timestamp, record.direction, sequence, frame)
+
+
+def reencode(frame):
+    """Encode a frame's fields again with oe10_codec
+
+    A codec regression check: for every frame with a valid checksum the
+    result must equal frame.raw.
+    """
+    if frame.status is None:
+        return oe10_codec.encode_raw(frame.command, frame.payload, frame.to_addr,
+                                     frame.from_addr)
+    return oe10_codec.encode_reply(frame.command, frame.payload, frame.status,
+                                   frame.to_addr, frame.from_addr)
+
+
+class _Distribution:
+    """Count, mean and percentiles from a millisecond histogram"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.histogram = Counter()
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        self.histogram[int(round(value * 1000))] += 1
+
+    def percentile(self, fraction):
+        rank = max(1, int(round(fraction * self.count)))
+        seen = 0
+        for millis in sorted(self.histogram):
+            seen += self.histogram[millis]
+            if seen >= rank:
+                return millis / 1000
+        return None
+
+    def summary(self):
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "min": round(self.min, 6),
+            "mean": round(self.total / self.count, 6),
+            "p50": self.percentile(0.50),
+            "p95": self.percentile(0.95),
+            "max": round(self.max, 6),
+        }
+
+
+class CaptureStats:
+    """Summary statistics over a stream of CaptureFrames
+
+    Only counters and histograms are kept, so memory does not grow with
+    the length of the capture.
+    """
+
+    def __init__(self):
+        self.commands = Counter()      # (direction, command, status) -> frames
+        self.bad_checksums = 0
+        self.naks = Counter()          # command -> NAK replies
+        self.codec_mismatches = 0
+        self.unanswered = 0            # Requests given up without a reply
+        self.unsolicited = 0           # Replies without a pending request
+        self.gaps = _Distribution()    # Between consecutive frames on the line
+        self.turnaround = _Distribution()  # Request to matching reply
+        self.first = None
+        self.last = None
+        self._pending = deque()        # (timestamp, command, to_addr)
+        self._encoded = set()          # Frames already checked against the codec
+
+    def add(self, record):
+        """Account for one CaptureFrame"""
+        stamp, direction, _, frame = record
+        if self.last is not None:
+            self.gaps.add(stamp - self.last if stamp > self.last else 0.0)
+        else:
+            self.first = stamp
+        self.last = stamp
+
+        self.commands[direction, frame.command, frame.status] += 1
+        if not frame.checksum_ok:
+            self.bad_checksums += 1
+            return
+        raw = bytes(frame.raw)
+        if raw not in self._encoded:
+            # Polling repeats the same frames, check each distinct one once
+            if raw != reencode(frame):
+                self.codec_mismatches += 1
+            elif len(self._encoded) < 4096:
+                self._encoded.add(raw)
+        if frame.is_nak:
+            self.naks[frame.command] += 1
+
+        if direction == TX:
+            if len(self._pending) >= MAX_PENDING:
+                self._pending.popleft()
+                self.unanswered += 1
+            self._pending.append((stamp, frame.command, frame.to_addr))
+            return
+
+        # The oldest pending request for this command from this unit
+        for i, (sent, command, to_addr) in enumerate(self._pending):
+            if command == frame.command and to_addr in (frame.from_addr, oe10_codec.BROADCAST_ID):
+                self.turnaround.add(stamp - sent if stamp > sent else 0.0)
+                del self._pending[i]
+                return
+        self.unsolicited += 1
+
+    def summary(self):
+        """Statistics as a JSON-friendly dict"""
+        frames = Counter()
+        commands = {}
+        for (direction, command, status), count in self.commands.most_common():
+            name = DIRECTION_NAMES[direction]
+            frames[name] += count
+            commands[f"{name} {command}{_STATUS_NAMES.get(status, '')}"] = count
+        return {
+            "frames": dict(frames),
+            "duration": round(self.last - self.first, 6) if self.first is not None else None,
+            "commands": commands,
+            "bad_checksums": self.bad_checksums,
+            "codec_mismatches": self.codec_mismatches,
+            "naks": dict(self.naks),
+            "unanswered": self.unanswered + len(self._pending),
+            "unsolicited": self.unsolicited,
+            "inter_frame_gap": self.gaps.summary(),
+            "turnaround": self.turnaround.summary(),
+        }
+
+
+def capture_stats(records):
+    """CaptureStats over an iterable of CaptureFrames"""
+    stats = CaptureStats()
+    for record in records:
+        stats.add(record)
+    return stats
+
+
+def _format(record):
+    frame = record.frame
+    stamp = datetime.fromtimestamp(record.timestamp).isoformat(timespec="seconds")
+    status = _STATUS_NAMES.get(frame.status, "")
+    check = "" if frame.checksum_ok else " BAD CHECKSUM"
+    return (f"{stamp} #{record.sequence} {DIRECTION_NAMES[record.direction]} "
+            f"{frame.from_addr:#04x}->{frame.to_addr:#04x} {frame.command}{status}"
+            f" {bytes(frame.payload).hex(' ')}{check}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import vendor serial monitor captures")
+    parser.add_argument("command", choices=["summary", "frames", "check", "replay"])
+    parser.add_argument("path", nargs="?", default="hexdump.txt")
+    args = parser.parse_args()
+
+    if args.command == "summary":
+        print(json.dumps(capture_stats(read_capture(args.path)).summary(), indent=2))
+    elif args.command == "frames":
+        for record in read_capture(args.path):
+            print(_format(record))
+    elif args.command == "check":
+        failures = 0
+        for record in read_capture(args.path):
+            frame = record.frame
+            if not frame.checksum_ok or bytes(frame.raw) != reencode(frame):
+                failures += 1
+                print(f"MISMATCH {_format(record)}")
+        print(f"{failures} mismatching frame(s)")
+        sys.exit(1 if failures else 0)
+    else:
+        from oe10_journal import replay
+        from oe10_simulator import OE10Device
+        print(replay(journal_records(args.path), OE10Device()))
+
+
+if __name__ == "__main__":
+    main()
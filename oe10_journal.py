@@ -0,0 +1,360 @@
+"""Binary journal of all serial traffic
+
+Recording appends (timestamp, direction, bytes) to an in-memory ring, which
+costs the control path one deque append and no lock. A writer thread drains
+the ring into append-only journal files:
+
+    header   "OE10JRN" + version byte, wall clock and monotonic start time
+    records  <monotonic f64><direction u8><length u16><bytes>
+
+Every file has an .idx sidecar of <monotonic f64><offset u64> entries, one
+per index interval, so readers mmap the journal, bisect the index and only
+scan the records of the requested time range. Files are rotated by size, so days of traffic stay searchable.
+
+UNKNOWN records hold raw bytes of a shared line whose direction cannot be
+told (see oe10_monitor). The frames in them are recorded again as TX/RX,
+so frame readers skip them.
+
+    python oe10_journal.py dump journal/ --start 2024-05-01T10:00 --frames
+    python oe10_journal.py replay journal/oe10-20240501-100000.oe10j
+"""
+import argparse
+import bisect
+import glob
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import deque, namedtuple
+from datetime import datetime
+
+from oe10_parser import FrameParser
+
+logger = logging.getLogger(__name__)
+
+TX = 0
+RX = 1
+UNKNOWN = 2
+DIRECTION_NAMES = {TX: "tx", RX: "rx", UNKNOWN: "unknown"}
+
+MAGIC = b"OE10JRN"
+VERSION = 1
+_HEADER = struct.Struct("<7sBdd")    # magic, version, wall start, monotonic start
+_RECORD = struct.Struct("<dBH")      # monotonic, direction, length
+_INDEX = struct.Struct("<dQ")        # monotonic, file offset
+EXTENSION = ".oe10j"
+
+JournalRecord = namedtuple('JournalRecord', ['timestamp', 'monotonic', 'direction', 'data'])
+
+
+class Journal:
+    """Records serial traffic with a background writer thread"""
+
+    def __init__(self, directory, prefix="oe10", max_bytes=64 << 20, capacity=65536,
+                 flush_interval=0.2, index_interval=1.0):
+        """Create a journal, start() begins writing
+
+        Args:
+            directory (str): Directory for the journal files
+            prefix (str): File name prefix
+            max_bytes (int): Start a new file beyond this size
+            capacity (int): Records held in memory, newer records are
+                dropped (and counted) while the ring is full
+            flush_interval (float): Seconds between writes to disk
+            index_interval (float): Seconds of traffic per index entry
+        """
+        self.directory = directory
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.index_interval = index_interval
+
+        self.recorded = 0
+        self.dropped = 0
+        self.written = 0
+        self.path = None
+
+        self._ring = deque()
+        self._file = None
+        self._index = None
+        self._last_indexed = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def record(self, direction, data, stamp=None):
+        """Queue bytes sent (TX) or received (RX), safe from any thread
+
+        Args:
+            stamp (float): time.monotonic() the bytes were seen at, defaults to now
+        """
+        if len(self._ring) >= self.capacity:
+            self.dropped += 1
+            return
+        self._ring.append((time.monotonic() if stamp is None else stamp, direction, bytes(data)))
+        self.recorded += 1
+
+    def start(self):
+        """Start the writer thread"""
+        if self._thread and self._thread.is_alive():
+            return self
+        os.makedirs(self.directory, exist_ok=True)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="oe10-journal", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        """Write everything still queued and close the files"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self._close_file()
+
+    def stats(self):
+        return {"recorded": self.recorded, "written": self.written, "dropped": self.dropped,
+                "queued": len(self._ring), "path": self.path}
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self._drain()
+        self._drain()
+
+    def _drain(self):
+        if not self._ring:
+            return
+        try:
+            if self._file is None or self._file.tell() >= self.max_bytes:
+                self._open_file()
+            buffer = bytearray()
+            offset = self._file.tell()
+            index = bytearray()
+            while self._ring:
+                stamp, direction, data = self._ring.popleft()
+                if self._last_indexed is None or stamp - self._last_indexed >= self.index_interval:
+                    index += _INDEX.pack(stamp, offset + len(buffer))
+                    self._last_indexed = stamp
+                buffer += _RECORD.pack(stamp, direction, len(data))
+                buffer += data
+                self.written += 1
+            self._file.write(buffer)
+            self._file.flush()
+            if index:
+                self._index.write(index)
+                self._index.flush()
+        except OSError as e:
+            logger.error(f"Journal write failed: {e}")
+
+    def _open_file(self):
+        self._close_file()
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(self.directory, f"{self.prefix}-{stamp}{EXTENSION}")
+        counter = 1
+        while os.path.exists(path):
+            path = os.path.join(self.directory, f"{self.prefix}-{stamp}-{counter}{EXTENSION}")
+            counter += 1
+        self._file = open(path, "wb")
+        self._file.write(_HEADER.pack(MAGIC, VERSION, time.time(), time.monotonic()))
+        self._index = open(path + ".idx", "wb")
+        self._last_indexed = None
+        self.path = path
+        logger.info(f"Journal writing to {path}")
+
+    def _close_file(self):
+        for handle in (self._file, self._index):
+            if handle:
+                handle.close()
+        self._file = self._index = None
+
+
+class JournalReader:
+    """Memory-mapped reader for one journal file
+
+    Sees the file as it was when opened, a file that is still being
+    written ends at the last complete record.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.wall_start, self.monotonic_start = _HEADER.unpack_from(self._data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not an OE10 journal (version {VERSION})")
+
+        self._index = []
+        self._offsets = []
+        if os.path.exists(path + ".idx"):
+            with open(path + ".idx", "rb") as f:
+                raw = f.read()
+            for stamp, offset in _INDEX.iter_unpack(raw[:len(raw) - len(raw) % _INDEX.size]):
+                self._index.append(stamp)
+                self._offsets.append(offset)
+
+    def close(self):
+        self._data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def to_wall(self, monotonic):
+        return self.wall_start + (monotonic - self.monotonic_start)
+
+    def to_monotonic(self, wall):
+        return self.monotonic_start + (wall - self.wall_start)
+
+    @property
+    def end(self):
+        """Wall clock time of the last indexed record (approximate file end)"""
+        return self.to_wall(self._index[-1]) if self._index else self.wall_start
+
+    def records(self, start=None, end=None):
+        """Records between two wall clock times
+
+        Args:
+            start (float): Unix time, None for the beginning of the file
+            end (float): Unix time, None for the end of the file
+
+        Yields:
+            JournalRecord: timestamp (unix), monotonic, direction, data
+        """
+        offset = _HEADER.size
+        start_mono = self.to_monotonic(start) if start is not None else None
+        end_mono = self.to_monotonic(end) if end is not None else None
+        if start_mono is not None and self._index:
+            position = bisect.bisect_right(self._index, start_mono) - 1
+            if position >= 0:
+                offset = self._offsets[position]
+
+        data = self._data
+        size = len(data)
+        while offset + _RECORD.size <= size:
+            stamp, direction, length = _RECORD.unpack_from(data, offset)
+            body = offset + _RECORD.size
+            if body + length > size:
+                break  # Record still being written
+            offset = body + length
+            if start_mono is not None and stamp < start_mono:
+                continue
+            if end_mono is not None and stamp > end_mono:
+                break
+            yield JournalRecord(self.to_wall(stamp), stamp, direction, data[body:offset])
+
+    def frames(self, start=None, end=None):
+        """Frames reassembled per direction from the recorded chunks
+
+        Yields:
+            tuple: (JournalRecord of the chunk completing the frame, Frame)
+        """
+        parsers = {TX: FrameParser(), RX: FrameParser()}
+        for record in self.records(start, end):
+            if record.direction in parsers:
+                for frame in parsers[record.direction].feed(record.data):
+                    yield record, frame
+
+
+def journal_files(directory, start=None, end=None):
+    """Journal files in a directory overlapping a time range, oldest first"""
+    paths = sorted(glob.glob(os.path.join(directory, f"*{EXTENSION}")))
+    selected = []
+    for i, path in enumerate(paths):
+        with JournalReader(path) as reader:
+            file_start, file_end = reader.wall_start, reader.end
+        if i + 1 < len(paths):
+            # A file ends where the next one starts
+            with JournalReader(paths[i + 1]) as following:
+                file_end = max(file_end, following.wall_start)
+        elif end is None or file_end < end:
+            file_end = float("inf")  # Possibly still being written
+        if (end is None or file_start <= end) and (start is None or file_end >= start):
+            selected.append(path)
+    return selected
+
+
+def read_range(path, start=None, end=None):
+    """Records of a journal file or directory between two unix times"""
+    paths = journal_files(path, start, end) if os.path.isdir(path) else [path]
+    for file_path in paths:
+        with JournalReader(file_path) as reader:
+            yield from reader.records(start, end)
+
+
+def replay(records, device):
+    """Feed recorded requests to a simulated device and compare the replies
+
+    Args:
+        records (iterable): JournalRecords, e.g. from read_range()
+        device: oe10_simulator.OE10Device
+
+    Returns:
+        dict: requests replayed, replies matching and differing commands
+    """
+    parsers = {TX: FrameParser(), RX: FrameParser()}
+    pending = deque()
+    result = {"requests": 0, "matched": 0, "different": 0, "unanswered": 0}
+    for record in records:
+        if record.direction not in parsers:
+            continue
+        for frame in parsers[record.direction].feed(record.data):
+            if record.direction == TX:
+                result["requests"] += 1
+                pending.append(device.handle(frame))
+            elif pending:
+                expected = pending.popleft()
+                if expected is None:
+                    result["unanswered"] += 1
+                elif bytes(frame.raw) == expected:
+                    result["matched"] += 1
+                else:
+                    result["different"] += 1
+    return result
+
+
+def _parse_time(value):
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect OE10 traffic journals")
+    parser.add_argument("command", choices=["dump", "replay"])
+    parser.add_argument("path", help="journal file or directory")
+    parser.add_argument("--start", type=_parse_time, help="unix time or ISO date")
+    parser.add_argument("--end", type=_parse_time, help="unix time or ISO date")
+    parser.add_argument("--frames", action="store_true", help="dump parsed frames, not chunks")
+    args = parser.parse_args()
+
+    records = read_range(args.path, args.start, args.end)
+    if args.command == "replay":
+        from oe10_simulator import OE10Device
+        print(replay(records, OE10Device()))
+        return
+
+    if not args.frames:
+        for record in records:
+            stamp = datetime.fromtimestamp(record.timestamp).isoformat(timespec="milliseconds")
+            print(f"{stamp} {DIRECTION_NAMES[record.direction]} {record.data.hex(' ')}")
+        return
+
+    parsers = {TX: FrameParser(), RX: FrameParser()}
+    for record in records:
+        if record.direction not in parsers:
+            continue
+        for frame in parsers[record.direction].feed(record.data):
+            stamp = datetime.fromtimestamp(record.timestamp).isoformat(timespec="milliseconds")
+            status = " ACK" if frame.is_ack else " NAK" if frame.is_nak else ""
+            check = "" if frame.checksum_ok else " BAD CHECKSUM"
+            print(f"{stamp} {DIRECTION_NAMES[record.direction]} {frame.command}{status}"
+                  f" {bytes(frame.payload).hex(' ')}{check}")
+
+
+if __name__ == "__main__":
+    main()
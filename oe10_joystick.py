@@ -0,0 +1,152 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+MAX_SPEED = 0x64
+
+# (pan_direction, tilt_direction, pan_speed, tilt_speed) with both axes stopped
+STOPPED = (0, 0, 0, 0)
+
+
+def velocity_command(pan, tilt):
+    """PC arguments for a velocity setpoint
+
+    Args:
+        pan (float): -100 (full left) to 100 (full right)
+        tilt (float): -100 (full down) to 100 (full up)
+
+    Returns:
+        tuple: pan_direction, tilt_direction, pan_speed, tilt_speed as taken
+        by OE10Protocol.proportional_control()
+    """
+    pan_speed = min(MAX_SPEED, int(round(abs(pan))))
+    tilt_speed = min(MAX_SPEED, int(round(abs(tilt))))
+    pan_direction = (1 if pan < 0 else 2) if pan_speed else 0
+    tilt_direction = (1 if tilt > 0 else 2) if tilt_speed else 0
+    return pan_direction, tilt_direction, pan_speed, tilt_speed
+
+
+class JoystickController:
+    """Turns a stream of velocity setpoints into as few PC commands as possible
+
+    Setpoints only replace the latest target, at most one PC command is sent
+    per send slot and only when it differs from the last one the device
+    accepted, so any setpoint rate costs at most `rate` frames per second
+    and holding a direction costs none. The deadman stops the head when no
+    setpoint has arrived for `deadman` seconds.
+    """
+
+    def __init__(self, device, stop_device=None, rate=20.0, deadman=0.5, on_command=None):
+        """Create a joystick controller, its thread starts with the first setpoint
+
+        Args:
+            device: OE10Protocol or a proxy with the same methods
+            stop_device: Same as device, used for stops (e.g. a proxy on
+                the scheduler's stop lane), defaults to device
+            rate (float): Maximum PC commands per second
+            deadman (float): Seconds without a setpoint before stopping
+            on_command (callable): Called after every command sent, e.g.
+                StatusPoller.invalidate
+        """
+        self.device = device
+        self.stop_device = stop_device or device
+        self.slot = 1.0 / rate
+        self.deadman = deadman
+        self.on_command = on_command
+
+        self.setpoints = 0
+        self.commands = 0
+        self.deadman_stops = 0
+        self.errors = 0
+
+        self._setpoint = (0.0, 0.0)
+        self._received = 0.0
+        self._sent = None  # Last command the device accepted, None if unknown
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def active(self):
+        """True once setpoints have started the send thread"""
+        return self._thread is not None
+
+    def update(self, pan=0.0, tilt=0.0):
+        """Set the velocity, see velocity_command() for the ranges"""
+        with self._lock:
+            self._setpoint = (float(pan), float(tilt))
+            self._received = time.monotonic()
+            self.setpoints += 1
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="oe10-joystick",
+                                                daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def release(self):
+        """Stop both axes at the next send slot"""
+        self.update(0.0, 0.0)
+
+    def stats(self):
+        """Counters and the current command"""
+        with self._lock:
+            return {
+                "setpoints": self.setpoints,
+                "commands": self.commands,
+                "coalesced": max(0, self.setpoints - self.commands),
+                "deadman_stops": self.deadman_stops,
+                "errors": self.errors,
+                "setpoint": {"pan": self._setpoint[0], "tilt": self._setpoint[1]},
+                "command": list(self._sent) if self._sent else None,
+            }
+
+    def stop(self, timeout=None):
+        """Stop the send thread (the head is not stopped)"""
+        self._stop.set()
+        self._wake.set()
+        thread = self._thread
+        if thread:
+            thread.join(timeout)
+        with self._lock:
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            self._wake.clear()
+            with self._lock:
+                setpoint = self._setpoint
+                expired = started - self._received > self.deadman
+
+            command = STOPPED if expired else velocity_command(*setpoint)
+            if command != self._sent:
+                if expired and self._sent != STOPPED:
+                    self.deadman_stops += 1
+                    logger.warning(f"No setpoint for {self.deadman}s, stopping")
+                self._send(command)
+
+            if self._sent == STOPPED and (expired or command == STOPPED):
+                # Idle until the next setpoint
+                self._wake.wait()
+            else:
+                self._stop.wait(max(0.0, self.slot - (time.monotonic() - started)))
+
+    def _send(self, command):
+        device = self.stop_device if command == STOPPED else self.device
+        try:
+            accepted = device.proportional_control(*command)
+        except Exception as e:
+            accepted = False
+            logger.error(f"Joystick command failed: {e}")
+        if accepted:
+            self._sent = command
+            self.commands += 1
+            if self.on_command:
+                self.on_command()
+        else:
+            # Try again in the next slot
+            self.errors += 1
@@ -0,0 +1,240 @@
+"""Connection management: keep the OE10 link up from a background thread
+
+SerialLink opens the port, runs the resync handshake (ST, then AS) and
+watches the link. It is declared down when:
+- the device node disappears (USB adapter unplugged)
+- the port reports an I/O error
+- `max_failures` requests in a row get no reply
+
+While down, the port is closed and every command raises
+oe10_transport.LinkDown at once, so request threads never wait on I/O.
+The thread reopens the port with exponential backoff. Each attempt
+looks the port up again with serial.tools.list_ports, so an adapter
+that comes back under another name (/dev/ttyUSB1 instead of
+/dev/ttyUSB0) is found by its USB id, serial number or description.
+"""
+import logging
+import os
+import random
+import threading
+import time
+
+import serial
+import serial.tools.list_ports
+
+logger = logging.getLogger(__name__)
+
+LINK_DOWN = "down"
+LINK_CONNECTING = "connecting"
+LINK_UP = "up"
+
+
+def _matches(info, match):
+    match = match.lower()
+    fields = (info.device, info.hwid, info.description, info.serial_number,
+              info.manufacturer, info.product)
+    if any(field and match in str(field).lower() for field in fields):
+        return True
+    if info.vid is not None and info.pid is not None:
+        return match == f"{info.vid:04x}:{info.pid:04x}"
+    return False
+
+
+def discover_port(port, match=None):
+    """Port to open now
+
+    Args:
+        port (str): Configured port, a device path or a pyserial URL
+        match (str): Text identifying the adapter in list_ports, e.g. a
+            USB id ("0403:6001"), serial number or description ("FT232R")
+
+    Returns:
+        str: `port` if it is a URL or present, else the first port
+        matching `match`, None if there is none
+    """
+    if "://" in port or os.path.exists(port):
+        return port
+    if match:
+        for info in serial.tools.list_ports.comports():
+            if _matches(info, match):
+                return info.device
+    return None
+
+
+class SerialLink:
+    """Opens an OE10Protocol and reconnects it whenever the link drops"""
+
+    def __init__(self, port, factory, match=None, check_interval=0.5, max_failures=3,
+                 initial_backoff=0.5, max_backoff=30.0, on_up=None, on_down=None):
+        """Create a link manager, start() begins connecting
+
+        Args:
+            port (str): Serial port or pyserial URL
+            factory (callable): factory(port) returns a new OE10Protocol,
+                called for the first connection only, later ones reopen it
+            match (str): Find the adapter under another name, see discover_port()
+            check_interval (float): Seconds between health checks
+            max_failures (int): Requests in a row without a reply that
+                take the link down
+            initial_backoff (float): Seconds before the first reconnect attempt
+            max_backoff (float): Upper limit for the delay between attempts
+            on_up (callable): on_up(controller, reconnect) after the
+                handshake, before the link is reported up
+            on_down (callable): on_down(controller, reason) after the port
+                was closed
+        """
+        self.configured = port
+        self.port = port     # Port in use, may differ after discovery
+        self.factory = factory
+        self.match = match
+        self.check_interval = check_interval
+        self.max_failures = max_failures
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.on_up = on_up
+        self.on_down = on_down
+
+        self.controller = None
+        self.state = LINK_DOWN
+        self.error = None
+        self.since = time.time()
+        self.attempts = 0    # Failed attempts since the link was last up
+        self.reconnects = 0
+        self.next_attempt = None
+
+        self._io_errors = 0
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def is_up(self):
+        return self.state == LINK_UP
+
+    def start(self):
+        """Start connecting in the background, returns at once"""
+        if self._thread and self._thread.is_alive():
+            return self
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="oe10-link", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """Stop the thread, the controller is left to the caller to close"""
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def wait_up(self, timeout):
+        """Wait up to timeout seconds for the link, returns is_up"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while not self.is_up and not self._stop.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+        return self.is_up
+
+    def status(self):
+        """Link state for the API"""
+        result = {
+            "state": self.state,
+            "port": self.port,
+            "since": self.since,
+            "reconnects": self.reconnects,
+        }
+        if not self.is_up:
+            result["error"] = self.error
+            result["attempts"] = self.attempts
+            if self.next_attempt is not None:
+                result["retry_in"] = round(max(0.0, self.next_attempt - time.monotonic()), 1)
+        return result
+
+    def _set_state(self, state, error=None):
+        with self._cond:
+            self.state = state
+            self.error = error
+            self.since = time.time()
+            self._cond.notify_all()
+
+    def _run(self):
+        backoff = self.initial_backoff
+        while not self._stop.is_set():
+            if self.is_up:
+                reason = self._check()
+                if reason is None:
+                    self._stop.wait(self.check_interval)
+                    continue
+                self._lost(reason)
+                backoff = self.initial_backoff
+
+            self._set_state(LINK_CONNECTING, self.error)
+            error = self._connect()
+            if error is None:
+                backoff = self.initial_backoff
+                continue
+            self.attempts += 1
+            self._set_state(LINK_DOWN, error)
+            # Jitter keeps several workers from retrying in lock step
+            delay = backoff * random.uniform(0.8, 1.2)
+            self.next_attempt = time.monotonic() + delay
+            logger.info(f"Link to {self.port} down ({error}), retrying in {delay:.1f}s")
+            backoff = min(backoff * 2, self.max_backoff)
+            self._stop.wait(delay)
+        self.next_attempt = None
+
+    def _connect(self):
+        """One connection attempt, returns None on success or the error text"""
+        port = discover_port(self.configured, self.match)
+        if port is None:
+            return f"{self.configured} not found"
+        reconnect = self.controller is not None
+        try:
+            if reconnect:
+                self.controller.reopen(port)
+            else:
+                self.controller = self.factory(port)
+            if not self.controller.resync():
+                raise ConnectionError("no reply to ST/AS")
+            if self.on_up:
+                self.on_up(self.controller, reconnect)
+        except Exception as e:
+            if self.controller is not None:
+                self.controller.disconnect()
+            return str(e)
+
+        self.port = port
+        self.attempts = 0
+        self.next_attempt = None
+        self._io_errors = self.controller.transport.io_errors
+        if reconnect:
+            self.reconnects += 1
+        self._set_state(LINK_UP)
+        logger.info(f"Link to {port} up" + (" again" if reconnect else ""))
+        return None
+
+    def _check(self):
+        """Reason the link is down, None while it is healthy"""
+        transport = self.controller.transport
+        if self.port.startswith("/dev/") and not os.path.exists(self.port):
+            return f"{self.port} disappeared"
+        if transport.io_errors != self._io_errors:
+            return f"I/O error: {transport.last_error}"
+        if transport.failure_streak >= self.max_failures:
+            return f"{transport.failure_streak} requests in a row without a reply"
+        return None
+
+    def _lost(self, reason):
+        logger.warning(f"Link to {self.port} lost: {reason}")
+        self.controller.disconnect()
+        self._set_state(LINK_DOWN, reason)
+        if self.on_down:
+            try:
+                self.on_down(self.controller, reason)
+            except Exception as e:
+                logger.error(f"Link down handler failed: {e}")
@@ -0,0 +1,269 @@
+"""Counters and latency histograms in the Prometheus text format
+
+Metrics are plain in-process objects: recording is a bucket lookup and an
+addition under an uncontended lock, nothing is formatted until a scrape
+calls Registry.render(). With REGISTRY.enabled set to False (app.py reads
+OE10_METRICS=0) every record call returns right away.
+
+The serial metrics below are recorded by FrameTransport, AsyncOE10Protocol
+and CommandScheduler; app.py adds the HTTP ones and serves /metrics.
+"""
+import bisect
+import threading
+
+# Seconds, one OE10 frame takes about 15 ms on the wire at 9600 baud
+SERIAL_BUCKETS = (0.005, 0.01, 0.02, 0.03, 0.05, 0.075, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# NAK error byte bits (oe10_codec.NAK_*) as label values
+NAK_REASONS = (
+    (0x01, "other_controller"),
+    (0x08, "not_available"),
+    (0x10, "not_recognised"),
+    (0x20, "timed_out"),
+)
+
+
+def nak_reasons(code):
+    """Names of the NAK error bits set in `code`, ["unknown"] if none is
+
+    Args:
+        code (int): Error byte of a NAK reply, None if it had none
+    """
+    code = code or 0
+    return [name for bit, name in NAK_REASONS if code & bit] or ["unknown"]
+
+
+_ADDRESSES = tuple(f"{address:#04x}" for address in range(256))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, registry, name, documentation, labelnames):
+        self._registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def _labels(self, values, extra=()):
+        pairs = list(zip(self.labelnames, values)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+    def clear(self):
+        with self._lock:
+            self._children.clear()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            children = sorted((labels, list(value) if isinstance(value, list) else value)
+                              for labels, value in self._children.items())
+        lines.extend(self._samples(children))
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonic count per label set"""
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        if not self._registry.enabled:
+            return
+        with self._lock:
+            self._children[labels] = self._children.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._children.get(labels, 0)
+
+    def _samples(self, children):
+        for labels, value in children:
+            yield f"{self.name}{self._labels(labels)} {_format_value(value)}"
+
+
+class Gauge(_Metric):
+    """Current value per label set"""
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        if not self._registry.enabled:
+            return
+        with self._lock:
+            self._children[labels] = value
+
+    def value(self, *labels):
+        return self._children.get(labels, 0)
+
+    def _samples(self, children):
+        for labels, value in children:
+            yield f"{self.name}{self._labels(labels)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    """Bucketed distribution per label set"""
+    kind = "histogram"
+
+    def __init__(self, registry, name, documentation, labelnames, buckets):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        if not self._registry.enabled:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            child = self._children.get(labels)
+            if child is None:
+                # Per bucket counts, the +Inf bucket, then the sum
+                child = self._children[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            child[index] += 1
+            child[-1] += value
+
+    def count(self, *labels):
+        child = self._children.get(labels)
+        return sum(child[:-1]) if child else 0
+
+    def _samples(self, children):
+        bounds = self.buckets + (float("inf"),)
+        for labels, child in children:
+            cumulative = 0
+            for bound, count in zip(bounds, child):
+                cumulative += count
+                le = (("le", _format_value(float(bound))),)
+                yield f"{self.name}_bucket{self._labels(labels, le)} {cumulative}"
+            yield f"{self.name}_sum{self._labels(labels)} {_format_value(child[-1])}"
+            yield f"{self.name}_count{self._labels(labels)} {cumulative}"
+
+
+class Registry:
+    """Set of metrics rendered together"""
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._add(Counter(self, name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._add(Gauge(self, name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=SERIAL_BUCKETS):
+        return self._add(Histogram(self, name, documentation, labelnames, buckets))
+
+    def clear(self):
+        """Forget all recorded values"""
+        for metric in self._metrics:
+            metric.clear()
+
+    def render(self, metrics=None):
+        """Metrics in the Prometheus text exposition format (0.0.4)
+
+        Args:
+            metrics (iterable): Metrics to include, defaults to all
+        """
+        lines = []
+        for metric in self._metrics if metrics is None else metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+COMMAND_DURATION = REGISTRY.histogram(
+    "oe10_command_duration_seconds",
+    "Time from first send to the reply, retransmissions included",
+    ("command", "address"))
+COMMANDS = REGISTRY.counter(
+    "oe10_commands_total",
+    "Completed requests by result (ack, nak, timeout)",
+    ("command", "address", "result"))
+NAKS = REGISTRY.counter(
+    "oe10_nak_total",
+    "NAK replies by error bit",
+    ("command", "address", "reason"))
+CHECKSUM_ERRORS = REGISTRY.counter(
+    "oe10_checksum_errors_total",
+    "Reply frames received with a bad checksum",
+    ("address",))
+RETRANSMITS = REGISTRY.counter(
+    "oe10_retransmits_total",
+    "Requests sent again after a lost or damaged reply",
+    ("command", "address"))
+REPLY_TIMEOUT = REGISTRY.gauge(
+    "oe10_reply_timeout_seconds",
+    "Current adaptive reply deadline, smoothed RTT plus four deviations",
+    ("command", "address"))
+MISROUTED = REGISTRY.counter(
+    "oe10_misrouted_total",
+    "Replies dropped because they came from another unit")
+QUEUE_WAIT = REGISTRY.histogram(
+    "oe10_scheduler_wait_seconds",
+    "Time jobs spent queued before the I/O thread ran them",
+    ("lane",))
+QUEUE_DEPTH = REGISTRY.gauge(
+    "oe10_scheduler_queue_depth",
+    "Jobs waiting per scheduler lane",
+    ("lane",))
+QUEUE_EXPIRED = REGISTRY.counter(
+    "oe10_scheduler_expired_total",
+    "Jobs dropped because their deadline passed before they ran",
+    ("lane",))
+HTTP_DURATION = REGISTRY.histogram(
+    "oe10_http_request_duration_seconds",
+    "HTTP request handling time by route",
+    ("route", "method", "status"),
+    buckets=HTTP_BUCKETS)
+
+# Everything recorded next to the serial port (the daemon's share of /metrics)
+SERIAL_METRICS = (COMMAND_DURATION, COMMANDS, NAKS, CHECKSUM_ERRORS, RETRANSMITS, REPLY_TIMEOUT,
+                  MISROUTED, QUEUE_WAIT, QUEUE_DEPTH, QUEUE_EXPIRED)
+
+
+def address_label(address):
+    """Label value for a unit address, e.g. 0x03"""
+    return _ADDRESSES[address & 0xFF]
+
+
+def observe_command(command, address, reply, seconds):
+    """Record the outcome of one request
+
+    Args:
+        command (str): Two letter command
+        address (int): Unit the request was sent to
+        reply (Frame): Reply with a valid checksum, None on timeout
+        seconds (float): Time from the first send to the reply
+    """
+    if not REGISTRY.enabled:
+        return
+    address = _ADDRESSES[address & 0xFF]
+    if reply is None:
+        COMMANDS.inc(command, address, "timeout")
+        return
+    COMMAND_DURATION.observe(seconds, command, address)
+    if reply.is_nak:
+        COMMANDS.inc(command, address, "nak")
+        for reason in nak_reasons(reply.error_code):
+            NAKS.inc(command, address, reason)
+    else:
+        COMMANDS.inc(command, address, "ack")
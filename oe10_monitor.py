@@ -0,0 +1,231 @@
+"""Passive bus monitor: capture OE10 traffic without taking part in it
+
+Listens on one port, or on two for a full-duplex tap (one adapter on the
+controller's TX line, one on the unit's TX line). Nothing is ever written.
+One reader thread waits on all ports with a selector and reads whatever
+arrived in one call. Each burst is stamped with time.monotonic() at
+reception and queued to a Journal, whose writer thread stores it, so the
+reader does no disk I/O and keeps up at 115200 baud.
+
+With a tap, every burst is recorded as it was read, TX from the first
+port and RX from the second. With one port, both directions share the
+wire: each burst is recorded as read with direction UNKNOWN, so garbled
+and partial traffic is kept, and the frames reassembled from it are
+recorded again one by one, requests as TX and ACK/NAK replies as RX.
+
+Captures are journal files (see oe10_journal), so the journal tools and
+the statistics of oe10_hexdump work on them:
+
+    python oe10_monitor.py /dev/ttyUSB0 /dev/ttyUSB1 --baudrate 115200 --out capture/ --live
+    python oe10_journal.py dump capture/ --frames
+"""
+import argparse
+import json
+import logging
+import selectors
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import serial
+
+import oe10_parser
+from oe10_hexdump import capture_stats, journal_frames
+from oe10_journal import DIRECTION_NAMES, RX, TX, UNKNOWN, Journal, read_range
+from oe10_metrics import nak_reasons
+from oe10_parser import FrameParser
+
+logger = logging.getLogger(__name__)
+
+# Frames kept for the live view, older ones are skipped when it falls behind
+LIVE_CAPACITY = 4096
+
+_DECODERS = {
+    "ST": oe10_parser.decode_status,
+    "AS": oe10_parser.decode_pan_tilt_status,
+    "ED": oe10_parser.decode_error_diagnosis,
+}
+
+
+class BusMonitor:
+    """Records everything received on one or two ports"""
+
+    def __init__(self, ports, baudrate=9600, journal=None, live=False):
+        """Open the ports
+
+        Args:
+            ports (list): One port, or two for a tap (controller side first)
+            baudrate (int): Line speed
+            journal (Journal): Started journal to record into, None to only
+                decode and count
+            live (bool): Keep decoded frames for live_frames()
+        """
+        if not 1 <= len(ports) <= 2:
+            raise ValueError("Monitor one port, or two for a full-duplex tap")
+        self.journal = journal
+        self.tap = len(ports) == 2
+        self.live = deque(maxlen=LIVE_CAPACITY) if live else None
+
+        self.ports = []
+        for port in ports:
+            link = serial.serial_for_url(port, baudrate=baudrate, bytesize=serial.EIGHTBITS,
+                                         parity=serial.PARITY_NONE,
+                                         stopbits=serial.STOPBITS_ONE, timeout=0)
+            try:
+                # USB adapters otherwise hold bytes back for up to 16 ms
+                link.set_low_latency_mode(True)
+            except (AttributeError, NotImplementedError, ValueError, OSError):
+                pass
+            self.ports.append(link)
+        self.parsers = [FrameParser() for _ in self.ports]
+
+        self.bytes = [0] * len(self.ports)
+        self.bursts = 0
+        self.frames = {TX: 0, RX: 0}
+        self.bad_checksums = 0
+
+        self._selector = selectors.DefaultSelector()
+        for index, link in enumerate(self.ports):
+            self._selector.register(link.fileno(), selectors.EVENT_READ, index)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the reader thread"""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="oe10-monitor", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop reading and close the ports"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self._selector.close()
+        for link in self.ports:
+            link.close()
+
+    def _run(self):
+        while not self._stop.is_set():
+            for key, _ in self._selector.select(0.2):
+                index = key.data
+                link = self.ports[index]
+                try:
+                    chunk = link.read(link.in_waiting or 1)
+                except (serial.SerialException, OSError) as e:
+                    # e.g. the USB adapter was unplugged
+                    logger.error(f"Monitor read on {link.port} failed: {e}")
+                    self._stop.set()
+                    return
+                if chunk:
+                    self._received(index, chunk, time.monotonic())
+
+    def _received(self, index, chunk, stamp):
+        self.bursts += 1
+        self.bytes[index] += len(chunk)
+        frames = self.parsers[index].feed(chunk)
+        # On a shared line the direction is only known per frame
+        direction = (TX if index == 0 else RX) if self.tap else UNKNOWN
+        if self.journal is not None:
+            self.journal.record(direction, chunk, stamp)
+        for frame in frames:
+            if not self.tap:
+                direction = TX if frame.status is None else RX
+                if self.journal is not None:
+                    self.journal.record(direction, frame.raw, stamp)
+            self.frames[direction] += 1
+            if not frame.checksum_ok:
+                self.bad_checksums += 1
+            if self.live is not None:
+                self.live.append((stamp, direction, frame))
+
+    def live_frames(self):
+        """Decoded frames received since the last call, oldest first"""
+        frames = []
+        while self.live:
+            frames.append(self.live.popleft())
+        return frames
+
+    def stats(self):
+        result = {
+            "ports": [link.port for link in self.ports],
+            "bytes": list(self.bytes),
+            "bursts": self.bursts,
+            "frames": {DIRECTION_NAMES[d]: count for d, count in self.frames.items()},
+            "bad_checksums": self.bad_checksums,
+            "resync_bytes": sum(parser.dropped for parser in self.parsers),
+        }
+        if self.journal is not None:
+            result["journal"] = self.journal.stats()
+        return result
+
+
+def describe(stamp, direction, frame, origin):
+    """One line for the live view
+
+    Args:
+        stamp (float): time.monotonic() of the burst completing the frame
+        origin (tuple): (wall clock, monotonic) pair to convert stamp with
+    """
+    wall = origin[0] + (stamp - origin[1])
+    line = (f"{datetime.fromtimestamp(wall).isoformat(timespec='microseconds')} "
+            f"{DIRECTION_NAMES[direction]} {frame.from_addr:#04x}->{frame.to_addr:#04x} "
+            f"{frame.command}")
+    if frame.is_ack:
+        line += " ACK"
+    elif frame.is_nak:
+        return f"{line} NAK {', '.join(nak_reasons(frame.error_code))}"
+    if not frame.checksum_ok:
+        return f"{line} {bytes(frame.payload).hex(' ')} BAD CHECKSUM"
+    decoder = _DECODERS.get(frame.command) if frame.is_ack else None
+    if decoder is not None and frame.payload:
+        try:
+            return f"{line} {decoder(frame.payload)}"
+        except (ValueError, IndexError):
+            pass
+    return f"{line} {bytes(frame.payload).hex(' ')}".rstrip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Passively capture OE10 serial traffic")
+    parser.add_argument("ports", nargs="+", help="port to listen on, or two for a tap "
+                                                 "(controller TX first)")
+    parser.add_argument("--baudrate", type=int, default=9600)
+    parser.add_argument("--out", help="directory for the capture files (journal format)")
+    parser.add_argument("--live", action="store_true", help="print decoded frames")
+    parser.add_argument("--duration", type=float, help="stop after this many seconds")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    journal = None
+    if args.out:
+        # A minute of back to back bursts at 115200 baud fits in the ring
+        journal = Journal(args.out, prefix="monitor", capacity=1 << 20).start()
+    monitor = BusMonitor(args.ports, args.baudrate, journal, live=args.live).start()
+    origin = (time.time(), time.monotonic())
+    started = origin[1]
+    try:
+        while args.duration is None or time.monotonic() - started < args.duration:
+            time.sleep(0.1)
+            for stamp, direction, frame in monitor.live_frames():
+                print(describe(stamp, direction, frame, origin))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        monitor.stop()
+        for stamp, direction, frame in monitor.live_frames():
+            print(describe(stamp, direction, frame, origin))
+        if journal is not None:
+            journal.close()
+        print(json.dumps(monitor.stats(), indent=2))
+        if journal is not None and journal.path:
+            print(json.dumps(capture_stats(journal_frames(read_range(args.out))).summary(),
+                             indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future, InvalidStateError
+
+MoveResult = namedtuple('MoveResult', ['arrived', 'pan', 'tilt', 'elapsed', 'reason'])
+
+
+def axis_error(axis, position, target):
+    """Distance to target in degrees, pan wraps around at 360"""
+    error = abs(position - target)
+    if axis == "pan":
+        error %= 360
+        error = min(error, 360 - error)
+    return error
+
+
+class ArrivalCheck:
+    """Decides when a wait for a position ends
+
+    Shared by wait_for_position() and the asyncio client, which only
+    differ in how they read the position and sleep.
+    """
+
+    def __init__(self, pan=None, tilt=None, tolerance=1.0, timeout=30.0, stall_time=3.0,
+                 started=0.0):
+        """Start a wait
+
+        Args:
+            pan (float): Pan target, None to ignore the axis
+            tilt (float): Tilt target, None to ignore the axis
+            tolerance (float): Accepted error in degrees
+            timeout (float): Give up after this many seconds
+            stall_time (float): Give up when the position has not changed for
+                this long without arriving (end stop, dead band, stall)
+            started (float): Clock reading at the start of the wait
+        """
+        self.targets = [(axis, target) for axis, target in (("pan", pan), ("tilt", tilt))
+                        if target is not None]
+        self.tolerance = tolerance
+        self.timeout = timeout
+        self.stall_time = stall_time
+        self.started = started
+        self.position = {}
+        self._last_position = None
+        self._last_change = started
+
+    def update(self, position, now):
+        """Take a position read at `now`
+
+        Args:
+            position (dict): AS status with pan_position and tilt_position,
+                None if the read failed (the last position is kept)
+
+        Returns:
+            str: "arrived", "timeout" or "stalled", None to keep waiting
+        """
+        self.position = position or self.position
+        current = tuple(self.position.get(f"{axis}_position") for axis, _ in self.targets)
+        if current != self._last_position:
+            self._last_position = current
+            self._last_change = now
+
+        if all(value is not None and axis_error(axis, value, target) <= self.tolerance
+               for value, (axis, target) in zip(current, self.targets)):
+            return "arrived"
+        if now - self.started >= self.timeout:
+            return "timeout"
+        if now - self._last_change >= self.stall_time:
+            return "stalled"
+        return None
+
+    def result(self, reason, now):
+        """MoveResult for a wait that ended for `reason`"""
+        return MoveResult(reason == "arrived", self.position.get("pan_position"),
+                          self.position.get("tilt_position"), now - self.started, reason)
+
+
+def start_move(device, pan=None, tilt=None):
+    """Issue one absolute move: GL for both axes, PP or TP for one
+
+    Args:
+        device: OE10Protocol or a proxy with the same methods
+
+    Returns:
+        bool: True if the device accepted the move
+    """
+    if pan is not None and tilt is not None:
+        return device.go_to_location(pan, tilt)
+    if pan is not None:
+        return device.go_to_pan(pan)
+    if tilt is not None:
+        return device.go_to_tilt(tilt)
+    raise ValueError("No target position given")
+
+
+def wait_for_position(read_position, pan=None, tilt=None, tolerance=1.0, timeout=30.0,
+                      poll_interval=0.1, stall_time=3.0, cancelled=None):
+    """Wait until the polled position is within tolerance of the target
+
+    Args:
+        read_position (callable): Returns a dict with pan_position and
+            tilt_position (e.g. OE10Protocol.get_pan_tilt_status), or None
+        pan (float): Pan target, None to ignore the axis
+        tilt (float): Tilt target, None to ignore the axis
+        tolerance (float): Accepted error in degrees
+        timeout (float): Give up after this many seconds
+        poll_interval (float): Seconds between position reads
+        stall_time (float): Give up when the position has not changed for
+            this long without arriving (end stop, dead band, stall)
+        cancelled (callable): Returns True to abort the wait
+
+    Returns:
+        MoveResult: arrived flag, last known position, elapsed time and
+        the reason the wait ended ("arrived", "timeout", "stalled", "cancelled")
+    """
+    check = ArrivalCheck(pan, tilt, tolerance, timeout, stall_time, time.monotonic())
+    while True:
+        now = time.monotonic()
+        if cancelled is not None and cancelled():
+            return check.result("cancelled", now)
+        reason = check.update(read_position(), now)
+        if reason is not None:
+            return check.result(reason, now)
+        time.sleep(poll_interval)
+
+
+def move_to(device, pan=None, tilt=None, tolerance=1.0, timeout=30.0, poll_interval=0.1,
+            read_position=None, cancelled=None):
+    """Move to an absolute position and block until it is reached
+
+    Args:
+        device: OE10Protocol or a proxy with the same methods
+        read_position (callable): Position source, defaults to polling AS
+            on the device
+
+    Returns:
+        MoveResult: See wait_for_position()
+    """
+    if not start_move(device, pan, tilt):
+        return MoveResult(False, None, None, 0.0, "rejected")
+    if read_position is None:
+        read_position = device.get_pan_tilt_status
+    return wait_for_position(read_position, pan, tilt, tolerance, timeout, poll_interval,
+                             cancelled=cancelled)
+
+
+def move_to_async(device, pan=None, tilt=None, tolerance=1.0, timeout=30.0, poll_interval=0.1,
+                  read_position=None):
+    """Start move_to() in a background thread
+
+    The returned Future stays cancellable until the move finishes, and
+    cancelling it stops the arrival wait (the device keeps moving to the
+    target unless it is stopped separately).
+
+    Returns:
+        Future: Resolves to a MoveResult
+    """
+    future = Future()
+
+    def run():
+        try:
+            result = move_to(device, pan, tilt, tolerance, timeout, poll_interval,
+                             read_position, cancelled=future.cancelled)
+        except Exception as e:
+            try:
+                future.set_exception(e)
+            except InvalidStateError:
+                pass  # Cancelled while the error was raised
+            return
+        try:
+            future.set_result(result)
+        except InvalidStateError:
+            pass  # Cancelled while finishing
+
+    threading.Thread(target=run, name="oe10-move", daemon=True).start()
+    return future
@@ -0,0 +1,237 @@
+"""Incremental frame parser for the OE10-104 protocol
+
+Frames are delimited by the length byte in the header rather than by
+splitting on ':', because data sections may contain 0x3A or bytes outside
+the ASCII range (e.g. ST replies: 18 00 00 31 35 30 ...). Payloads are
+returned as memoryview slices of the received chunk, so parsing does not
+copy the data per byte or per field.
+"""
+from collections import namedtuple
+
+from oe10_codec import ACK, NAK, FRAME_START, FRAME_END, SEPARATOR, checksum, encode_checksum
+
+HEADER_SIZE = 7   # '<' to ':' from ':' length ':'
+TRAILER_SIZE = 5  # ':' checksum ':' checksum ind '>'
+
+# Command names are two ASCII bytes, decode each distinct name only once
+_COMMAND_NAMES = {}
+
+
+class Frame(namedtuple('Frame', ['to_addr', 'from_addr', 'length', 'status', 'command',
+                                 'payload', 'checksum_ok', 'raw'])):
+    """One decoded frame
+
+    Attributes:
+        to_addr (int): Destination id
+        from_addr (int): Source id
+        length (int): Length byte from the header
+        status (int): ACK or NAK for replies, None for requests
+        command (str): Two letter command
+        payload (memoryview): Data section after the command
+        checksum_ok (bool): Checksum and indicator match the frame
+        raw (memoryview): Complete frame including delimiters
+    """
+    __slots__ = ()
+
+    @property
+    def is_ack(self):
+        return self.status == ACK
+
+    @property
+    def is_nak(self):
+        return self.status == NAK
+
+    @property
+    def error_code(self):
+        """NAK error byte, or None"""
+        if self.status == NAK and len(self.payload):
+            return self.payload[0]
+        return None
+
+
+class FrameParser:
+    """Streaming parser that turns raw serial chunks into frames
+
+    Garbage between frames is dropped and the parser resynchronises on the
+    next '<'. Several frames in one chunk and frames split across chunks
+    are both handled.
+    """
+
+    def __init__(self):
+        self._pending = b""  # Partial frame carried over to the next chunk
+        self.dropped = 0     # Bytes discarded while resynchronising
+        self.bad_checksums = 0
+
+    def reset(self):
+        """Forget any partial frame"""
+        self._pending = b""
+
+    def bytes_missing(self):
+        """Minimum number of bytes before the next frame can be complete"""
+        pending = self._pending
+        if len(pending) < HEADER_SIZE:
+            return HEADER_SIZE - len(pending)
+        return max(HEADER_SIZE + pending[5] + TRAILER_SIZE - len(pending), 1)
+
+    def feed(self, chunk):
+        """Parse a chunk of received bytes
+
+        Args:
+            chunk (bytes, bytearray or memoryview): Received data
+
+        Returns:
+            list: Complete frames found, in order
+        """
+        if self._pending:
+            data = self._pending + chunk
+        elif isinstance(chunk, bytes):
+            data = chunk
+        else:
+            data = bytes(chunk)
+
+        frames = []
+        view = memoryview(data)
+        end = len(data)
+        pos = 0
+        while True:
+            start = data.find(FRAME_START, pos)
+            if start < 0:
+                self.dropped += end - pos
+                pos = end
+                break
+            self.dropped += start - pos
+            pos = start
+
+            if end - start < HEADER_SIZE:
+                break
+            if (data[start + 2] != SEPARATOR or data[start + 4] != SEPARATOR
+                    or data[start + 6] != SEPARATOR):
+                # Not a header, resynchronise on the next '<'
+                pos = start + 1
+                self.dropped += 1
+                continue
+
+            length = data[start + 5]
+            stop = start + HEADER_SIZE + length + TRAILER_SIZE
+            if stop > end:
+                break
+            if (data[stop - 1] != FRAME_END or data[stop - 3] != SEPARATOR
+                    or data[stop - 5] != SEPARATOR):
+                pos = start + 1
+                self.dropped += 1
+                continue
+
+            frame = self._decode(data, view, start, length, stop)
+            if not frame.checksum_ok:
+                self.bad_checksums += 1
+            frames.append(frame)
+            pos = stop
+
+        self._pending = data[pos:]
+        return frames
+
+    def _decode(self, data, view, start, length, stop):
+        """Build a Frame from a delimited region of data"""
+        body = start + HEADER_SIZE
+        body_end = body + length
+
+        if length >= 2 and data[body] in (ACK, NAK) and data[body + 1] == SEPARATOR:
+            # Reply: ACK/NAK ':' command data
+            status = data[body]
+            name_at = body + 2
+            payload_at = name_at + 2
+        else:
+            # Request: command ':' data
+            status = None
+            name_at = body
+            payload_at = body + 3
+
+        name = data[name_at:min(name_at + 2, body_end)]
+        command = _COMMAND_NAMES.get(name)
+        if command is None:
+            command = _COMMAND_NAMES[name] = name.decode('latin-1')
+
+        expected = encode_checksum(checksum(view[start + 1:body_end]))
+        checksum_ok = data[stop - 4] == expected[0] and data[stop - 2] == expected[1]
+
+        return Frame(data[start + 1], data[start + 3], length, status, command,
+                     view[min(payload_at, body_end):body_end], checksum_ok,
+                     view[start:stop])
+
+
+def iter_frames(chunks):
+    """Yield frames from an iterable of raw chunks"""
+    parser = FrameParser()
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+
+
+def decode_degrees(digits):
+    """Decode three ASCII digits into degrees
+
+    Returns:
+        int: Angle, or None for '999' (dead band) or non digit bytes
+    """
+    if len(digits) != 3:
+        return None
+    value = 0
+    for byte in digits:
+        if not 0x30 <= byte <= 0x39:
+            return None
+        value = value * 10 + byte - 0x30
+    return None if value == 999 else value
+
+
+def decode_status(payload):
+    """Decode the 9 data bytes of an ST reply"""
+    if len(payload) < 9:
+        return None
+    return {
+        "pan_supported": bool(payload[0] & 0x08),
+        "tilt_supported": bool(payload[0] & 0x10),
+        "error": bool(payload[1] & 0x20),
+        "pan_position": decode_degrees(payload[3:6]),
+        "tilt_position": decode_degrees(payload[6:9]),
+    }
+
+
+# ED byte 1 bits, bits 6 and 7 are reserved
+DIAGNOSIS_ERRORS = (
+    (0x01, "over_temperature"),
+    (0x02, "low_oil_level"),
+    (0x04, "moisture_ingress"),
+    (0x08, "over_current"),
+    (0x10, "tilt_stall"),
+    (0x20, "pan_stall"),
+)
+
+
+def decode_error_diagnosis(payload):
+    """Decode the data bytes of an ED reply
+
+    Returns:
+        dict: errors (names of the byte 1 bits set) and error_bytes (all
+        bytes as sent, trailing zero bytes may be omitted by the device)
+    """
+    if not len(payload):
+        return {"errors": [], "error_bytes": []}
+    first = payload[0]
+    return {
+        "errors": [name for bit, name in DIAGNOSIS_ERRORS if first & bit],
+        "error_bytes": list(payload),
+    }
+
+
+def decode_pan_tilt_status(payload):
+    """Decode the 10 data bytes of an AS reply"""
+    if len(payload) < 10:
+        return None
+    return {
+        "pan_speed": payload[0],
+        "tilt_speed": payload[1],
+        "pan_position": decode_degrees(payload[2:5]),
+        "tilt_position": decode_degrees(payload[5:8]),
+        # 0x30 = enabled, 0x31 = disabled
+        "pan_endstops": payload[8] == 0x30,
+        "tilt_endstops": payload[9] == 0x30,
+    }
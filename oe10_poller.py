@@ -0,0 +1,233 @@
+import logging
+import threading
+import time
+from collections import namedtuple
+from types import MappingProxyType
+
+from oe10_transport import LinkDown
+
+logger = logging.getLogger(__name__)
+
+
+class StatusSnapshot(namedtuple('StatusSnapshot', ['data', 'timestamp', 'monotonic', 'sequence'])):
+    """Immutable result of one poll
+
+    Attributes:
+        data (Mapping): Read-only merge of the decoded ST and AS replies
+        timestamp (float): Wall clock time of the sample
+        monotonic (float): time.monotonic() of the sample, used for age
+        sequence (int): Increments with every published sample
+    """
+    __slots__ = ()
+
+    @property
+    def age(self):
+        """Seconds since the sample was taken"""
+        return time.monotonic() - self.monotonic
+
+    def as_dict(self):
+        """Plain dict for JSON responses"""
+        result = dict(self.data)
+        result["timestamp"] = self.timestamp
+        result["age"] = round(self.age, 3)
+        result["sequence"] = self.sequence
+        return result
+
+
+def iter_updates(wait_newer, min_interval=0.0, keepalive=15.0, stopped=lambda: False):
+    """Yield status changes as they are sampled, for push subscribers
+
+    Samples without changes are coalesced away. With min_interval set,
+    at most one update is produced per interval and samples taken in
+    between are skipped in favour of the newest one.
+
+    Args:
+        wait_newer (callable): wait_newer(sequence, timeout) of a poller
+        min_interval (float): Minimum seconds between updates
+        keepalive (float): Yield None after this long without an update
+        stopped (callable): Returns True when the source has shut down
+
+    Yields:
+        dict: Changed fields plus timestamp and sequence (the first
+        update carries all fields), or None as a keepalive
+    """
+    sent = {}
+    sequence = 0
+    last_yield = time.monotonic() - min_interval
+    while not stopped():
+        wait = last_yield + min_interval - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+
+        snap = wait_newer(sequence, keepalive)
+        if snap is not None:
+            sequence = snap.sequence
+            delta = {key: value for key, value in snap.data.items()
+                     if key not in sent or sent[key] != value}
+            if delta:
+                sent.update(delta)
+                delta["timestamp"] = snap.timestamp
+                delta["sequence"] = snap.sequence
+                last_yield = time.monotonic()
+                yield delta
+                continue
+
+        if time.monotonic() - last_yield >= keepalive:
+            last_yield = time.monotonic()
+            yield None
+
+
+class StatusPoller:
+    """Samples device status in one background thread
+
+    All readers share the latest snapshot, so serial traffic depends only on
+    the poll rate and not on how many clients ask for status. AS (positions
+    and speeds) is sampled every cycle, ST (supported axes and error flag)
+    every `status_every` cycles.
+    """
+
+    def __init__(self, controller, interval=0.5, status_every=5, max_age=2.0):
+        """Create a poller for an OE10Protocol instance
+
+        Args:
+            controller: OE10Protocol (or compatible) to sample
+            interval (float): Seconds between samples
+            status_every (int): Sample ST once every this many cycles
+            max_age (float): Default staleness limit for readers in seconds
+        """
+        self.controller = controller
+        self.interval = interval
+        self.status_every = max(1, status_every)
+        self.max_age = max_age
+
+        self.errors = 0
+        self._snapshot = None
+        self._valid = False
+        self._generation = 0
+        self._sequence = 0
+        self._health = {}
+        self._cycle = 0
+
+        self._cond = threading.Condition()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the polling thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="oe10-poller", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop the polling thread and wait for it to finish"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def snapshot(self, max_age=None):
+        """Latest snapshot without touching the port
+
+        Args:
+            max_age (float): Staleness limit, defaults to the poller's max_age
+
+        Returns:
+            StatusSnapshot: Latest valid sample, or None if there is none,
+            it was invalidated or it is older than max_age
+        """
+        snap = self._snapshot
+        if snap is None or not self._valid:
+            return None
+        if max_age is None:
+            max_age = self.max_age
+        if snap.age > max_age:
+            return None
+        return snap
+
+    def wait(self, timeout, max_age=None):
+        """Like snapshot(), but wait up to timeout for a valid sample"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                snap = self.snapshot(max_age)
+                remaining = deadline - time.monotonic()
+                if snap is not None or remaining <= 0:
+                    return snap
+                self._cond.wait(remaining)
+
+    def wait_newer(self, sequence, timeout):
+        """Wait up to timeout for a valid snapshot newer than sequence"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                snap = self._snapshot
+                if snap is not None and self._valid and snap.sequence > sequence:
+                    return snap
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._stop.is_set():
+                    return None
+                self._cond.wait(remaining)
+
+    def updates(self, min_interval=0.0, keepalive=15.0):
+        """Yield status changes as they are sampled, see iter_updates()"""
+        return iter_updates(self.wait_newer, min_interval, keepalive, self._stop.is_set)
+
+    def invalidate(self):
+        """Mark the current snapshot stale and sample again immediately
+
+        Called after motion commands so readers never see a position from
+        before the move as current.
+        """
+        with self._cond:
+            self._generation += 1
+            self._valid = False
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                self._sample()
+            except LinkDown:
+                # Reported once by the link thread, not on every poll
+                self.errors += 1
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Status poll failed: {e}")
+            self._wake.wait(max(0.0, self.interval - (time.monotonic() - started)))
+            self._wake.clear()
+
+    def _sample(self):
+        generation = self._generation
+
+        status = None
+        if self._cycle % self.status_every == 0 or not self._health:
+            status = self.controller.get_status()
+            if status:
+                self._health = status
+        self._cycle += 1
+
+        pan_tilt = self.controller.get_pan_tilt_status()
+        if pan_tilt is None and status is None:
+            self.errors += 1
+            return
+
+        # Positions from AS are fresher than those in the last ST reply
+        data = dict(self._health)
+        if pan_tilt:
+            data.update(pan_tilt)
+
+        with self._cond:
+            if generation != self._generation:
+                # A motion command was issued while sampling, resample
+                self._wake.set()
+                return
+            self._sequence += 1
+            self._snapshot = StatusSnapshot(MappingProxyType(data), time.time(),
+                                            time.monotonic(), self._sequence)
+            self._valid = True
+            self._cond.notify_all()
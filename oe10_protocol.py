@@ -1,165 +1,535 @@
 import serial
 import time
 
+import oe10_codec
+import oe10_motion
+import oe10_parser
+from oe10_calibration import MAX_SPEED, MOVE_COMMANDS, SPEED_COMMANDS, SpeedTable
+from oe10_estimator import PositionEstimator
+from oe10_transport import DEFAULT_RETRY, FrameTransport
+
+# Proportional control action bits per direction argument
+PAN_ACTIONS = {1: oe10_codec.PAN_LEFT, 2: oe10_codec.PAN_RIGHT}
+TILT_ACTIONS = {1: oe10_codec.TILT_UP, 2: oe10_codec.TILT_DOWN}
+
+# Replies that echo the position of one axis, and the jog direction
+POSITION_ECHOES = {
+    "PL": ("pan", -1), "PR": ("pan", 1), "PS": ("pan", 0),
+    "TU": ("tilt", 1), "TD": ("tilt", -1), "TS": ("tilt", 0),
+}
+
+# NAK error bits that will not change by asking again
+_PERMANENT_NAK_BITS = oe10_codec.NAK_NOT_AVAILABLE | oe10_codec.NAK_NOT_RECOGNISED
+
+# Send each command once, check the echoed reply, retransmit on loss
+MODE_RELIABLE = "reliable"
+# Replay the vendor GUI sequence from hexdump: AS before every command,
+# ST and PC sent twice
+MODE_COMPAT = "compat"
+
 class OE10Protocol:
     """Implementation of the OE10-104 Serial Pan and Tilt Unit protocol"""
     
-    def __init__(self, port='/dev/ttyAMA0', baudrate=9600):
-        """Initialize with exact settings from working configuration"""
-        self.serial = serial.Serial(
-            port=port,
-            baudrate=baudrate,
-            bytesize=serial.EIGHTBITS,
-            parity=serial.PARITY_NONE,
-            stopbits=serial.STOPBITS_ONE,
-            timeout=1
-        )
+    def __init__(self, port='/dev/ttyAMA0', baudrate=9600, timeout=1.0,
+                 address=oe10_codec.PERIPHERAL_ID, transport=None, mode=MODE_RELIABLE,
+                 retry=DEFAULT_RETRY, journal=None, trace=False, adaptive=True):
+        """Initialize with exact settings from working configuration
+
+        Args:
+            port (str): Serial port the OE10 is connected to, or a pyserial
+                URL such as socket://localhost:7777 (see oe10_simulator)
+            baudrate (int): Line speed
+            timeout (float): Seconds to wait for a reply frame
+            address (int): Address of the unit on the bus
+            transport (FrameTransport): Share an already open port with
+                other units instead of opening one (see oe10_bus)
+            mode (str): MODE_RELIABLE or MODE_COMPAT
+            retry (RetryPolicy): Retransmissions in reliable mode
+            journal (Journal): Record all traffic (see oe10_journal),
+                ignored when a transport is passed in
+            trace (bool): Print every frame sent and received, for debugging
+                only: the console write costs more than the frame
+            adaptive (bool): Derive reply deadlines from measured round
+                trip times, `timeout` becomes the upper limit (see
+                oe10_transport.RttEstimator); ignored with a transport
+        """
+        if mode not in (MODE_RELIABLE, MODE_COMPAT):
+            raise ValueError(f"Unknown protocol mode {mode!r}")
+        self.mode = mode
+        self.retry = retry
+        self.trace = trace
+        self._owns_port = transport is None
+        self.port = port
+        self.baudrate = baudrate
+        if transport is None:
+            transport = FrameTransport(self._open_port(port, timeout), timeout=timeout,
+                                       journal=journal, adaptive=adaptive)
+        self.transport = transport
+        self.serial = transport.serial
         
         # Use addresses from working captures
-        self.CONTROLLER_ID = 0x01
-        self.PERIPHERAL_ID = 0x03  # Changed from 0x02 to 0x03
-        self.BROADCAST_ID = 0xFF
+        self.CONTROLLER_ID = oe10_codec.CONTROLLER_ID
+        self.PERIPHERAL_ID = address  # 0x03 in the captures
+        self.BROADCAST_ID = oe10_codec.BROADCAST_ID
         
         # Constants
-        self.ACK = 0x06  # ASCII ACK character
-        self.NAK = 0x15  # ASCII NAK character
+        self.ACK = oe10_codec.ACK  # ASCII ACK character
+        self.NAK = oe10_codec.NAK  # ASCII NAK character
         
         # Current state
         self.current_pan = 0
         self.current_tilt = 0
 
-        # Add status caching
-        self._last_status = None
-        self._last_status_time = 0
-        self._status_cache_duration = 2  # seconds
+        # Fed by every ACKed reply, answers position lookups without I/O
+        self.estimator = PositionEstimator()
+
+        # Degrees per second per speed setting, nominal until a calibrated
+        # table is set (see oe10_calibration)
+        self.speed_table = SpeedTable.nominal()
+
+        # Versions and supported axes, read once per session (get_identity)
+        # and cleared when the connection is re-established
+        self.identity = None
+
+        # Commands the unit answered with "not available" or "not
+        # recognised", command -> NAK frame; they fail without I/O
+        self.unsupported = {}
+
+        # Serialises transactions between request threads and the status
+        # poller (see oe10_poller.StatusPoller, which also caches status).
+        # Owned by the transport so units sharing a bus share it too.
+        self.lock = transport.lock
+
+        # Replies are routed by their "from" field, a broadcast accepts any
+        self._source = None if address == oe10_codec.BROADCAST_ID else address
+
+    def _open_port(self, port, timeout):
+        return serial.serial_for_url(
+            port,
+            baudrate=self.baudrate,
+            bytesize=serial.EIGHTBITS,
+            parity=serial.PARITY_NONE,
+            stopbits=serial.STOPBITS_ONE,
+            timeout=timeout
+        )
+
+    def reopen(self, port=None):
+        """Open the port again after the link was lost
+
+        The session caches (identity, unsupported commands) are cleared,
+        the device may have been swapped or updated while it was away.
 
-    def _calculate_checksum(self, data):
-        """Calculate XOR checksum of packet data
-        
         Args:
-            data (str): Packet data excluding < and checksum section
-            
-        Returns:
-            tuple: (checksum byte, checksum indicator)
-        """
-        checksum = 0
-        for byte in data.encode('ascii'):
-            checksum ^= byte
-            
-        # Handle special cases as per protocol
-        if checksum == 0x3C:  # '<'
-            return 'FF', '0'
-        elif checksum == 0x3E:  # '>'
-            return 'FF', '1'
-        else:
-            return format(checksum, '02X'), 'G'
-
-    def _build_packet(self, command, data=""):
-        """Build packet exactly as seen in hexdump
-        Examples from dump:
-        Status (ST):  3c 03 3a 01 3a 03 3a 53 54 3a 3a 06 3a 47 3e
-        AS check:     3c 03 3a 01 3a 03 3a 41 53 3a 3a 13 3a 47 3e
-        PC command:   3c 03 3a 01 3a 07 3a 50 43 3a [data] 3a [checksum] 3a 47 3e
-        """
-        to_addr = "03"
-        from_addr = "01"
-        
-        # Fixed lengths from hexdump
-        if command == "PC":
-            length = "07"
-        else:
-            length = "03"
-        
-        # Fixed checksums from hexdump
-        checksums = {
-            "ST": "06",
-            "AS": "13",
-            "PC": None  # Will be added with data
-        }
-        
-        packet = f"<{to_addr}:{from_addr}:{length}:{command}:"
-        if data:
-            packet += f"{data}:"
-        else:
-            packet += ":"
-        
-        # Add appropriate checksum
-        if command in checksums and checksums[command]:
-            packet += f"{checksums[command]}:"
-        
-        packet += "G>"
-        return packet
+            port (str): Port to open, defaults to the previous one (a
+                re-plugged USB adapter may come back under another name)
+        """
+        if not self._owns_port:
+            raise RuntimeError("The port belongs to a shared bus transport")
+        self.disconnect()
+        if port is not None:
+            self.port = port
+        self.serial = self._open_port(self.port, self.transport.timeout)
+        self.transport.replace_port(self.serial)
+        self.identity = None
+        self.unsupported.clear()
 
-    def _send_command(self, command, data=""):
-        """Send command with exact timing from hexdump"""
-        # Every command is preceded by AS status check
-        self._send_status_check()
-        
-        # Send command (some commands are sent twice in hexdump)
+    def disconnect(self):
+        """Close the port, commands raise LinkDown until reopen()"""
+        if self._owns_port:
+            self.transport.disconnect()
+
+    def resync(self):
+        """Handshake after (re)connecting: ST, then AS to anchor the estimator
+
+        Returns:
+            bool: True if the device answered both
+        """
+        with self.lock:
+            self.transport.discard_input()
+            return self.get_status() is not None and self.get_pan_tilt_status() is not None
+
+    def _build_packet(self, command, data=b""):
+        """Encode a packet for the peripheral with the shared codec
+
+        Args:
+            command (str): Two letter command
+            data (bytes or str): Data section, a str is read as hex digits
+                (e.g. "08001E00" as captured in hexdump)
+
+        Returns:
+            bytes: Complete frame with computed length and checksum
+        """
+        if isinstance(data, str):
+            data = bytes.fromhex(data)
+        if not data and command in oe10_codec.COMMANDS:
+            return oe10_codec.fixed_frame(command, self.PERIPHERAL_ID, self.CONTROLLER_ID)
+        return oe10_codec.encode_raw(command, data, self.PERIPHERAL_ID, self.CONTROLLER_ID)
+
+    def _send_command(self, command, data=b""):
+        """Send a command and return its reply frame
+
+        In reliable mode the command is sent once and retransmitted only if
+        no reply echoing it arrives or the reply is damaged. In compat mode
+        the sequence from hexdump is replayed. Either way each write is
+        followed by a read of its reply, no fixed sleeps.
+        """
+        rejected = self.unsupported.get(command)
+        if rejected is not None:
+            return rejected
         packet = self._build_packet(command, data)
-        print(f"Sending: {packet}")
-        self.serial.write(packet.encode('ascii'))
-        self.serial.flush()
-        
-        # Commands are often duplicated in hexdump
-        if command in ["ST", "PC"]:
-            time.sleep(0.1)
-            self.serial.write(packet.encode('ascii'))
-            self.serial.flush()
+        with self.lock:
+            if self.trace:
+                print(f"Sending: {packet.hex(' ')}")
+            if self.mode == MODE_RELIABLE:
+                response = self.transport.request(packet, command, source=self._source,
+                                                  retry=self.retry)
+            else:
+                # Every command is preceded by AS status check
+                self._send_status_check()
+
+                # Commands are often duplicated in hexdump, written back to
+                # back in one burst and answered with one reply each
+                if command in ["ST", "PC"]:
+                    response = self.transport.transact(packet * 2, replies=2,
+                                                       source=self._source)
+                else:
+                    response = self.transport.transact(packet, source=self._source)
         
-        # Wait for response as seen in dump
-        time.sleep(0.1)
-        response = self.serial.readline().decode('ascii').strip()
-        print(f"Response: {response}")
+        if response is not None and self.trace:
+            print(f"Response: {response.raw.hex(' ')}")
+        if (response is not None and response.is_nak and response.checksum_ok
+                and response.command == command
+                and (response.error_code or 0) & _PERMANENT_NAK_BITS):
+            self.unsupported[command] = response
         return response
 
+    def _query(self, command, data=b""):
+        """Send a command and return its reply frame if the device ACKed it
+
+        Returns:
+            Frame: ACK reply for the command (see oe10_parser), or None
+        """
+        response = self._send_command(command, data)
+        if response is None:
+            return None
+        if not response.checksum_ok:
+            print(f"Checksum error in {response.command} reply")
+            return None
+        if not response.is_ack or response.command != command:
+            print(f"Unexpected reply to {command}: {response.raw.hex(' ')}")
+            return None
+        self._observe(command, data, response)
+        return response
+
+    def _observe(self, command, data, response):
+        """Feed the position estimator from a command and its ACK reply"""
+        # The device sampled its position before sending the reply
+        sampled = time.monotonic() - len(response.raw) * 10.0 / self.serial.baudrate
+        payload = response.payload
+        estimator = self.estimator
+
+        if command == "ST":
+            status = oe10_parser.decode_status(payload)
+            if status:
+                estimator.observe(sampled, status["pan_position"], status["tilt_position"])
+        elif command == "AS":
+            status = oe10_parser.decode_pan_tilt_status(payload)
+            if status:
+                estimator.set_speeds(status["pan_speed"], status["tilt_speed"])
+                estimator.observe(sampled, status["pan_position"], status["tilt_position"])
+        elif command in POSITION_ECHOES:
+            axis, direction = POSITION_ECHOES[command]
+            estimator.observe(sampled, **{axis: oe10_parser.decode_degrees(payload[:3])})
+            if direction:
+                estimator.command_jog(**{axis: direction})
+            else:
+                estimator.command_velocity(**{axis: 0})
+        elif command == "PC" and len(data) >= 3:
+            actions, pan_speed, tilt_speed = data[0], data[1], data[2]
+            pan = -pan_speed if actions & PAN_ACTIONS[1] else pan_speed if actions & PAN_ACTIONS[2] else 0
+            tilt = tilt_speed if actions & TILT_ACTIONS[1] else -tilt_speed if actions & TILT_ACTIONS[2] else 0
+            estimator.command_velocity(pan=pan, tilt=tilt)
+        elif command == "DS" and data:
+            estimator.set_speeds(pan=data[0])
+        elif command == "TA" and data:
+            estimator.set_speeds(tilt=data[0])
+        elif command == "PP":
+            estimator.command_target(pan=oe10_parser.decode_degrees(data[:3]))
+        elif command == "TP":
+            estimator.command_target(tilt=oe10_parser.decode_degrees(data[:3]))
+        elif command == "GL":
+            estimator.command_target(pan=oe10_parser.decode_degrees(data[:3]),
+                                     tilt=oe10_parser.decode_degrees(data[3:6]))
+
+    def estimate_position(self, at=None):
+        """Estimated position at any time without serial traffic
+
+        Args:
+            at (float): time.monotonic() to estimate for, defaults to now
+
+        Returns:
+            dict: See oe10_estimator.PositionEstimator.estimate()
+        """
+        return self.estimator.estimate(at)
+
+    def set_speed_table(self, table):
+        """Use calibrated rates (oe10_calibration.SpeedTable) for estimates and predictions"""
+        self.speed_table = table
+        self.estimator.set_speed_table(table)
+
+    def predict_move(self, pan=None, tilt=None, pan_speed=None, tilt_speed=None):
+        """Seconds an absolute move from the estimated position takes, no serial traffic
+
+        Args:
+            pan (float): Pan target, None if the axis does not move
+            tilt (float): Tilt target, None if the axis does not move
+            pan_speed (int): DS setting, defaults to the configured one
+            tilt_speed (int): TA setting, defaults to the configured one
+
+        Returns:
+            float: Predicted duration, None while the position is unknown
+        """
+        estimate = self.estimator.estimate()
+        speeds = self.estimator.speeds()
+        predicted = 0.0
+        for axis, target, speed in (("pan", pan, pan_speed), ("tilt", tilt, tilt_speed)):
+            if target is None:
+                continue
+            if estimate[axis] is None:
+                return None
+            predicted = max(predicted, self.speed_table.move_time(
+                axis, target - estimate[axis], speed or speeds[axis]))
+        return predicted
+
+    def move_within(self, pan=None, tilt=None, deadline=None):
+        """Absolute move at the lowest speeds that arrive within a deadline
+
+        DS/TA are set from the speed table and the move is sent in the
+        same batch. Axes that cannot make the deadline run at full speed.
+        An axis already at its target keeps its speed setting. The settings
+        sent stay in effect for later moves and jogs, the unit applies them
+        to the running move, so they cannot be put back before it arrives.
+
+        Args:
+            pan (float): Pan target, None if the axis does not move
+            tilt (float): Tilt target, None if the axis does not move
+            deadline (float): Seconds the move may take, None for full speed
+
+        Returns:
+            float: Predicted duration, None if the device rejected a command
+        """
+        if pan is None and tilt is None:
+            raise ValueError("No target position given")
+        with self.lock:
+            estimate = self.estimator.estimate()
+            if ((pan is not None and estimate["pan"] is None)
+                    or (tilt is not None and estimate["tilt"] is None)):
+                if self.get_pan_tilt_status() is None:
+                    return None
+                estimate = self.estimator.estimate()
+
+            commands = []
+            predicted = 0.0
+            for axis, target in (("pan", pan), ("tilt", tilt)):
+                if target is None:
+                    continue
+                # PP/TP/GL send whole degrees, so compare what the unit sees
+                distance = round(target) - round(estimate[axis])
+                if not distance:
+                    continue
+                speed = MAX_SPEED
+                if deadline is not None:
+                    speed = self.speed_table.speed_for(axis, distance, deadline) or MAX_SPEED
+                commands.append((SPEED_COMMANDS[axis], (speed,)))
+                predicted = max(predicted, self.speed_table.move_time(axis, distance, speed))
+            if pan is not None and tilt is not None:
+                commands.append(("GL", (pan, tilt)))
+            else:
+                axis = "pan" if pan is not None else "tilt"
+                commands.append((MOVE_COMMANDS[axis], (pan if pan is not None else tilt,)))
+            if self.send_batch(commands) != len(commands):
+                return None
+        return predicted
+
     def _send_status_check(self):
         """AS status check exactly as seen in hexdump"""
-        packet = "<03:01:03:AS::13:G>"
-        self.serial.write(packet.encode('ascii'))
-        self.serial.flush()
-        time.sleep(0.1)
-        response = self.serial.readline()
-        return response
+        return self.transport.transact(self._build_packet("AS"), source=self._source)
 
     def get_status(self):
-        """Status command exactly as seen in hexdump"""
-        # Send ST command: 3c 03 3a 01 3a 03 3a 53 54 3a 3a 06 3a 47 3e
-        response = self._send_command("ST")
-        if not response:
+        """Status command exactly as seen in hexdump
+
+        Returns:
+            dict: Decoded ST reply (see oe10_parser.decode_status) or None
+        """
+        # Example reply: 3c 01 3a 03 3a 0d 3a 06 3a 53 54 18 00 00 31 35 30 30 31 30 ...
+        response = self._query("ST")
+        if response is None:
             return None
-        
-        try:
-            # Parse response format from hexdump
-            # Example: <01:03:0D:06:ST18000150010:13:G>
-            parts = response[1:-1].split(':')
-            if len(parts) >= 6:
-                status_data = parts[4][2:]  # Skip 'ST'
-                return {
-                    "pan_position": int(status_data[3:6]),
-                    "tilt_position": int(status_data[6:9])
-                }
-        except Exception as e:
-            print(f"Error parsing status: {e}")
-        return None
+        status = oe10_parser.decode_status(response.payload)
+        self._update_position(status)
+        if status and status["error"]:
+            status["diagnosis"] = self.get_error_diagnosis()
+        return status
+
+    def get_error_diagnosis(self):
+        """Error diagnosis (ED), read by get_status() when the error flag is set
+
+        Returns:
+            dict: See oe10_parser.decode_error_diagnosis, or None
+        """
+        response = self._query("ED")
+        if response is None:
+            return None
+        diagnosis = oe10_parser.decode_error_diagnosis(response.payload)
+        if diagnosis["errors"]:
+            print(f"Device errors: {', '.join(diagnosis['errors'])}")
+        return diagnosis
+
+    def get_pan_tilt_status(self):
+        """Pan and tilt status (AS): speeds, positions and endstops
+
+        Returns:
+            dict: Decoded AS reply (see oe10_parser.decode_pan_tilt_status) or None
+        """
+        response = self._query("AS")
+        if response is None:
+            return None
+        status = oe10_parser.decode_pan_tilt_status(response.payload)
+        self._update_position(status)
+        return status
+
+    def _update_position(self, status):
+        """Track the last reported position in current_pan/current_tilt"""
+        if not status:
+            return
+        if status.get("pan_position") is not None:
+            self.current_pan = status["pan_position"]
+        if status.get("tilt_position") is not None:
+            self.current_tilt = status["tilt_position"]
+
+    def go_to_pan(self, degrees):
+        """Go to pan position (PP)
+
+        Returns:
+            bool: True if the device accepted the move
+        """
+        return self._query("PP", oe10_codec.encode_data("PP", degrees)) is not None
+
+    def go_to_tilt(self, degrees):
+        """Go to tilt position (TP)
+
+        Returns:
+            bool: True if the device accepted the move
+        """
+        return self._query("TP", oe10_codec.encode_data("TP", degrees)) is not None
+
+    def go_to_location(self, pan, tilt):
+        """Go to pan and tilt position in one command (GL)
+
+        Returns:
+            bool: True if the device accepted the move
+        """
+        return self._query("GL", oe10_codec.encode_data("GL", pan, tilt)) is not None
+
+    def send_batch(self, commands):
+        """Send several commands back to back without other traffic between
+
+        Used by oe10_trajectory to issue a step (speed settings and a move)
+        as one job on the I/O thread.
+
+        Args:
+            commands (list): (command, args) pairs, e.g.
+                [("DS", [40]), ("TA", [25]), ("GL", [90, 20])]
+
+        Returns:
+            int: Number of commands acknowledged, the batch stops at the
+            first one that is not
+        """
+        sent = 0
+        with self.lock:
+            for command, args in commands:
+                if self._query(command, oe10_codec.encode_data(command, *args)) is None:
+                    break
+                sent += 1
+        return sent
 
     def move_pan_to(self, degrees):
-        """Absolute pan movement using PC command as seen in dump"""
-        # Convert degrees to proportional command
-        if degrees > self.current_pan:
-            return self.proportional_control(pan_direction=2, pan_speed=50)
-        elif degrees < self.current_pan:
-            return self.proportional_control(pan_direction=1, pan_speed=50)
-        return True
+        """Absolute pan movement, returns once the PP command is accepted"""
+        return self.go_to_pan(degrees)
 
     def move_tilt_to(self, degrees):
-        """Absolute tilt movement using PC command as seen in dump"""
-        # Convert degrees to proportional command
-        if degrees > self.current_tilt:
-            return self.proportional_control(tilt_direction=1, tilt_speed=50)
-        elif degrees < self.current_tilt:
-            return self.proportional_control(tilt_direction=2, tilt_speed=50)
-        return True
+        """Absolute tilt movement, returns once the TP command is accepted"""
+        return self.go_to_tilt(degrees)
+
+    def move_to(self, pan=None, tilt=None, tolerance=1.0, timeout=30.0):
+        """Move to an absolute position and block until it is reached
+
+        Sends a single GL (both axes) or PP/TP command and detects arrival
+        by polling AS. Blocks the calling thread, so when the controller is
+        driven through oe10_scheduler use oe10_motion with a proxy instead.
+
+        Args:
+            pan (float): Pan target in degrees, None to leave the axis alone
+            tilt (float): Tilt target in degrees, None to leave the axis alone
+            tolerance (float): Accepted error in degrees
+            timeout (float): Seconds to wait for arrival
+
+        Returns:
+            MoveResult: See oe10_motion.wait_for_position()
+        """
+        return oe10_motion.move_to(self, pan, tilt, tolerance, timeout)
+
+    def move_to_async(self, pan=None, tilt=None, tolerance=1.0, timeout=30.0):
+        """Like move_to(), but returns a Future resolving to the MoveResult"""
+        return oe10_motion.move_to_async(self, pan, tilt, tolerance, timeout)
+
+    def pan_left(self):
+        """Start panning left at the configured speed (PL)
+
+        Returns:
+            bool: True if the device acknowledged the command
+        """
+        return self._query("PL") is not None
+
+    def pan_right(self):
+        """Start panning right at the configured speed (PR)
+
+        Returns:
+            bool: True if the device acknowledged the command
+        """
+        return self._query("PR") is not None
+
+    def tilt_up(self):
+        """Start tilting up at the configured speed (TU)
+
+        Returns:
+            bool: True if the device acknowledged the command
+        """
+        return self._query("TU") is not None
+
+    def tilt_down(self):
+        """Start tilting down at the configured speed (TD)
+
+        Returns:
+            bool: True if the device acknowledged the command
+        """
+        return self._query("TD") is not None
+
+    def pan_stop(self):
+        """Pan stop (PS)
+
+        Returns:
+            bool: True if the device acknowledged the stop
+        """
+        return self._query("PS") is not None
+
+    def tilt_stop(self):
+        """Tilt stop (TS)
+
+        Returns:
+            bool: True if the device acknowledged the stop
+        """
+        return self._query("TS") is not None
 
     def stop(self):
         """Stop command exactly as seen in hexdump"""
@@ -167,23 +537,26 @@ class OE10Protocol:
 
     def proportional_control(self, pan_direction=0, tilt_direction=0, 
                            pan_speed=0, tilt_speed=0):
-        """Movement commands exactly as captured in hexdump"""
-        # Exact command patterns from hexdump
-        if pan_direction == 1:  # Left
-            data = "023200003a26"
-        elif pan_direction == 2:  # Right
-            data = "013200003a25"
-        elif tilt_direction == 1:  # Up
-            data = "08001e003a00"
-        elif tilt_direction == 2:  # Down
-            data = "0400280003a3a"
-        else:  # Stop
-            data = "000000003a16"
+        """Proportional control (PC) movement
+
+        Args:
+            pan_direction (int): 0 = stop, 1 = left, 2 = right
+            tilt_direction (int): 0 = stop, 1 = up, 2 = down
+            pan_speed (int): 0 - 100 (0x64)
+            tilt_speed (int): 0 - 100 (0x64)
+        """
+        # Direction bits as sent by the vendor GUI in hexdump, e.g.
+        # up = 08 00 1E 00, left = 02 32 00 00, stop = 00 00 00 00
+        actions = PAN_ACTIONS.get(pan_direction, 0) | TILT_ACTIONS.get(tilt_direction, 0)
+        data = oe10_codec.encode_data("PC", actions, pan_speed, tilt_speed)
         
+        if self.mode == MODE_RELIABLE:
+            return self._query("PC", data) is not None
+
         # Send PC command twice as seen in hexdump
-        self._send_command("PC", data)
-        time.sleep(0.1)
-        return self._send_command("PC", data) is not None
+        with self.lock:
+            self._send_command("PC", data)
+            return self._send_command("PC", data) is not None
 
     def get_protocol_version(self):
         """Get protocol version
@@ -191,10 +564,10 @@ class OE10Protocol:
         Returns:
             str: Version string or None
         """
-        response = self._send_command("PV")
-        if response and response['command'] == 'PV':
-            return response['data']
-        return None
+        response = self._query("PV")
+        if response is None:
+            return None
+        return bytes(response.payload).decode('ascii', 'replace').strip()
 
     def get_software_version(self):
         """Get software version
@@ -202,18 +575,47 @@ class OE10Protocol:
         Returns:
             str: Version string or None
         """
-        response = self._send_command("CV")
-        if response and response['command'] == 'CV':
-            version = response['data']
-            if len(version) >= 6:
-                major = f"{version[0]}{version[1]}"
-                minor = f"{version[2]}{version[3]}"
-                revision = f"{version[4]}{version[5]}"
-                return f"{major}.{minor}.{revision}"
-        return None
+        response = self._query("CV")
+        if response is None or len(response.payload) < 6:
+            return None
+        version = bytes(response.payload[:6]).decode('ascii', 'replace')
+        return f"{version[0:2]}.{version[2:4]}.{version[4:6]}"
+
+    def get_identity(self, refresh=False):
+        """Device identity, read from the device once per session
+
+        Args:
+            refresh (bool): Read it again even if it is cached
+
+        Returns:
+            dict: protocol_version, software_version, pan_supported and
+            tilt_supported (ST byte 1), or None if the device did not answer
+        """
+        if self.identity is not None and not refresh:
+            return self.identity
+
+        with self.lock:
+            status = self.get_status()
+            protocol_version = self.get_protocol_version()
+            software_version = self.get_software_version()
+        if status is None or protocol_version is None or software_version is None:
+            return None
+
+        self.identity = {
+            "protocol_version": protocol_version,
+            "software_version": software_version,
+            "pan_supported": status["pan_supported"],
+            "tilt_supported": status["tilt_supported"],
+        }
+        return self.identity
 
     def close(self):
-        """Close the serial connection and cleanup resources"""
+        """Close the serial connection and cleanup resources
+
+        A port shared through a bus transport is left open for the bus.
+        """
+        if not self._owns_port:
+            return
         try:
             if hasattr(self, 'serial') and self.serial and self.serial.is_open:
                 self.serial.close()
@@ -223,7 +625,7 @@ class OE10Protocol:
 
 if __name__ == "__main__":
     # Basic test
-    oe10 = OE10Protocol()
+    oe10 = OE10Protocol(trace=True)
     print("Testing connection...")
     
     # Get status
@@ -232,8 +634,7 @@ if __name__ == "__main__":
     
     # Test movement
     print("Testing pan movement...")
-    oe10.move_pan_to(90)
-    time.sleep(2)
-    oe10.move_pan_to(0)
+    print(oe10.move_to(pan=90))
+    print(oe10.move_to(pan=0))
     
     oe10.close() 
\ No newline at end of file
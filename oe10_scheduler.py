@@ -0,0 +1,221 @@
+import itertools
+import logging
+import queue
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import Future, TimeoutError
+
+import oe10_metrics
+from oe10_transport import LinkDown
+
+logger = logging.getLogger(__name__)
+
+# Priority lanes, lower runs first
+PRIORITY_STOP = 0     # STOP/PS/TS pre-empt everything queued
+PRIORITY_MOTION = 1
+PRIORITY_STATUS = 2
+
+LANE_NAMES = {
+    PRIORITY_STOP: "stop",
+    PRIORITY_MOTION: "motion",
+    PRIORITY_STATUS: "status",
+}
+
+_Job = namedtuple('_Job', ['future', 'func', 'args', 'kwargs', 'deadline', 'submitted', 'name'])
+
+
+class _LaneStats:
+    """Counters and recent wait times for one priority lane"""
+
+    def __init__(self, samples):
+        self.depth = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.expired = 0
+        self.waits = deque(maxlen=samples)
+
+    def as_dict(self):
+        waits = sorted(self.waits)
+        result = {
+            "depth": self.depth,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "expired": self.expired,
+        }
+        if waits:
+            result["wait_ms"] = {
+                "mean": round(sum(waits) / len(waits) * 1000, 3),
+                "p50": round(waits[len(waits) // 2] * 1000, 3),
+                "p95": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 3),
+                "max": round(waits[-1] * 1000, 3),
+            }
+        return result
+
+
+class CommandScheduler:
+    """Single I/O thread that owns the serial port
+
+    Every device call is submitted as a job and executed one at a time on
+    the scheduler thread, so bytes of different transactions can never
+    interleave and replies always reach the caller that sent the request.
+    Jobs are taken by priority lane, then in submission order, so a STOP
+    only ever waits for the transaction already on the wire.
+    """
+
+    def __init__(self, wait_samples=1000):
+        """Create a scheduler
+
+        Args:
+            wait_samples (int): Recent wait times kept per lane for metrics
+        """
+        self._queue = queue.PriorityQueue()
+        self._counter = itertools.count()
+        self._stats = {lane: _LaneStats(wait_samples) for lane in LANE_NAMES}
+        self._stats_lock = threading.Lock()
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        """Start the I/O thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="oe10-io", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop the I/O thread, cancelling jobs that have not started"""
+        self._running = False
+        self._queue.put((-1, next(self._counter), None))
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+        while True:
+            try:
+                _, _, job = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is not None:
+                job.future.cancel()
+
+    def submit(self, func, *args, priority=PRIORITY_MOTION, deadline=None, name=None, **kwargs):
+        """Queue a call to run on the I/O thread
+
+        Args:
+            func (callable): Device call, e.g. controller.get_status
+            priority (int): PRIORITY_STOP, PRIORITY_MOTION or PRIORITY_STATUS
+            deadline (float): Seconds from now after which the job is
+                dropped with TimeoutError instead of being started
+            name (str): Label for logs
+
+        Returns:
+            Future: Resolves to the call's return value
+        """
+        if not self._running:
+            raise RuntimeError("Scheduler is not running")
+        future = Future()
+        now = time.monotonic()
+        job = _Job(future, func, args, kwargs,
+                   now + deadline if deadline is not None else None,
+                   now, name or getattr(func, '__name__', 'job'))
+        with self._stats_lock:
+            stats = self._stats[priority]
+            stats.depth += 1
+            stats.submitted += 1
+            oe10_metrics.QUEUE_DEPTH.set(stats.depth, LANE_NAMES[priority])
+        self._queue.put((priority, next(self._counter), job))
+        return future
+
+    def call(self, func, *args, priority=PRIORITY_MOTION, timeout=None, **kwargs):
+        """Run a call on the I/O thread and wait for its result
+
+        The timeout is also the job's deadline, so a call that gives up
+        waiting never reaches the device later.
+        """
+        future = self.submit(func, *args, priority=priority, deadline=timeout, **kwargs)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            future.cancel()
+            raise TimeoutError(f"{getattr(func, '__name__', 'job')} did not complete within {timeout}s")
+
+    def proxy(self, target, priority=PRIORITY_MOTION, timeout=None):
+        """Return an object whose method calls run on the I/O thread"""
+        return ScheduledProxy(self, target, priority, timeout)
+
+    def queue_depth(self):
+        """Number of queued jobs per lane"""
+        with self._stats_lock:
+            return {LANE_NAMES[lane]: stats.depth for lane, stats in self._stats.items()}
+
+    def metrics(self):
+        """Queue depth, counters and wait times per lane"""
+        with self._stats_lock:
+            return {LANE_NAMES[lane]: stats.as_dict() for lane, stats in self._stats.items()}
+
+    def _run(self):
+        while True:
+            priority, _, job = self._queue.get()
+            if job is None:
+                break
+
+            started = time.monotonic()
+            lane = LANE_NAMES[priority]
+            with self._stats_lock:
+                stats = self._stats[priority]
+                stats.depth -= 1
+                stats.waits.append(started - job.submitted)
+                oe10_metrics.QUEUE_DEPTH.set(stats.depth, lane)
+            oe10_metrics.QUEUE_WAIT.observe(started - job.submitted, lane)
+
+            if job.deadline is not None and started > job.deadline:
+                oe10_metrics.QUEUE_EXPIRED.inc(lane)
+                with self._stats_lock:
+                    stats.expired += 1
+                # The caller may have cancelled it after giving up waiting
+                if job.future.set_running_or_notify_cancel():
+                    job.future.set_exception(TimeoutError(f"{job.name} expired before it was sent"))
+                continue
+            if not job.future.set_running_or_notify_cancel():
+                continue
+
+            try:
+                result = job.func(*job.args, **job.kwargs)
+            except Exception as e:
+                with self._stats_lock:
+                    stats.failed += 1
+                if isinstance(e, LinkDown):
+                    # The link thread logs the outage once
+                    logger.debug(f"{job.name} failed: {e}")
+                else:
+                    logger.error(f"{job.name} failed: {e}")
+                job.future.set_exception(e)
+            else:
+                with self._stats_lock:
+                    stats.completed += 1
+                job.future.set_result(result)
+
+
+class ScheduledProxy:
+    """Forwards method calls on a target to CommandScheduler.call()"""
+
+    def __init__(self, scheduler, target, priority, timeout):
+        self._scheduler = scheduler
+        self._target = target
+        self._priority = priority
+        self._timeout = timeout
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr):
+            return attr
+
+        def scheduled(*args, **kwargs):
+            return self._scheduler.call(attr, *args, priority=self._priority,
+                                        timeout=self._timeout, **kwargs)
+        scheduled.__name__ = name
+        return scheduled
@@ -0,0 +1,504 @@
+"""OE10-104 device simulator
+
+Implements the command set from oe10_com_protocol.md with simple axis
+kinematics and serves it behind a pty pair or a TCP socket, so the real
+clients can be pointed at it without changes:
+
+    python oe10_simulator.py              # prints a /dev/pts/N path
+    python oe10_simulator.py --tcp 7777   # use port socket://localhost:7777
+
+Replies are paced at the configured baud rate, and faults (dropped bytes,
+NAKs, corrupted checksums, slow turnaround) are injected from a seeded
+random generator so runs are repeatable.
+"""
+import abc
+import argparse
+import os
+import random
+import select
+import socket
+import threading
+import time
+import tty
+from collections import namedtuple
+
+import oe10_codec
+from oe10_codec import ACK, NAK, CONTROLLER_ID, PERIPHERAL_ID
+from oe10_parser import FrameParser
+
+# Fault injection probabilities per reply (0.0 - 1.0)
+Faults = namedtuple('Faults', ['drop_reply', 'drop_byte', 'nak', 'corrupt', 'slow',
+                               'slow_turnaround'],
+                    defaults=(0.0, 0.0, 0.0, 0.0, 0.0, 0.5))
+
+# Seconds the peripheral keeps a new id from SI without a status command
+SI_REVERT_TIME = 1.0
+
+
+class _Axis:
+    """Position model for one axis"""
+
+    def __init__(self, position, low, high, max_rate, wraps):
+        self.position = float(position)
+        self.low = low
+        self.high = high
+        self.soft_low = low
+        self.soft_high = high
+        self.max_rate = max_rate  # deg/s at speed 0x64
+        self.wraps = wraps
+        self.speed = 0x32         # DS/TA setting
+        self.velocity = 0.0       # deg/s, signed, for jogs
+        self.target = None
+
+    def rate(self, speed):
+        return self.max_rate * max(0, min(0x64, speed)) / 0x64
+
+    def jog(self, direction, speed=None):
+        self.target = None
+        self.velocity = direction * self.rate(self.speed if speed is None else speed)
+
+    def stop(self):
+        self.target = None
+        self.velocity = 0.0
+
+    def advance(self, dt, endstops):
+        if self.target is not None:
+            step = self.rate(self.speed) * dt
+            diff = self.target - self.position
+            if abs(diff) <= step:
+                self.position = self.target
+                self.target = None
+            else:
+                self.position += step if diff > 0 else -step
+        elif self.velocity:
+            self.position += self.velocity * dt
+
+        low, high = (self.soft_low, self.soft_high) if endstops else (self.low, self.high)
+        if self.wraps and not endstops:
+            self.position %= 360.0
+        elif not low <= self.position <= high:
+            self.position = max(low, min(high, self.position))
+            self.stop()
+
+    @property
+    def moving(self):
+        return self.target is not None or bool(self.velocity)
+
+    def digits(self):
+        return b"%03d" % int(round(self.position))
+
+
+class OE10Device:
+    """Protocol level model of one OE10 unit
+
+    handle() takes a parsed request frame and returns the encoded reply
+    (or None when the unit would stay silent). Time comes from `clock`, so
+    tests can drive the kinematics deterministically.
+    """
+
+    def __init__(self, address=PERIPHERAL_ID, pan=150, tilt=10, pan_rate=20.0, tilt_rate=10.0,
+                 pan_range=(0, 360), tilt_range=(0, 180), dead_band=0.5, clock=time.monotonic):
+        self.address = address
+        self.pan = _Axis(pan, pan_range[0], pan_range[1], pan_rate, wraps=True)
+        self.tilt = _Axis(tilt, tilt_range[0], tilt_range[1], tilt_rate, wraps=False)
+        self.dead_band = dead_band
+        self.clock = clock
+        self.endstops = True
+        self.termination = 0
+        self.error_bits = 0  # ED byte 1, also raises the ST error flag
+        self.protocol_version = b"1A"
+        self.software_version = b"010428"
+        self._last_update = clock()
+        self._si_revert = None  # (old address, deadline)
+
+        self._handlers = {
+            "ST": self._status, "AS": self._pan_tilt_status, "PV": self._protocol_version,
+            "CV": self._software_version, "SI": self._change_id,
+            "PL": self._jog, "PR": self._jog, "TU": self._jog, "TD": self._jog,
+            "PS": self._stop, "TS": self._stop, "PP": self._go_to, "TP": self._go_to,
+            "GL": self._go_to_location, "PC": self._proportional, "PF": self._proportional,
+            "AW": self._soft_stop, "CW": self._soft_stop, "UT": self._soft_stop,
+            "DT": self._soft_stop, "DS": self._set_speed, "TA": self._set_speed,
+            "ES": self._use_endstops, "TR": self._termination, "ED": self._error_diagnosis,
+        }
+
+    def update(self):
+        """Advance the kinematics to the current clock time"""
+        now = self.clock()
+        dt = now - self._last_update
+        self._last_update = now
+        if dt > 0:
+            self.pan.advance(dt, self.endstops)
+            self.tilt.advance(dt, self.endstops)
+        if self._si_revert and now > self._si_revert[1]:
+            self.address = self._si_revert[0]
+            self._si_revert = None
+
+    def handle(self, frame):
+        """Process one request frame
+
+        Returns:
+            bytes: Encoded reply, or None if the frame is not for this unit
+        """
+        self.update()
+        if frame.status is not None or not frame.checksum_ok:
+            return None
+        if frame.to_addr not in (self.address, oe10_codec.BROADCAST_ID):
+            return None
+
+        if frame.command in ("ST", "AS") and self._si_revert:
+            # The controller is talking to the new id, keep it
+            self._si_revert = None
+
+        handler = self._handlers.get(frame.command)
+        if handler is None:
+            return self.nak(frame, oe10_codec.NAK_NOT_RECOGNISED)
+        return handler(frame)
+
+    def reply(self, frame, data=b"", status=ACK):
+        return oe10_codec.encode_reply(frame.command, data, status,
+                                       to_addr=frame.from_addr, from_addr=self.address)
+
+    def nak(self, frame, error_bits):
+        return self.reply(frame, bytes([error_bits]), NAK)
+
+    def _status(self, frame):
+        flags = 0x20 if self.error_bits else 0x00
+        return self.reply(frame, bytes([0x18, flags, 0x00]) + self.pan.digits() + self.tilt.digits())
+
+    def _pan_tilt_status(self, frame):
+        endstops = b"0" if self.endstops else b"1"  # 0x30 = enabled
+        return self.reply(frame, bytes([self.pan.speed, self.tilt.speed])
+                          + self.pan.digits() + self.tilt.digits() + endstops * 2)
+
+    def _protocol_version(self, frame):
+        return self.reply(frame, self.protocol_version)
+
+    def _software_version(self, frame):
+        return self.reply(frame, self.software_version)
+
+    def _change_id(self, frame):
+        if len(frame.payload) != 1 or not 0x02 <= frame.payload[0] <= 0xFE:
+            return self.nak(frame, oe10_codec.NAK_NOT_AVAILABLE)
+        self._si_revert = (self.address, self.clock() + SI_REVERT_TIME)
+        self.address = frame.payload[0]
+        return self.reply(frame)
+
+    def _jog(self, frame):
+        axis, direction = {
+            "PL": (self.pan, -1), "PR": (self.pan, 1),
+            "TU": (self.tilt, 1), "TD": (self.tilt, -1),
+        }[frame.command]
+        axis.jog(direction)
+        return self.reply(frame, axis.digits())
+
+    def _stop(self, frame):
+        axis = self.pan if frame.command == "PS" else self.tilt
+        axis.stop()
+        return self.reply(frame, axis.digits())
+
+    def _target(self, axis, digits):
+        """Start a move to an ASCII target, returns the echo for the reply"""
+        target = int(digits)
+        if abs(target - axis.position) <= self.dead_band:
+            return b"999"
+        axis.velocity = 0.0
+        axis.target = float(max(axis.low, min(axis.high, target)))
+        return bytes(digits)
+
+    def _go_to(self, frame):
+        if len(frame.payload) != 3 or not bytes(frame.payload).isdigit():
+            return self.nak(frame, oe10_codec.NAK_NOT_AVAILABLE)
+        axis = self.pan if frame.command == "PP" else self.tilt
+        return self.reply(frame, self._target(axis, frame.payload))
+
+    def _go_to_location(self, frame):
+        if len(frame.payload) != 6 or not bytes(frame.payload).isdigit():
+            return self.nak(frame, oe10_codec.NAK_NOT_AVAILABLE)
+        echo = self._target(self.pan, frame.payload[:3]) + self._target(self.tilt, frame.payload[3:])
+        return self.reply(frame, echo)
+
+    def _proportional(self, frame):
+        if len(frame.payload) != 4:
+            return self.nak(frame, oe10_codec.NAK_NOT_AVAILABLE)
+        actions, pan_speed, tilt_speed = frame.payload[0], frame.payload[1], frame.payload[2]
+        # Direction bits as the vendor GUI sends them (see oe10_codec)
+        for axis, negative, positive, speed in (
+                (self.pan, oe10_codec.PAN_LEFT, oe10_codec.PAN_RIGHT, pan_speed),
+                (self.tilt, oe10_codec.TILT_DOWN, oe10_codec.TILT_UP, tilt_speed)):
+            bits = actions & (negative | positive)
+            if bits == negative:
+                axis.jog(-1, speed)
+            elif bits == positive:
+                axis.jog(1, speed)
+            else:
+                axis.stop()
+        if frame.command == "PC":
+            return self.reply(frame)
+
+        endstops = b"0" if self.endstops else b"1"
+        return self.reply(frame, bytes([pan_speed, tilt_speed]) + self.tilt.digits()
+                          + self.pan.digits() + endstops * 2)
+
+    def _soft_stop(self, frame):
+        axis, attr = {
+            "AW": (self.pan, "soft_low"), "CW": (self.pan, "soft_high"),
+            "UT": (self.tilt, "soft_high"), "DT": (self.tilt, "soft_low"),
+        }[frame.command]
+        setattr(axis, attr, axis.position)
+        return self.reply(frame)
+
+    def _set_speed(self, frame):
+        if len(frame.payload) != 1:
+            return self.nak(frame, oe10_codec.NAK_NOT_AVAILABLE)
+        axis = self.pan if frame.command == "DS" else self.tilt
+        axis.speed = min(0x64, frame.payload[0])
+        return self.reply(frame)
+
+    def _use_endstops(self, frame):
+        if bytes(frame.payload) not in (b"0", b"1"):
+            return self.nak(frame, oe10_codec.NAK_NOT_AVAILABLE)
+        self.endstops = frame.payload[0] == 0x31
+        return self.reply(frame, bytes(frame.payload))
+
+    def _termination(self, frame):
+        if bytes(frame.payload) not in (b"0", b"1", b"2"):
+            return self.nak(frame, oe10_codec.NAK_NOT_AVAILABLE)
+        if frame.payload[0] != 0x32:
+            self.termination = frame.payload[0] - 0x30
+        return self.reply(frame, b"%d" % self.termination)
+
+    def _error_diagnosis(self, frame):
+        return self.reply(frame, bytes([self.error_bits]))
+
+
+class SimulatorServer(abc.ABC):
+    """Serves an OE10Device over a byte stream with line-accurate timing
+
+    Each request is answered after the time the request would take on the
+    wire plus the device turnaround, and the reply is written in small
+    chunks at the configured baud rate, like a real UART would deliver it.
+    Subclasses provide the transport: _serve() and close().
+    """
+
+    CHUNK = 8  # bytes written per pacing step
+
+    def __init__(self, device=None, baudrate=9600, turnaround=0.005, faults=None, seed=0,
+                 devices=None):
+        # Several devices share the line like units on one RS-485 bus
+        self.devices = list(devices) if devices else [device or OE10Device()]
+        self.device = self.devices[0]
+        self.baudrate = baudrate
+        self.turnaround = turnaround
+        self.faults = faults or Faults()
+        self.random = random.Random(seed)
+        self.stats = {"requests": 0, "replies": 0, "dropped": 0, "naks": 0,
+                      "corrupted": 0, "slow": 0}
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def byte_time(self):
+        """Seconds per byte on the wire (8N1 = 10 bits)"""
+        return 10.0 / self.baudrate
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._serve, name="oe10-simulator", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(2)
+            self._thread = None
+        self.close()
+
+    @abc.abstractmethod
+    def close(self):
+        """Release the transport, called by stop()"""
+
+    @abc.abstractmethod
+    def _serve(self):
+        """Server thread: pass each connection to _exchange() until stopped"""
+
+    def _exchange(self, read, write):
+        """Serve one connection until it closes or the server stops
+
+        Args:
+            read (callable): Returns received bytes, b"" on timeout, None on close
+            write (callable): Writes bytes
+
+        Returns:
+            bool: True if the connection ended (closed or a write failed),
+            False if the server was stopped
+        """
+        parser = FrameParser()
+        while not self._stop.is_set():
+            chunk = read()
+            if chunk is None:
+                return True
+            if not chunk:
+                continue
+            received = time.monotonic()
+            for frame in parser.feed(chunk):
+                self.stats["requests"] += 1
+                for device in self.devices:
+                    reply = self._apply_faults(device.handle(frame))
+                    if reply is None:
+                        continue
+                    turnaround = self.turnaround
+                    if self.random.random() < self.faults.slow:
+                        self.stats["slow"] += 1
+                        turnaround = self.faults.slow_turnaround
+                    start = received + len(frame.raw) * self.byte_time + turnaround
+                    try:
+                        self._send_paced(write, reply, start)
+                    except OSError:
+                        # The client went away mid-reply, drop only this connection
+                        return True
+                    received = time.monotonic()
+        return False
+
+    def _apply_faults(self, reply):
+        if reply is None:
+            return None
+        faults = self.faults
+        rnd = self.random.random
+        if rnd() < faults.drop_reply:
+            self.stats["dropped"] += 1
+            return None
+        if rnd() < faults.nak:
+            self.stats["naks"] += 1
+            # Keep addressing and command, replace the body with a NAK
+            to_addr, from_addr, command = reply[1], reply[3], reply[9:11]
+            reply = oe10_codec.encode_reply(command, bytes([oe10_codec.NAK_TIMED_OUT]), NAK,
+                                            to_addr=to_addr, from_addr=from_addr)
+        if rnd() < faults.corrupt:
+            self.stats["corrupted"] += 1
+            reply = bytearray(reply)
+            reply[-4] ^= 0x55
+            reply = bytes(reply)
+        if rnd() < faults.drop_byte:
+            self.stats["dropped"] += 1
+            index = self.random.randrange(len(reply))
+            reply = reply[:index] + reply[index + 1:]
+        self.stats["replies"] += 1
+        return reply
+
+    def _send_paced(self, write, data, start):
+        for offset in range(0, len(data), self.CHUNK):
+            delay = start + offset * self.byte_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            write(data[offset:offset + self.CHUNK])
+
+
+class PtySimulator(SimulatorServer):
+    """Simulator behind a pseudo terminal, open `port` like a serial device"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+
+    def _serve(self):
+        def read():
+            ready, _, _ = select.select([self._master], [], [], 0.05)
+            if not ready:
+                return b""
+            try:
+                return os.read(self._master, 4096)
+            except OSError:
+                return None
+
+        # The pty stays open after a failed write, so serve it again
+        while self._exchange(read, lambda data: os.write(self._master, data)):
+            if self._stop.wait(0.05):
+                return
+
+    def close(self):
+        for fd in (self._master, self._slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+class SocketSimulator(SimulatorServer):
+    """Simulator behind a TCP socket, open `url` with pyserial (socket://)"""
+
+    def __init__(self, *args, host="localhost", port=0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._listener = socket.create_server((host, port))
+        self._listener.settimeout(0.05)
+        self.url = f"socket://{host}:{self._listener.getsockname()[1]}"
+
+    def _serve(self):
+        while not self._stop.is_set():
+            try:
+                conn, _ = self._listener.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            with conn:
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                conn.settimeout(0.05)
+
+                def read():
+                    try:
+                        data = conn.recv(4096)
+                    except socket.timeout:
+                        return b""
+                    except OSError:
+                        return None
+                    return data or None
+
+                self._exchange(read, conn.sendall)
+
+    def close(self):
+        self._listener.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OE10-104 device simulator")
+    parser.add_argument("--tcp", type=int, metavar="PORT",
+                        help="serve on socket://localhost:PORT instead of a pty")
+    parser.add_argument("--address", type=lambda v: int(v, 0), default=PERIPHERAL_ID)
+    parser.add_argument("--units", type=int, default=1,
+                        help="simulate this many units on consecutive addresses")
+    parser.add_argument("--baud", type=int, default=9600)
+    parser.add_argument("--turnaround", type=float, default=0.005, help="seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    for name in ("drop-reply", "drop-byte", "nak", "corrupt", "slow"):
+        parser.add_argument(f"--{name}", type=float, default=0.0, metavar="RATE")
+    parser.add_argument("--slow-turnaround", type=float, default=0.5, help="seconds")
+    args = parser.parse_args()
+
+    faults = Faults(args.drop_reply, args.drop_byte, args.nak, args.corrupt, args.slow,
+                    args.slow_turnaround)
+    devices = [OE10Device(address=args.address + i) for i in range(args.units)]
+    options = dict(devices=devices, baudrate=args.baud,
+                   turnaround=args.turnaround, faults=faults, seed=args.seed)
+    if args.tcp is not None:
+        server = SocketSimulator(port=args.tcp, **options)
+        print(f"Simulated {args.units} OE10 unit(s) on {server.url}")
+    else:
+        server = PtySimulator(**options)
+        print(f"Simulated {args.units} OE10 unit(s) on {server.port}")
+
+    server.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print(f"\nStopped, {server.stats}")
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,429 @@
+"""Scan patterns and waypoint lists planned ahead and run without an operator
+
+A pattern (raster, spiral or waypoint list) is turned into waypoints, and
+plan() turns those into steps with every command and its timing decided up
+front. Each move gets DS/TA speeds that make both axes arrive together, so
+the head travels straight lines in pan/tilt space. Speed commands are only
+included when the speed changes. TrajectoryRunner sends the commands of a
+step as one batch on the I/O thread (OE10Protocol.send_batch), waits for the
+planned arrival and confirms it with one status read before the dwell.
+"""
+import logging
+import math
+import threading
+import time
+from collections import namedtuple
+
+import oe10_motion
+from oe10_calibration import MAX_SPEED, SpeedTable
+from oe10_estimator import DEFAULT_PAN_RATE, DEFAULT_TILT_RATE
+
+logger = logging.getLogger(__name__)
+
+# Seconds one command transaction takes, about 45 ms at 9600 baud
+COMMAND_TIME = 0.05
+
+# Seconds between AS reads while confirming an arrival; the first read is
+# timed to the planned arrival, so later ones are only for late moves
+POLL_INTERVAL = 0.25
+
+# Pan travels 0-359 without wrapping, a move from 350 to 10 crosses 340 degrees
+PAN_MIN = 0
+PAN_MAX = 359
+
+Waypoint = namedtuple('Waypoint', ['pan', 'tilt', 'dwell'], defaults=(None, None, 0.0))
+
+# commands: ((command, args), ...) sent as one batch; start is the planned
+# offset from the beginning of the run, move_time the planned travel time
+Step = namedtuple('Step', ['index', 'commands', 'pan', 'tilt', 'start', 'move_time', 'dwell'])
+
+# restore: commands putting the speeds back to their values before the run
+Plan = namedtuple('Plan', ['steps', 'duration', 'restore'])
+
+
+class TrajectoryBusy(RuntimeError):
+    """A run is already in progress"""
+
+
+class PositionUnknown(RuntimeError):
+    """The current position could not be read, so no run can be planned"""
+
+
+def _spaced(start, end, count):
+    if count == 1:
+        return [float(start)]
+    return [start + (end - start) * i / (count - 1) for i in range(count)]
+
+
+def _clamp_pan(pan):
+    return max(PAN_MIN, min(PAN_MAX, pan))
+
+
+def raster(pan_start, pan_end, tilt_start, tilt_end, rows, columns=None, dwell=0.0):
+    """Serpentine raster over a pan/tilt window
+
+    Args:
+        pan_start (float): Pan edge the first row starts at
+        pan_end (float): Opposite pan edge
+        tilt_start (float): Tilt of the first row
+        tilt_end (float): Tilt of the last row
+        rows (int): Number of rows
+        columns (int): Stops per row for step-and-stare, None sweeps each
+            row from edge to edge in one move
+        dwell (float): Seconds to hold at every stop
+
+    Returns:
+        list: Waypoints
+    """
+    if rows < 1 or (columns is not None and columns < 1):
+        raise ValueError("A raster needs at least one row and column")
+    pans = _spaced(pan_start, pan_end, columns or 2)
+    waypoints = []
+    for row, tilt in enumerate(_spaced(tilt_start, tilt_end, rows)):
+        for pan in (pans if row % 2 == 0 else reversed(pans)):
+            waypoints.append(Waypoint(pan, tilt, dwell))
+    return waypoints
+
+
+def spiral(pan, tilt, radius, turns=3.0, points_per_turn=12, dwell=0.0):
+    """Archimedean spiral outward from a centre point
+
+    Pan does not wrap, points past either end of the pan travel are
+    clamped to it, as plan() does.
+
+    Args:
+        pan (float): Pan of the centre
+        tilt (float): Tilt of the centre
+        radius (float): Degrees from the centre at the last point
+        turns (float): Number of revolutions
+        points_per_turn (int): Waypoints per revolution
+        dwell (float): Seconds to hold at every point
+
+    Returns:
+        list: Waypoints
+    """
+    if points_per_turn < 1 or turns <= 0:
+        raise ValueError("A spiral needs a positive number of turns and points")
+    count = max(1, int(round(turns * points_per_turn)))
+    waypoints = []
+    for i in range(count + 1):
+        angle = 2 * math.pi * i / points_per_turn
+        distance = radius * i / count
+        waypoints.append(Waypoint(_clamp_pan(pan + distance * math.cos(angle)),
+                                  max(0.0, tilt + distance * math.sin(angle)), dwell))
+    return waypoints
+
+
+def waypoint_list(points):
+    """Waypoints from dicts ({"pan", "tilt", "dwell"}) or (pan, tilt[, dwell]) sequences"""
+    waypoints = []
+    for point in points:
+        if isinstance(point, dict):
+            waypoint = Waypoint(point.get("pan"), point.get("tilt"), float(point.get("dwell", 0.0)))
+        else:
+            waypoint = Waypoint(*point)
+        if waypoint.pan is None and waypoint.tilt is None:
+            raise ValueError(f"Waypoint without a position: {point!r}")
+        waypoints.append(waypoint)
+    return waypoints
+
+
+def build_pattern(spec):
+    """Waypoints from a JSON pattern description
+
+    Examples:
+        {"pattern": "raster", "pan": [60, 120], "tilt": [10, 40], "rows": 4}
+        {"pattern": "spiral", "pan": 90, "tilt": 30, "radius": 15, "turns": 2}
+        {"pattern": "waypoints", "points": [{"pan": 10, "tilt": 20, "dwell": 2}]}
+    """
+    kind = spec.get("pattern")
+    dwell = float(spec.get("dwell", 0.0))
+    if kind == "raster":
+        (pan_start, pan_end), (tilt_start, tilt_end) = spec["pan"], spec["tilt"]
+        columns = spec.get("columns")
+        return raster(float(pan_start), float(pan_end), float(tilt_start), float(tilt_end),
+                      int(spec["rows"]), int(columns) if columns else None, dwell)
+    if kind == "spiral":
+        return spiral(float(spec["pan"]), float(spec["tilt"]), float(spec["radius"]),
+                      float(spec.get("turns", 3.0)), int(spec.get("points_per_turn", 12)), dwell)
+    if kind == "waypoints":
+        return waypoint_list(spec["points"])
+    raise ValueError(f"Unknown pattern {kind!r}")
+
+
+def plan(waypoints, pan, tilt, pan_speed=None, tilt_speed=None, speed=MAX_SPEED,
+         pan_rate=DEFAULT_PAN_RATE, tilt_rate=DEFAULT_TILT_RATE, command_time=COMMAND_TIME,
+         table=None):
+    """Plan commands and timing for a list of waypoints
+
+    Args:
+        waypoints (list): Waypoints, an axis left at None keeps its position
+        pan (float): Pan position at the start
+        tilt (float): Tilt position at the start
+        pan_speed (int): DS speed at the start, None if unknown
+        tilt_speed (int): TA speed at the start, None if unknown
+        speed (int): Highest speed to use, 1-100
+        pan_rate (float): Pan degrees per second at speed 0x64
+        tilt_rate (float): Tilt degrees per second at speed 0x64
+        command_time (float): Seconds per command transaction
+        table (SpeedTable): Calibrated rates (see oe10_calibration), replaces
+            pan_rate and tilt_rate
+
+    Returns:
+        Plan: Steps, planned duration in seconds and the restore commands
+    """
+    speed = max(1, min(MAX_SPEED, int(speed)))
+    table = table or SpeedTable.nominal(pan_rate, tilt_rate)
+    current_pan, current_tilt = pan_speed, tilt_speed
+    pan, tilt = int(round(pan)), int(round(tilt))
+    steps = []
+    elapsed = 0.0
+    for index, waypoint in enumerate(waypoints):
+        target_pan = pan if waypoint.pan is None else _clamp_pan(int(round(waypoint.pan)))
+        target_tilt = tilt if waypoint.tilt is None else int(round(waypoint.tilt))
+        pan_distance = abs(target_pan - pan)
+        tilt_distance = abs(target_tilt - tilt)
+
+        commands = []
+        move_time = 0.0
+        if pan_distance or tilt_distance:
+            # The slower axis at full speed sets the time, the other one is
+            # slowed down to arrive with it
+            duration = max(table.move_time("pan", pan_distance, speed),
+                           table.move_time("tilt", tilt_distance, speed))
+            if pan_distance:
+                wanted = table.speed_for("pan", pan_distance, duration, speed)
+                if wanted != current_pan:
+                    commands.append(("DS", (wanted,)))
+                    current_pan = wanted
+                move_time = table.move_time("pan", pan_distance, current_pan)
+            if tilt_distance:
+                wanted = table.speed_for("tilt", tilt_distance, duration, speed)
+                if wanted != current_tilt:
+                    commands.append(("TA", (wanted,)))
+                    current_tilt = wanted
+                move_time = max(move_time, table.move_time("tilt", tilt_distance, current_tilt))
+            if pan_distance and tilt_distance:
+                commands.append(("GL", (target_pan, target_tilt)))
+            elif pan_distance:
+                commands.append(("PP", (target_pan,)))
+            else:
+                commands.append(("TP", (target_tilt,)))
+
+        steps.append(Step(index, tuple(commands), target_pan, target_tilt, elapsed, move_time,
+                          float(waypoint.dwell)))
+        elapsed += len(commands) * command_time + move_time + waypoint.dwell
+        pan, tilt = target_pan, target_tilt
+
+    restore = []
+    if pan_speed is not None and current_pan != pan_speed:
+        restore.append(("DS", (pan_speed,)))
+    if tilt_speed is not None and current_tilt != tilt_speed:
+        restore.append(("TA", (tilt_speed,)))
+    return Plan(tuple(steps), elapsed, tuple(restore))
+
+
+class TrajectoryRunner:
+    """Runs one plan at a time in a background thread
+
+    Commands go through `device` (e.g. a scheduler proxy, so they run on
+    the I/O thread); between steps the thread only sleeps, so status polls
+    and stops are never held up. abort() ends the run and stops the head on
+    `stop_device`.
+    """
+
+    def __init__(self, device, stop_device=None, read_position=None, tolerance=1.0,
+                 pan_rate=DEFAULT_PAN_RATE, tilt_rate=DEFAULT_TILT_RATE,
+                 command_time=COMMAND_TIME, on_command=None, table=None,
+                 poll_interval=POLL_INTERVAL):
+        """Create a runner
+
+        Args:
+            device: OE10Protocol or a proxy with the same methods
+            stop_device: Same as device, used to stop (e.g. a proxy on the
+                scheduler's stop lane), defaults to device
+            read_position (callable): Returns an AS status dict, defaults
+                to device.get_pan_tilt_status
+            tolerance (float): Degrees from a waypoint that count as arrived
+            pan_rate (float): Pan degrees per second at speed 0x64
+            tilt_rate (float): Tilt degrees per second at speed 0x64
+            command_time (float): Seconds per command transaction
+            on_command (callable): Called after every batch of commands,
+                e.g. StatusPoller.invalidate
+            table (SpeedTable): Calibrated rates, replaces pan_rate and tilt_rate
+            poll_interval (float): Seconds between status reads when a move
+                arrives later than planned
+        """
+        self.device = device
+        self.stop_device = stop_device or device
+        self.read_position = read_position or device.get_pan_tilt_status
+        self.tolerance = tolerance
+        self.pan_rate = pan_rate
+        self.tilt_rate = tilt_rate
+        self.command_time = command_time
+        self.on_command = on_command
+        self.table = table
+        self.poll_interval = poll_interval
+
+        self.plan = None
+        self._state = "idle"
+        self._step = 0
+        self._started = None
+        self._finished = None
+        self._error = None
+        self._lock = threading.Lock()
+        self._abort = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, waypoints, speed=MAX_SPEED):
+        """Plan from the current position and start running
+
+        Args:
+            waypoints (list): Waypoints, see raster(), spiral(), build_pattern()
+            speed (int): Highest speed to use, 1-100
+
+        Returns:
+            Plan: The plan being run
+
+        Raises:
+            TrajectoryBusy: A run is in progress
+            PositionUnknown: No AS reply, or one without a position
+        """
+        with self._lock:
+            if self.running:
+                raise TrajectoryBusy("A trajectory is already running")
+            status = self.read_position()
+            if (status is None or status.get("pan_position") is None
+                    or status.get("tilt_position") is None):
+                raise PositionUnknown("Could not read the current position")
+            self.plan = plan(waypoints, status["pan_position"], status["tilt_position"],
+                             status.get("pan_speed"), status.get("tilt_speed"), speed,
+                             self.pan_rate, self.tilt_rate, self.command_time, self.table)
+            self._abort.clear()
+            self._state = "running"
+            self._step = 0
+            self._error = None
+            self._started = time.monotonic()
+            self._finished = None
+            self._thread = threading.Thread(target=self._run, args=(self.plan,),
+                                            name="oe10-trajectory", daemon=True)
+            self._thread.start()
+        logger.info(f"Trajectory started: {len(self.plan.steps)} steps, "
+                    f"{self.plan.duration:.1f}s planned")
+        return self.plan
+
+    def abort(self, stop=True):
+        """End the run, and stop the head unless `stop` is False
+
+        Returns:
+            bool: True if a run was in progress
+        """
+        was_running = self.running
+        self._abort.set()
+        if stop and was_running:
+            try:
+                self.stop_device.stop()
+            except Exception as e:
+                logger.error(f"Stop after trajectory abort failed: {e}")
+        return was_running
+
+    def wait(self, timeout=None):
+        """Wait for the run to end, returns False on timeout"""
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+            return not thread.is_alive()
+        return True
+
+    def progress(self):
+        """State of the current or last run"""
+        with self._lock:
+            plan_ = self.plan
+            state = self._state
+            index = self._step
+            error = self._error
+            started = self._started
+            finished = self._finished
+        if plan_ is None:
+            return {"state": state}
+        steps = plan_.steps
+        elapsed = (finished or time.monotonic()) - started
+        result = {
+            "state": state,
+            "step": min(index, len(steps)),
+            "steps": len(steps),
+            "elapsed": round(elapsed, 3),
+            "planned_duration": round(plan_.duration, 3),
+            "error": error,
+        }
+        if state == "running" and index < len(steps):
+            step = steps[index]
+            step_end = steps[index + 1].start if index + 1 < len(steps) else plan_.duration
+            result["target"] = {"pan": step.pan, "tilt": step.tilt}
+            # Seconds past the planned end of the current step
+            result["late"] = round(max(0.0, elapsed - step_end), 3)
+            result["remaining"] = round(max(0.0, plan_.duration - elapsed), 3)
+        return result
+
+    def _finish(self, state, error=None):
+        with self._lock:
+            self._state = state
+            self._error = error
+            self._finished = time.monotonic()
+
+    def _send(self, commands):
+        sent = self.device.send_batch([[command, list(args)] for command, args in commands])
+        if self.on_command:
+            self.on_command()
+        return sent == len(commands)
+
+    def _run(self, plan_):
+        state, error = "done", None
+        try:
+            for step in plan_.steps:
+                with self._lock:
+                    self._step = step.index
+                if self._abort.is_set():
+                    break
+                if step.commands:
+                    if not self._send(step.commands):
+                        state, error = "failed", f"Step {step.index} was rejected"
+                        break
+                    # Sleep through the planned travel, the status read is
+                    # timed to land at the planned arrival
+                    if self._abort.wait(max(0.0, step.move_time - self.command_time)):
+                        break
+                    result = oe10_motion.wait_for_position(
+                        self.read_position, step.pan, step.tilt, self.tolerance,
+                        timeout=step.move_time + 5.0, poll_interval=self.poll_interval,
+                        cancelled=self._abort.is_set)
+                    if result.reason == "cancelled":
+                        break
+                    if not result.arrived:
+                        state = "failed"
+                        error = f"Step {step.index} {result.reason} at {result.pan}/{result.tilt}"
+                        break
+                if step.dwell and self._abort.wait(step.dwell):
+                    break
+            else:
+                with self._lock:
+                    self._step = len(plan_.steps)
+            if self._abort.is_set():
+                state = "aborted"
+            elif state == "failed":
+                self.stop_device.stop()
+        except Exception as e:
+            state, error = "failed", str(e)
+            logger.error(f"Trajectory failed: {e}")
+        finally:
+            if plan_.restore:
+                try:
+                    self._send(plan_.restore)
+                except Exception as e:
+                    logger.warning(f"Could not restore the axis speeds: {e}")
+            self._finish(state, error)
+            logger.info(f"Trajectory {state}" + (f": {error}" if error else ""))
@@ -0,0 +1,412 @@
+import select
+import threading
+import time
+from collections import deque, namedtuple
+
+import oe10_metrics
+from oe10_codec import NAK_TIMED_OUT
+from oe10_journal import RX, TX
+from oe10_parser import HEADER_SIZE, FrameParser
+
+try:
+    import termios
+    # flush() and reset_input_buffer() raise termios.error, not OSError
+    # (SerialException is one), when the adapter is gone
+    PORT_ERRORS = (OSError, termios.error)
+except ImportError:  # Windows
+    PORT_ERRORS = (OSError,)
+
+
+# NAK error bits that describe a transient condition, a NAK carrying any
+# other bit (command not available or not recognised, another controller)
+# is final
+RETRY_NAK_BITS = NAK_TIMED_OUT
+
+
+class RetryPolicy(namedtuple('RetryPolicy', ['attempts', 'backoff', 'max_backoff'])):
+    """Bounded retransmission policy for FrameTransport.request()
+
+    Attributes:
+        attempts (int): Total sends per request, including the first
+        backoff (float): Seconds before resending after a damaged reply or
+            a "device timed out" NAK, doubled for every further one. After
+            a lost reply the expired deadline already spaced the sends.
+        max_backoff (float): Upper limit for the delay between sends
+    """
+    __slots__ = ()
+
+    def delay(self, retry):
+        """Seconds to wait before retransmission number `retry` (1 based)"""
+        return min(self.backoff * 2 ** (retry - 1), self.max_backoff)
+
+
+DEFAULT_RETRY = RetryPolicy(attempts=3, backoff=0.05, max_backoff=0.5)
+
+
+class LinkDown(ConnectionError):
+    """The port is closed because the link is down (see oe10_link)
+
+    Raised before any I/O, so callers fail at once instead of waiting for
+    reply timeouts while the device is away.
+    """
+
+
+class RttEstimator:
+    """Reply deadlines from measured round-trip times, as TCP does (RFC 6298)
+
+    Keeps a smoothed RTT and its mean deviation per command and unit, and
+    per unit for commands not seen yet. The deadline is the smoothed RTT
+    plus four deviations, so a healthy link waits tens of milliseconds for
+    a lost reply instead of the full timeout. Every expired deadline
+    doubles it until a reply to a first send is measured again (samples
+    from retransmitted requests are ambiguous and skipped).
+    """
+
+    def __init__(self, initial=1.0, min_timeout=0.05, max_timeout=None, granularity=0.02,
+                 alpha=0.125, beta=0.25):
+        """Create an estimator
+
+        Args:
+            initial (float): Deadline before the first measurement
+            min_timeout (float): Shortest deadline handed out
+            max_timeout (float): Longest deadline, defaults to initial
+            granularity (float): Smallest margin above the smoothed RTT,
+                covers scheduler and USB adapter latency
+            alpha (float): Gain of the smoothed RTT
+            beta (float): Gain of the deviation
+        """
+        self.initial = initial
+        self.min_timeout = min_timeout
+        self.max_timeout = initial if max_timeout is None else max_timeout
+        self.granularity = granularity
+        self.alpha = alpha
+        self.beta = beta
+        self._entries = {}  # (command or None, address) -> [srtt, rttvar, backoff]
+
+    def _entry(self, command, address):
+        entry = self._entries.get((command, address))
+        if entry is None:
+            entry = self._entries.get((None, address))
+        return entry
+
+    def timeout(self, command, address):
+        """Deadline in seconds for a reply to `command` from `address`"""
+        entry = self._entry(command, address)
+        if entry is None:
+            return self.initial
+        srtt, rttvar, backoff = entry
+        timeout = max(self.min_timeout, srtt + max(4 * rttvar, self.granularity)) * backoff
+        return min(timeout, self.max_timeout)
+
+    def observe(self, command, address, rtt):
+        """Measured time from sending a request to the end of its reply"""
+        for key in ((command, address), (None, address)):
+            entry = self._entries.get(key)
+            if entry is None:
+                self._entries[key] = [rtt, rtt / 2, 1]
+            else:
+                entry[1] += self.beta * (abs(entry[0] - rtt) - entry[1])
+                entry[0] += self.alpha * (rtt - entry[0])
+                entry[2] = 1
+        oe10_metrics.REPLY_TIMEOUT.set(self.timeout(command, address), command,
+                                       oe10_metrics.address_label(address))
+
+    def expired(self, command, address):
+        """A deadline passed without a reply, back off"""
+        entry = self._entries.get((command, address))
+        if entry is None:
+            fallback = self._entries.get((None, address))
+            if fallback is None:
+                return
+            entry = self._entries[(command, address)] = list(fallback)
+        entry[2] = min(entry[2] * 2, 64)
+
+    def stats(self):
+        """Smoothed RTT, deviation and current deadline in ms per command"""
+        result = {}
+        for (command, address), (srtt, rttvar, _) in sorted(
+                self._entries.items(), key=lambda item: (item[0][1], item[0][0] or "")):
+            result[f"{command or '*'}@{address:#04x}"] = {
+                "srtt_ms": round(srtt * 1000, 3),
+                "rttvar_ms": round(rttvar * 1000, 3),
+                "timeout_ms": round(self.timeout(command, address) * 1000, 3),
+            }
+        return result
+
+
+def _transient_nak(reply):
+    """True if a NAK only reports conditions worth retrying"""
+    code = reply.error_code
+    return bool(code) and not code & ~RETRY_NAK_BITS
+
+
+def _port_fileno(serial_port):
+    """Descriptor of the port for select(), None if it has none"""
+    try:
+        return serial_port.fileno()
+    except (AttributeError, NotImplementedError, OSError):
+        return None
+
+
+def _request_command(frame):
+    """Command of an encoded request, it follows the header"""
+    return bytes(frame[HEADER_SIZE:HEADER_SIZE + 2]).decode('latin-1')
+
+
+class FrameTransport:
+    """Request/response transport that reads OE10 frames by their delimiters
+
+    The OE10 never terminates a frame with a newline, so line based reads
+    always run into the port timeout. This transport instead waits on the
+    port's descriptor with select() until bytes arrive, reads what is there
+    and uses the length byte in the header to know when a frame is complete.
+    A transaction therefore returns as soon as the last byte of the reply is
+    on the wire. The port timeout is never changed, setting it reconfigures
+    the port with a system call.
+    """
+
+    def __init__(self, serial_port, timeout=1.0, journal=None, adaptive=True):
+        """Wrap an open pyserial port
+
+        Args:
+            serial_port: Open pyserial port (or compatible object)
+            timeout (float): Default seconds to wait for a reply frame
+            journal (Journal): Records all bytes written and read
+                (see oe10_journal)
+            adaptive (bool): Let request() derive its deadlines from
+                measured round-trip times, `timeout` becomes the upper limit
+        """
+        self.serial = serial_port
+        self._fileno = _port_fileno(serial_port)
+        self.timeout = timeout
+        self.journal = journal
+        self.rtt = RttEstimator(timeout) if adaptive else None
+        self.parser = FrameParser()
+        self._frames = deque()
+        # Held for a whole transaction by everyone sharing the port
+        self.lock = threading.RLock()
+        self.misrouted = 0  # Replies dropped because they came from another unit
+        self.retransmits = 0
+        self.failed = 0  # Requests that got no valid reply after all attempts
+
+        # Link health, watched by oe10_link.SerialLink
+        self.connected = True
+        self.failure_streak = 0  # Requests in a row without any reply
+        self.io_errors = 0       # Port errors (e.g. the adapter was unplugged)
+        self.last_error = None
+
+    def _io_failed(self, error):
+        self.io_errors += 1
+        self.last_error = error
+
+    def write_frame(self, frame):
+        """Write one or more encoded frames to the port"""
+        if not self.connected:
+            raise LinkDown("Serial link is down")
+        try:
+            self.serial.write(frame)
+            self.serial.flush()
+        except PORT_ERRORS as e:
+            self._io_failed(e)
+            raise
+        if self.journal is not None:
+            self.journal.record(TX, frame)
+
+    def read_frame(self, timeout=None):
+        """Read the next complete frame
+
+        Args:
+            timeout (float): Seconds to wait, defaults to the transport timeout
+
+        Returns:
+            Frame: Parsed frame (see oe10_parser), or None on timeout
+        """
+        if timeout is None:
+            timeout = self.timeout
+        deadline = time.monotonic() + timeout
+
+        while not self._frames:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+
+            try:
+                if self._fileno is None:
+                    # No descriptor to wait on (e.g. loop://), block in read
+                    self.serial.timeout = remaining
+                    chunk = self.serial.read(max(self.parser.bytes_missing(),
+                                                 self.serial.in_waiting))
+                else:
+                    waiting = self.serial.in_waiting
+                    if not waiting:
+                        if not select.select([self._fileno], [], [], remaining)[0]:
+                            continue
+                        waiting = self.serial.in_waiting
+                    # Readable without data raises in read(), e.g. on hang-up
+                    chunk = self.serial.read(waiting or 1)
+            except PORT_ERRORS as e:
+                self._io_failed(e)
+                raise
+            if chunk:
+                if self.journal is not None:
+                    self.journal.record(RX, chunk)
+                self._frames.extend(self.parser.feed(chunk))
+        frame = self._frames.popleft()
+        if not frame.checksum_ok:
+            oe10_metrics.CHECKSUM_ERRORS.inc(oe10_metrics.address_label(frame.from_addr))
+        return frame
+
+    def transact(self, frame, replies=1, timeout=None, source=None):
+        """Write a frame and wait for its reply
+
+        Args:
+            frame (bytes): Encoded request (may contain several frames)
+            replies (int): Number of reply frames the request produces
+            timeout (float): Seconds to wait for each reply
+            source (int): Only accept replies whose "from" field matches,
+                others are dropped (e.g. late replies from another unit)
+
+        Returns:
+            Frame: The last reply frame received, or None on timeout
+        """
+        if timeout is None:
+            timeout = self.timeout
+        with self.lock:
+            self.discard_input()
+            started = time.monotonic()
+            self.write_frame(frame)
+
+            response = None
+            for _ in range(replies):
+                deadline = time.monotonic() + timeout
+                while True:
+                    reply = self.read_frame(max(0.0, deadline - time.monotonic()))
+                    if reply is None or source is None or reply.from_addr == source:
+                        break
+                    self.misrouted += 1
+                    oe10_metrics.MISROUTED.inc()
+                if reply is None:
+                    break
+                response = reply
+            self.failure_streak = 0 if response is not None else self.failure_streak + 1
+            oe10_metrics.observe_command(
+                _request_command(frame), frame[1],
+                response if response is not None and response.checksum_ok else None,
+                time.monotonic() - started)
+            return response
+
+    def request(self, frame, command, timeout=None, source=None, retry=DEFAULT_RETRY):
+        """Send a request once and retransmit only when its reply is lost
+
+        The reply must echo the command (and come from `source` if given),
+        anything else on the line is skipped. A timeout, a reply with a bad
+        checksum or a NAK saying the device timed out is retried according
+        to `retry`. Any other NAK is a final answer and returned at once.
+
+        Args:
+            frame (bytes): Encoded request
+            command (str): Command the reply has to echo
+            timeout (float): Seconds to wait for the reply per attempt,
+                defaults to the adaptive deadline (or the transport timeout)
+            source (int): Expected "from" address of the reply
+            retry (RetryPolicy): Retransmission policy
+
+        Returns:
+            Frame: The reply (the last NAK if only NAKs came back), or None
+            if every attempt failed
+        """
+        address = frame[1]
+        rtt = self.rtt if timeout is None else None
+        with self.lock:
+            started = time.monotonic()
+            answer = None
+            lost = False
+            attempts = max(1, retry.attempts)
+            for attempt in range(attempts):
+                if attempt:
+                    self.retransmits += 1
+                    oe10_metrics.RETRANSMITS.inc(command, oe10_metrics.address_label(address))
+                    if not lost:
+                        time.sleep(retry.delay(attempt))
+                self.discard_input()
+                sent = time.monotonic()
+                self.write_frame(frame)
+
+                if rtt is not None:
+                    wait = rtt.timeout(command, address)
+                    if attempt == attempts - 1:
+                        # Last chance, a slow reply must not turn into a failure
+                        wait = max(wait, self.timeout)
+                else:
+                    wait = self.timeout if timeout is None else timeout
+                deadline = time.monotonic() + wait
+                while True:
+                    reply = self.read_frame(max(0.0, deadline - time.monotonic()))
+                    if reply is None or not reply.checksum_ok:
+                        break  # Lost or damaged, retransmit
+                    if source is not None and reply.from_addr != source:
+                        self.misrouted += 1
+                        oe10_metrics.MISROUTED.inc()
+                        continue
+                    if reply.command != command:
+                        continue  # Late reply to an earlier request
+                    break
+                lost = reply is None
+                if lost:
+                    if rtt is not None:
+                        rtt.expired(command, address)
+                    continue
+                if not reply.checksum_ok:
+                    continue
+                if rtt is not None and not attempt:
+                    rtt.observe(command, address, time.monotonic() - sent)
+                answer = reply
+                if not reply.is_nak or not _transient_nak(reply):
+                    break
+            else:
+                if answer is None:
+                    self.failed += 1
+            self.failure_streak = 0 if answer is not None else self.failure_streak + 1
+            oe10_metrics.observe_command(command, address, answer, time.monotonic() - started)
+            return answer
+
+    def round_trip_times(self):
+        """Adaptive deadline state, see RttEstimator.stats()"""
+        return self.rtt.stats() if self.rtt is not None else {}
+
+    def discard_input(self):
+        """Drop stale bytes so late replies cannot pair with a new request"""
+        if not self.connected:
+            raise LinkDown("Serial link is down")
+        self._frames.clear()
+        self.parser.reset()
+        try:
+            self.serial.reset_input_buffer()
+        except PORT_ERRORS as e:
+            self._io_failed(e)
+            raise
+
+    def disconnect(self):
+        """Close the port and fail every request with LinkDown until replace_port()"""
+        with self.lock:
+            self.connected = False
+            try:
+                self.serial.close()
+            except PORT_ERRORS:
+                pass  # Already gone with the adapter
+
+    def replace_port(self, serial_port):
+        """Continue on a newly opened port after a reconnect
+
+        Deadlines start from scratch, the ones learned before may have
+        been stretched by the outage.
+        """
+        with self.lock:
+            self.serial = serial_port
+            self._fileno = _port_fileno(serial_port)
+            self._frames.clear()
+            self.parser.reset()
+            if self.rtt is not None:
+                self.rtt = RttEstimator(self.timeout)
+            self.failure_streak = 0
+            self.connected = True
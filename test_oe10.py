@@ -3,41 +3,17 @@ import time
 import binascii
 from struct import unpack
 
-# Constants from Packet.hpp
-ACK = 0x06
-NAK = 0x15
-CONTROLLER_ID = 0x01
-PERIPHERAL_ID = 0x03
-
-def compute_checksum(data):
-    """Compute XOR checksum of data"""
-    result = 0
-    for b in data:
-        result ^= b
-    return result
+import oe10_codec
 
-def marshal_checksum(checksum):
-    """Handle special checksum encoding"""
-    if checksum == 0x3A or checksum == 0x3E:  # ':' or '>'
-        return bytes([0x30, 0x30, checksum])  # '00' + checksum
-    else:
-        return bytes([checksum, 0x30, 0x30])  # checksum + '00'
+# Constants from Packet.hpp
+ACK = oe10_codec.ACK
+NAK = oe10_codec.NAK
+CONTROLLER_ID = oe10_codec.CONTROLLER_ID
+PERIPHERAL_ID = oe10_codec.PERIPHERAL_ID
 
 def build_packet(to_addr, from_addr, command, data=b''):
     """Build a packet following the exact protocol"""
-    packet = bytearray([0x3C])  # '<'
-    packet.extend([to_addr, 0x3A, from_addr, 0x3A])
-    packet.append(len(command) + len(data) + 1)
-    packet.append(0x3A)
-    packet.extend(command)
-    packet.append(0x3A)
-    if data:
-        packet.extend(data)
-        packet.append(0x3A)
-    checksum = compute_checksum(packet[1:])
-    packet.extend(marshal_checksum(checksum))
-    packet.append(0x3E)
-    return packet
+    return oe10_codec.encode_raw(command, data, to_addr, from_addr)
 
 def read_response(ser, timeout=1.0):
     """Read and parse a complete response packet"""